@@ -1,80 +1,764 @@
-# This dictionary needs to be accessible by both the task runner and the cancel handler.
-# It will be imported into main.py
-cancelled_tasks = {}
+import concurrent.futures
+import io
+import math
+
+from services import cancellation, shared_state
+
+# Import the loaded config for analysis tuning knobs
+try:
+    from config import CONFIG
+except ImportError:
+    print("ERROR: Could not import CONFIG from config.py in background_tasks.py.")
+    CONFIG = {'analysis': {}}  # Fallback
+
+ANALYSIS_CONFIG = CONFIG.get('analysis', {}) or {}
+MAX_CONCURRENT_FILES = max(1, int(ANALYSIS_CONFIG.get('max_concurrent_files', 4)))
+MAX_CONCURRENT_FILES_LIMIT = max(1, int(ANALYSIS_CONFIG.get('max_concurrent_files_limit', 16)))
+STREAM_TOKENS = bool(ANALYSIS_CONFIG.get('stream_tokens', True))
+# 'async' routes LLM calls through the rate-limited asyncio engine, 'sync' calls the provider clients directly
+LLM_ENGINE = ANALYSIS_CONFIG.get('llm_engine', 'async')
+
+# Default per-task budgets (0 = unlimited); /api/process can set token_budget / cost_budget per task
+TOKEN_BUDGET = int(ANALYSIS_CONFIG.get('token_budget', 0) or 0)
+COST_BUDGET = float(ANALYSIS_CONFIG.get('cost_budget', 0) or 0)
+
+MAP_REDUCE_CONFIG = ANALYSIS_CONFIG.get('map_reduce', {}) or {}
+# Estimated prompt tokens of file content per map chunk (and of notes per reduce call)
+MAP_REDUCE_CHUNK_TOKENS = max(500, int(MAP_REDUCE_CONFIG.get('chunk_tokens', 3000)))
+# Max partial summaries merged by one reduce call
+MAP_REDUCE_FAN_IN = max(2, int(MAP_REDUCE_CONFIG.get('fan_in', 4)))
+
+# This mapping needs to be accessible by both the task runner and the cancel handler.
+# Flags live in the shared-state backend so a cancel received by any worker reaches the task.
+cancelled_tasks = shared_state.CancellationFlags()
 
 # Import necessary services and libraries within the function or globally if preferred
 # Note: socketio instance needs to be passed in or imported carefully to avoid circular dependencies
 # Passing it in is generally safer.
 
 
-def run_analysis_task(socketio, task_id, analysis_mode, scope, user_prompt, owner, repo, branch, provider_config, model_id):
-    """The actual analysis logic run in a background thread via SocketIO."""
+def resolve_max_concurrency(requested=None):
+    """Clamps a requested per-task file concurrency to the configured bounds."""
+    if requested is None:
+        return min(MAX_CONCURRENT_FILES, MAX_CONCURRENT_FILES_LIMIT)
+    try:
+        requested = int(requested)
+    except (TypeError, ValueError):
+        return min(MAX_CONCURRENT_FILES, MAX_CONCURRENT_FILES_LIMIT)
+    return max(1, min(requested, MAX_CONCURRENT_FILES_LIMIT))
+
+
+def _run_iterative_pool(socketio, task_id, pending, total_files, analyze_file, max_workers, on_result, completed_offset=0, budget=None, cancel_token=None,
+                        progress_extra=None):
+    """
+    Runs analyze_file over the pending (index, file_path) items with at most max_workers
+    files in flight. Results are emitted as they complete (possibly out of scope order);
+    progress is reported as a completed-files count (starting at completed_offset for
+    resumed tasks) so it stays monotonic. on_result is called for each result and returns
+    how many files it stands for (more than one when it was fanned out to duplicates).
+    progress_extra is added to every progress event.
+    No new files are started once the budget (a token_usage.UsageTracker) is exhausted.
+    Workers run with cancel_token bound, so a cancel aborts the files in flight; those
+    are not reported. Results are not kept here; returns the final status.
+    """
+    completed_count = completed_offset
+    pending = list(pending)
+    next_item = 0
+    in_flight = {}  # future -> (index, file_path)
+    status = 'completed'
+
+    print(f"Task {task_id} running iterative pool with {max_workers} workers for {len(pending)} files.")
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"task-{task_id[:8]}",
+                                               initializer=cancellation.set_current, initargs=(cancel_token,)) as executor:
+        while next_item < len(pending) or in_flight:
+            # Top up the pool, but never submit new work once the task is cancelled or out of budget
+            budget_exhausted = budget is not None and budget.exhausted()
+            while next_item < len(pending) and len(in_flight) < max_workers and not cancelled_tasks.get(task_id) and not budget_exhausted:
+                index, file_path = pending[next_item]
+                in_flight[executor.submit(analyze_file, index, file_path)] = (index, file_path)
+                next_item += 1
+
+            if cancelled_tasks.get(task_id):
+                status = 'cancelled'
+                if not in_flight:
+                    break
+            elif budget_exhausted and next_item < len(pending):
+                status = 'budget_exceeded'
+                if not in_flight:
+                    break
+
+            done, _ = concurrent.futures.wait(in_flight, timeout=0.5, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                index, file_path = in_flight.pop(future)
+                try:
+                    partial_result = future.result()
+                except cancellation.TaskCancelled:
+                    status = 'cancelled'  # Aborted mid-file; left for a resume to redo
+                    continue
+                except Exception as e:
+                    print(f"Task {task_id} worker FAILED for {file_path}: {e}")
+                    partial_result = {'path': file_path, 'index': index, 'error': f'Unexpected error during processing: {e}'}
+
+                print(f"Task {task_id} emitting partial result for: {file_path} ({completed_count + 1}/{total_files})")
+                socketio.emit('partial_result', partial_result, room=task_id)
+                completed_count += on_result(partial_result)
+                progress_data = {
+                    'current_file': file_path,
+                    'current_index': completed_count - 1,
+                    'total_files': total_files,
+                    'completed_files': completed_count,
+                    'in_flight': len(in_flight),
+                    **(progress_extra or {}),
+                }
+                socketio.emit('progress_update', progress_data, room=task_id)
+
+    if status == 'cancelled':
+        print(f"Task {task_id} cancelled by user request after {completed_count}/{total_files} files.")
+    elif status == 'budget_exceeded':
+        print(f"Task {task_id} stopped after {completed_count}/{total_files} files: budget exhausted.")
+    return status
+
+
+def _split_into_chunks(documents, chunk_tokens, chars_per_token):
+    """
+    Packs (path, content) documents into chunks of at most chunk_tokens estimated tokens.
+    Documents larger than one chunk are split into numbered parts. Nothing is dropped.
+    """
+    chunk_chars = chunk_tokens * chars_per_token
+    pieces = []
+    for path, content in documents:
+        if content is None:
+            pieces.append(f"\n\n--- Error fetching content for {path} ---\n\n")
+            continue
+        header = f"\n\n--- Content from {path} ---\n"
+        body_chars = max(1, chunk_chars - len(header) - 32)
+        if len(header) + len(content) <= chunk_chars:
+            pieces.append(header + content)
+            continue
+        parts = [content[i:i + body_chars] for i in range(0, len(content), body_chars)]
+        for n, part in enumerate(parts, start=1):
+            pieces.append(f"\n\n--- Content from {path} (part {n}/{len(parts)}) ---\n{part}")
+
+    chunks, current, current_len = [], [], 0
+    for piece in pieces:
+        if current and current_len + len(piece) > chunk_chars:
+            chunks.append(''.join(current))
+            current, current_len = [], 0
+        current.append(piece)
+        current_len += len(piece)
+    if current:
+        chunks.append(''.join(current))
+    return chunks
+
+
+def _combined_candidates(scope, sizes, budget_tokens, chars_per_token):
+    """
+    The leading part of scope that can plausibly fit a combined prompt of budget_tokens,
+    judged from the tree's blob sizes (with slack for tokenizer variance). Only these are
+    worth bulk-fetching; anything the assembler still wants later is fetched per file.
+    """
+    budget_chars = budget_tokens * chars_per_token * 3 // 2
+    used_chars = 0
+    for position, path in enumerate(scope):
+        if used_chars >= budget_chars:
+            return scope[:position]
+        used_chars += sizes.get(path, 0) + len(path) + 24  # Unknown sizes never stop the walk
+    return list(scope)
+
+
+def _assemble_combined(scope, fetch_file, budget_tokens, model_id, cancel_token=None):
+    """
+    Streams the scope's files, in order, into one prompt body of at most budget_tokens
+    tokens. Each file is fetched only if there is budget left for it, so fetching stops as
+    soon as the prompt is full. Returns (content, report) where report lists the
+    'included_files' (whole), 'partial_files' (truncated), 'skipped_files' (never fetched)
+    and 'missing_files' (fetch failed).
+    """
+    from services import token_usage
+
+    buffer = io.StringIO()  # Appends in amortised O(1), unlike repeated str +=
+    remaining = budget_tokens
+    report = {'included_files': [], 'partial_files': [], 'skipped_files': [], 'missing_files': []}
+    for position, file_path in enumerate(scope):
+        if remaining <= 0:
+            report['skipped_files'].extend(scope[position:])
+            break
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()
+        content = fetch_file(file_path)
+        if content is None:
+            report['missing_files'].append(file_path)
+            piece = f"\n\n--- Error fetching content for {file_path} ---\n\n"
+            piece_tokens = token_usage.count_tokens(piece, model_id)
+            if piece_tokens <= remaining:
+                buffer.write(piece)
+                remaining -= piece_tokens
+            continue
+
+        header = f"\n\n--- Content from {file_path} ---\n"
+        piece = header + content
+        piece_tokens = token_usage.count_tokens(piece, model_id)
+        if piece_tokens <= remaining:
+            report['included_files'].append(file_path)
+        else:
+            piece = token_usage.truncate_to_tokens(piece, remaining, model_id)
+            if len(piece) <= len(header):
+                report['skipped_files'].extend(scope[position:])  # Not even the header fits
+                break
+            piece_tokens = remaining
+            report['partial_files'].append(file_path)
+        buffer.write(piece)
+        remaining -= piece_tokens
+    return buffer.getvalue(), report
+
+
+def _group_for_reduce(summaries, chunk_tokens, fan_in, chars_per_token):
+    """Groups summaries for one reduce round: up to fan_in per group and within the token budget, but never fewer than two."""
+    chunk_chars = chunk_tokens * chars_per_token
+    groups, current, current_len = [], [], 0
+    for summary in summaries:
+        if len(current) >= 2 and (len(current) >= fan_in or current_len + len(summary) > chunk_chars):
+            groups.append(current)
+            current, current_len = [], 0
+        current.append(summary)
+        current_len += len(summary)
+    if current:
+        if len(current) == 1 and groups:
+            groups[-1].append(current[0])  # Don't leave a lone summary to be "reduced" by itself
+        else:
+            groups.append(current)
+    return groups
+
+
+def _run_map_reduce(socketio, task_id, scope, user_prompt, fetch_file, complete_cached, max_workers, budget=None, cancel_token=None):
+    """
+    Hierarchical map-reduce over the whole scope: fetch every file, split the content into
+    token-budgeted chunks, summarise chunks in parallel (level 1), then merge the summaries
+    in rounds of up to MAP_REDUCE_FAN_IN until one answer remains. Progress is reported per level.
+    Raises token_usage.BudgetExhausted if the budget (a UsageTracker) runs out part-way, and
+    cancellation.TaskCancelled if cancel_token aborts fetches or LLM calls in flight.
+    Returns (status, response_text or None, info dict).
+    """
+    from services import llm_service, token_usage
+
+    def emit_progress(level, stage, completed, total):
+        socketio.emit('progress_update', {
+            'message': f"Level {level} ({stage}): {completed}/{total} done",
+            'stage': stage, 'level': level, 'completed': completed, 'total': total,
+        }, room=task_id)
+
+    def run_level(level, stage, prompts, final=False):
+        """Runs one level's LLM calls in parallel, preserving order. Returns None if cancelled."""
+        outputs = [None] * len(prompts)
+        emit_progress(level, stage, 0, len(prompts))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"mr-{task_id[:8]}",
+                                                   initializer=cancellation.set_current, initargs=(cancel_token,)) as executor:
+            futures = {}
+            for i, prompt in enumerate(prompts):
+                if cancelled_tasks.get(task_id) or (budget is not None and budget.exhausted()):
+                    break
+                messages = [{"role": "user", "content": prompt}]
+                # Only the final answer is streamed to the client
+                futures[executor.submit(complete_cached, messages, {} if final else None)] = i
+            completed = 0
+            for future in concurrent.futures.as_completed(futures):
+                outputs[futures[future]] = future.result()[0]  # Propagates LLM errors to the task
+                completed += 1
+                emit_progress(level, stage, completed, len(prompts))
+        if cancelled_tasks.get(task_id):
+            return None
+        if None in outputs:
+            raise token_usage.BudgetExhausted(f"Budget exhausted during map-reduce level {level} ({stage}).")
+        return outputs
+
+    socketio.emit('progress_update', {'message': 'Fetching content for map-reduce...', 'stage': 'fetch'}, room=task_id)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"mr-fetch-{task_id[:8]}",
+                                               initializer=cancellation.set_current, initargs=(cancel_token,)) as executor:
+        documents = list(zip(scope, executor.map(fetch_file, scope)))
+    if cancelled_tasks.get(task_id):
+        return 'cancelled', None, {}
+    missing = [path for path, content in documents if content is None]
+
+    chunks = _split_into_chunks(documents, MAP_REDUCE_CHUNK_TOKENS, llm_service.CHARS_PER_TOKEN)
+    info = {'chunks': len(chunks), 'levels': 1, 'files': len(scope), 'missing_files': missing}
+    print(f"Task {task_id} map-reduce: {len(scope)} files -> {len(chunks)} chunks.")
+    file_list = ', '.join(scope)
+
+    if len(chunks) == 1:
+        prompt = f"{user_prompt}\n\nAnalyze the combined content from the following files: {file_list}\n---\n{chunks[0]}\n---"
+        outputs = run_level(1, 'map', [prompt], final=True)
+        return ('cancelled', None, info) if outputs is None else ('completed', outputs[0], info)
+
+    map_prompts = [
+        f"{user_prompt}\n\nThe following is part {i}/{len(chunks)} of a larger set of files. "
+        f"Extract everything in it that is relevant to the request above, as concise notes that will be "
+        f"combined with notes from the other parts. Cite file paths.\n---\n{chunk}\n---"
+        for i, chunk in enumerate(chunks, start=1)
+    ]
+    summaries = run_level(1, 'map', map_prompts)
+    if summaries is None:
+        return 'cancelled', None, info
+
+    level = 1
+    while True:
+        level += 1
+        groups = _group_for_reduce(summaries, MAP_REDUCE_CHUNK_TOKENS, MAP_REDUCE_FAN_IN, llm_service.CHARS_PER_TOKEN)
+        final = len(groups) == 1
+        if final:
+            instruction = (f"The notes below were extracted from all of these files: {file_list}. "
+                           f"Using them, give the complete answer to the request above.")
+        else:
+            instruction = ("The notes below were extracted from different parts of a larger set of files. "
+                           "Merge them into a single set of notes, keeping every detail relevant to the request above.")
+        reduce_prompts = [
+            f"{user_prompt}\n\n{instruction}\n" + ''.join(f"\n--- Notes {n} ---\n{summary}\n" for n, summary in enumerate(group, start=1))
+            for group in groups
+        ]
+        summaries = run_level(level, 'reduce', reduce_prompts, final=final)
+        if summaries is None:
+            info['levels'] = level
+            return 'cancelled', None, info
+        if final:
+            info['levels'] = level
+            return 'completed', summaries[0], info
+
+
+def _safe_store(func, *args):
+    """Calls a task_store / shared_state function without letting storage errors kill the task."""
+    try:
+        return func(*args)
+    except Exception as e:
+        print(f"Warning: Task store call {func.__name__} failed: {e}")
+        return None
+
+
+# run_analysis_task parameters persisted with each task so it can be resumed (provider is stored by id)
+TASK_PARAM_KEYS = ('analysis_mode', 'scope', 'user_prompt', 'owner', 'repo', 'branch', 'model_id', 'max_concurrency', 'stream', 'base_ref', 'previous_task_id',
+                   'token_budget', 'cost_budget')
+# Modes producing one stored result per file
+PER_FILE_MODES = ('iterative', 'incremental')
+
+
+def resume_task(socketio, task_id):
+    """
+    Restarts a stored task from its last checkpoint; finished files are not recomputed.
+    Returns (ok, error_message).
+    """
+    from services import task_store
+
+    task = task_store.get_task(task_id)
+    if not task:
+        return False, f'Task "{task_id}" not found.'
+    if task['status'] not in task_store.RESUMABLE_STATUSES:
+        return False, f'Task "{task_id}" is {task["status"]} and cannot be resumed.'
+    owner = shared_state.get_task_owner(task_id)
+    if owner:
+        return False, f'Task "{task_id}" is still running on worker {owner}.'
+    params = task['params']
+    provider_config = next((p for p in CONFIG.get('llm_providers', {}).get('providers', []) if p.get('id') == params.get('provider_id')), None)
+    if not provider_config or not provider_config.get('enabled', True):
+        return False, f'Provider "{params.get("provider_id")}" is no longer configured or enabled.'
+
+    cancelled_tasks.pop(task_id, None)
+    task_store.set_status(task_id, 'queued')
+    print(f"Resuming task {task_id} ({task_store.count_results(task_id)} results checkpointed).")
+    socketio.start_background_task(
+        target=run_analysis_task,
+        socketio=socketio,
+        task_id=task_id,
+        provider_config=provider_config,
+        resume=True,
+        **{key: params.get(key) for key in TASK_PARAM_KEYS}
+    )
+    return True, None
+
+
+def _group_duplicate_blobs(pending, blob_shas):
+    """
+    Groups pending (index, file_path) items by blob SHA so identical content is analysed
+    once. Returns (unique, duplicates): unique keeps the first item per blob in scope order,
+    duplicates maps a kept item's index to the [(index, file_path)] sharing its content.
+    Files without a known SHA are never grouped.
+    """
+    unique, duplicates, first_by_sha = [], {}, {}
+    for index, file_path in pending:
+        sha = blob_shas.get(file_path)
+        if sha and sha in first_by_sha:
+            duplicates.setdefault(first_by_sha[sha], []).append((index, file_path))
+            continue
+        if sha:
+            first_by_sha[sha] = index
+        unique.append((index, file_path))
+    return unique, duplicates
+
+
+def _carry_over_results(task_id, pending, owner, repo, branch, base_ref, previous_task_id, user_prompt, provider_id, model_id, blob_shas):
+    """
+    For incremental mode: returns previous results (re-indexed to this scope) for pending
+    files unchanged between base_ref and branch. A result recorded with a blob SHA is only
+    reused if the file still has that SHA. Everything else is left to be analysed.
+    """
+    from services import github_service, task_store
+
+    changed_paths = github_service.get_changed_paths(owner, repo, base_ref, branch)
+    if changed_paths is None:
+        print(f"Task {task_id} could not compare '{base_ref}' with '{branch}'; analysing the full scope.")
+        return []
+
+    if previous_task_id:
+        previous_task = _safe_store(task_store.get_task, previous_task_id)
+    else:
+        previous_task = _safe_store(task_store.find_latest_task, lambda params: (
+            params.get('analysis_mode') in PER_FILE_MODES and params.get('owner') == owner and params.get('repo') == repo
+            and params.get('user_prompt') == user_prompt and params.get('provider_id') == provider_id and params.get('model_id') == model_id
+        ), 'completed', task_id)
+    if not previous_task:
+        print(f"Task {task_id} found no previous run to carry results over from; analysing the full scope.")
+        return []
+
+    previous_results = {r['path']: r for r in (_safe_store(task_store.get_results, previous_task['task_id']) or []) if 'error' not in r}
+    carried = []
+    for index, file_path in pending:
+        previous = previous_results.get(file_path)
+        if previous is None or file_path in changed_paths:
+            continue
+        if previous.get('blob_sha') and previous['blob_sha'] != blob_shas.get(file_path):
+            continue
+        carried.append({**previous, 'index': index, 'carried_over': True, 'previous_task_id': previous_task['task_id']})
+    print(f"Task {task_id} incremental vs '{base_ref}': {len(changed_paths)} changed paths in repo, "
+          f"{len(carried)}/{len(pending)} results carried over from task {previous_task['task_id']}.")
+    return carried
+
+
+def estimate_task_usage(analysis_mode, scope, user_prompt, owner, repo, branch, provider_config, model_id, blob_shas=None, blob_sizes=None):
+    """
+    Pre-flight estimate of a task's LLM calls, tokens and cost from the file sizes in the
+    repo tree, before any content is fetched. Completion-cache hits, resumed results and
+    (in incremental mode) unchanged files are not subtracted, so it is an upper bound on
+    prompt tokens; completion tokens assume DEFAULT_OUTPUT_TOKENS_ESTIMATE per call.
+    blob_shas and blob_sizes are the branch's tree maps, fetched here when not given.
+    """
+    from services import github_service, llm_service, token_usage
+
+    sizes = github_service.get_blob_sizes(owner, repo, branch) if blob_sizes is None else blob_sizes
+    known_sizes = [sizes[path] for path in scope if path in sizes]
+    average_size = sum(known_sizes) / len(known_sizes) if known_sizes else 0
+    # Bytes stand in for characters; each file also gets a '--- Content from <path> ---' header
+    file_chars = [sizes.get(path, average_size) + len(path) + 24 for path in scope]
+    prompt_overhead = token_usage.count_tokens(user_prompt, model_id) + token_usage.MESSAGE_OVERHEAD_TOKENS + 16
+    output_tokens = token_usage.DEFAULT_OUTPUT_TOKENS_ESTIMATE
+    chars_per_token = llm_service.CHARS_PER_TOKEN
+
+    if analysis_mode in PER_FILE_MODES:
+        per_file_tokens = llm_service.MAX_COMBINED_TOKENS // len(scope)
+        # Files with identical content (same blob SHA) are analysed once
+        if blob_shas is None:
+            blob_shas = github_service.get_blob_shas(owner, repo, branch)
+        unique, _ = _group_duplicate_blobs(list(enumerate(scope)), blob_shas)
+        calls = len(unique)
+        prompt_tokens = sum(prompt_overhead + min(file_chars[index] / chars_per_token, per_file_tokens) for index, _ in unique)
+    elif analysis_mode == 'combined':
+        calls = 1
+        file_list_tokens = token_usage.count_tokens(', '.join(scope), model_id)
+        prompt_tokens = prompt_overhead + file_list_tokens + min(sum(file_chars) / chars_per_token, llm_service.MAX_COMBINED_TOKENS)
+    else:  # map_reduce: every byte is sent once in the map level, then summaries are merged FAN_IN at a time
+        chunks = max(1, math.ceil(sum(file_chars) / (MAP_REDUCE_CHUNK_TOKENS * chars_per_token)))
+        calls = chunks
+        prompt_tokens = chunks * prompt_overhead + sum(file_chars) / chars_per_token
+        summaries = chunks if chunks > 1 else 0
+        while summaries > 1:
+            groups = math.ceil(summaries / MAP_REDUCE_FAN_IN)
+            calls += groups
+            prompt_tokens += groups * prompt_overhead + summaries * output_tokens
+            summaries = groups
+
+    estimate = token_usage.make_usage(math.ceil(prompt_tokens), calls * output_tokens, estimated=True)
+    estimate['calls'] = calls
+    estimate['cost'] = token_usage.usage_cost(estimate, token_usage.get_pricing(provider_config, model_id))
+    estimate['files_without_size'] = len(scope) - len(known_sizes)
+    estimate['tokenizer'] = token_usage.tokenizer_name(model_id)
+    return estimate
+
+
+def run_analysis_task(socketio, task_id, analysis_mode, scope, user_prompt, owner, repo, branch, provider_config, model_id, max_concurrency=None, stream=None, resume=False, base_ref=None, previous_task_id=None, token_budget=None, cost_budget=None, blob_shas=None, blob_sizes=None):
+    """
+    The actual analysis logic run in a background thread via SocketIO.
+    Every result is checkpointed to the task store and appended to the task's NDJSON
+    results file (services/result_export.py) rather than kept in memory; with resume=True, files that
+    already have a stored result are re-emitted instead of being analysed again.
+    'incremental' mode is iterative over the files changed since base_ref only; results
+    for the other files are carried over from previous_task_id (default: the latest
+    completed per-file task with the same repo, prompt and model).
+    Token usage is reported per result and in task_finished; once token_budget or
+    cost_budget (USD) is spent no new LLM calls start and the task ends 'budget_exceeded'.
+    A cancel aborts the fetches and LLM calls in flight (see services/cancellation.py).
+    blob_shas and blob_sizes are the tree maps the caller already fetched (fetched here when None).
+    """
     # Import services here to avoid potential circular imports if services also import this
     from services import github_service
     from services import llm_service  # Renamed import
+    from services import content_sources, completion_cache, task_store, event_batcher, metrics, token_usage, result_export
 
+    max_concurrency = resolve_max_concurrency(max_concurrency)
+    stream = STREAM_TOKENS if stream is None else bool(stream)
+    usage_tracker = token_usage.UsageTracker(
+        token_usage.get_pricing(provider_config, model_id),
+        TOKEN_BUDGET if token_budget is None else token_budget,
+        COST_BUDGET if cost_budget is None else cost_budget,
+    )
     print(f"Background task {task_id} starting for mode '{analysis_mode}' with provider '{provider_config['id']}' model '{model_id}'...")  # Log start with provider/model
-    fetch_content_func = github_service.fetch_file_content
+
+    fetch_content_func = None  # Content source, built in the try below once the tree is known
+
     final_status = 'error'  # Default status
-    results = []  # Initialize results list for iterative mode
+    error_message = None  # Stored with the task when it ends in error
+    result_writer = None  # Per-file modes stream their results to NDJSON
+    budget_skipped = []  # Results refused by the budget (only whether there are any matters)
+    duplicates = {}  # Analysed file's index -> [(index, file_path)] of files with the same blob
+    files_queued = 0  # Per-file work added to the pending-files gauge
+    files_analysed = []  # Indexes analyze_file has finished (appended from worker threads)
+
+    def complete(messages, token_event=None):
+        """
+        Runs the LLM call. When streaming is enabled and token_event is given, tokens are
+        emitted as 'partial_token' events carrying token_event's fields (None = don't stream).
+        Returns (response_text, usage). Raises token_usage.BudgetExhausted instead of
+        starting a call the task's budget can't cover.
+        """
+        reservation = usage_tracker.check(token_usage.count_message_tokens(messages, model_id))
+        call_usage = {}
+        on_token = None
+        if stream and token_event is not None:
+            def on_token(text):
+                events.emit('partial_token', {**token_event, 'token': text}, room=task_id)
+
+        try:
+            if LLM_ENGINE == 'async':
+                from services import llm_async
+                response_text = llm_async.complete(provider_config, model_id, messages, on_token=on_token, on_usage=call_usage.update, cancel_token=cancel_token)
+            elif on_token:
+                response_text = llm_service.stream_llm_completion(
+                    provider_config=provider_config, model_id=model_id, prompt_messages=messages, on_token=on_token, on_usage=call_usage.update, cancel_token=cancel_token
+                )
+            else:
+                response_text = llm_service.get_llm_completion(
+                    provider_config=provider_config, model_id=model_id, prompt_messages=messages, on_usage=call_usage.update, cancel_token=cancel_token
+                )
+        except BaseException:
+            usage_tracker.release(reservation)
+            raise
+        return response_text, usage_tracker.add(call_usage or token_usage.estimate_usage(messages, response_text, model_id), reservation)
+
+    def complete_cached(messages, token_event=None, blob_sha=None):
+        """complete() behind the completion cache. Returns (response_text, cached, usage); cache hits cost nothing (usage None)."""
+        cache_key = completion_cache.make_key(provider_config['id'], model_id, messages, blob_sha=blob_sha)
+        response_text = completion_cache.get(cache_key)
+        if response_text is not None:
+            return response_text, True, None
+        response_text, usage = complete(messages, token_event=token_event)
+        completion_cache.put(cache_key, provider_config['id'], model_id, response_text)
+        return response_text, False, usage
+
+    def analyze_file(index, file_path):
+        """Fetches one file and runs the LLM on it. Safe to call from worker threads."""
+        metrics.FILES_IN_FLIGHT.inc()
+        partial_result = {'path': file_path, 'index': index, 'error': 'Analysis did not finish.'}
+        try:
+            total_files = len(scope)
+            print(f"Task {task_id} fetching content for: {file_path}")  # Log content fetch
+            content = fetch_content_func(owner, repo, file_path, branch)
+            cancel_token.raise_if_cancelled()  # A cancelled fetch returns None or raises; either way stop here
+            partial_result = {'path': file_path, 'index': index}
+            if blob_shas.get(file_path):
+                partial_result['blob_sha'] = blob_shas[file_path]  # Lets later incremental runs reuse this result
+            if content is None:
+                partial_result['error'] = 'Could not fetch content.'
+            # No need to check llm_service.client here, get_llm_completion handles initialization errors
+            else:
+                try:
+                    print(f"Task {task_id} preparing LLM call for: {file_path}")
+                    # Split the MAX_COMBINED_TOKENS prompt budget from llm_service between the files
+                    prompt_content = token_usage.truncate_to_tokens(
+                        content, llm_service.MAX_COMBINED_TOKENS // total_files if total_files > 0 else llm_service.MAX_COMBINED_TOKENS, model_id
+                    )
+                    # Construct messages in OpenAI format (adapt in get_llm_completion if needed)
+                    messages = [{"role": "user", "content": f"{user_prompt}\n\nAnalyze the following content from file '{file_path}':\n---\n{prompt_content}\n---"}]
+
+                    # Reuse a previous answer for the same prompt, model and blob if we have one;
+                    # otherwise call the LLM (streamed tokens are tagged with the file)
+                    response_text, cached, usage = complete_cached(messages, token_event={'path': file_path, 'index': index}, blob_sha=blob_shas.get(file_path))
+                    partial_result['response'] = response_text
+                    partial_result['cached'] = cached
+                    if usage:
+                        partial_result['usage'] = usage
+                    print(f"Task {task_id} LLM call successful for: {file_path}{' (cached)' if cached else ''}")
+                except cancellation.TaskCancelled:
+                    raise
+                except token_usage.BudgetExhausted as e:
+                    print(f"Task {task_id} skipped {file_path}: {e}")
+                    partial_result['error'] = f'Skipped: {e}'
+                    partial_result['budget_exceeded'] = True
+                except Exception as e:
+                    print(f"Task {task_id} LLM call FAILED for {file_path}: {e}")
+                    partial_result['error'] = f'LLM API error: {e}'  # Generic error
+        finally:
+            metrics.FILES_IN_FLIGHT.dec()
+            metrics.FILES_PENDING.dec()
+            files_analysed.append(index)
+            metrics.ANALYSIS_FILES.inc(mode=analysis_mode, outcome='cancelled' if cancel_token.cancelled else (
+                'error' if 'error' in partial_result else ('cached' if partial_result.get('cached') else 'success')))
+        return partial_result
+
+    # Progress, results and tokens are coalesced into periodic 'event_batch' events
+    events = event_batcher.BatchingEmitter(socketio, task_id)
+
+    def record_result(partial_result):
+        """Checkpoints a result and fans it out to files with the same content. Returns the number of files recorded."""
+        _safe_store(task_store.save_result, task_id, partial_result['index'], partial_result)
+        _safe_store(result_writer.write, partial_result)
+        if partial_result.get('budget_exceeded'):
+            budget_skipped.append(partial_result['index'])
+        recorded = 1
+        for index, file_path in duplicates.pop(partial_result['index'], ()):
+            # Same answer under the duplicate's own path; the prompt named the original's path (kept as
+            # duplicate_of, so readers know whose answer it is) and its usage was counted on the original
+            copy = {key: value for key, value in partial_result.items() if key != 'usage'}
+            copy.update({'path': file_path, 'index': index, 'duplicate_of': partial_result['path']})
+            events.emit('partial_result', copy, room=task_id)
+            recorded += record_result(copy)
+            metrics.ANALYSIS_FILES.inc(mode=analysis_mode, outcome='duplicate')
+        return recorded
+
+    # Watches the shared cancel flag; cancelling aborts this task's requests and LLM calls in flight
+    cancel_token = cancellation.CancelToken(task_id).watch(lambda: cancelled_tasks.get(task_id))
+    previous_cancel_token = cancellation.set_current(cancel_token)
 
+    _safe_store(shared_state.claim_task, task_id)  # Claimed first, so orphan sweeps never see it running unowned
+    _safe_store(task_store.set_status, task_id, 'running')
+    metrics.TASKS_IN_FLIGHT.inc()
+    # Everything from here on (tree and content source setup included) ends in the finally below,
+    # which sets the terminal status, emits task_finished and releases the claim
     try:
-        if analysis_mode == 'iterative':
+        # Blob SHAs from the tree let unchanged files come straight from the local blob cache
+        if blob_shas is None:
+            blob_shas = github_service.get_blob_shas(owner, repo, branch)
+        print(f"Task {task_id} resolved {sum(1 for p in scope if p in blob_shas)}/{len(scope)} blob SHAs.")
+        source_paths = scope
+        if analysis_mode == 'combined':
+            # Only bulk-fetch the files that can fit the combined prompt
+            source_paths = _combined_candidates(
+                scope, github_service.get_blob_sizes(owner, repo, branch) if blob_sizes is None else blob_sizes, llm_service.MAX_COMBINED_TOKENS, llm_service.CHARS_PER_TOKEN
+            )
+            print(f"Task {task_id} combined prompt budget fits about {len(source_paths)}/{len(scope)} files.")
+
+        if analysis_mode in PER_FILE_MODES:
+            # Skip files checkpointed by an earlier run of this task, replaying their results
+            # (failed files are retried)
+            stored_results = (_safe_store(task_store.get_results, task_id) or []) if resume else []
+            stored_results = [r for r in stored_results if 'error' not in r]
+            result_writer = result_export.ResultWriter(task_id)
+            if stored_results:
+                print(f"Task {task_id} resuming: {len(stored_results)}/{len(scope)} files already done.")
+                for stored in stored_results:
+                    events.emit('partial_result', {**stored, 'resumed': True}, room=task_id)
+                    _safe_store(result_writer.write, stored)
+                    if stored.get('usage'):
+                        usage_tracker.add(stored['usage'])  # Spent by the earlier run, counts against the budget
+            done_indexes = {r['index'] for r in stored_results}
+            pending = [(i, file_path) for i, file_path in enumerate(scope) if i not in done_indexes]
+
+            if analysis_mode == 'incremental':
+                carried = _carry_over_results(
+                    task_id, pending, owner, repo, branch, base_ref, previous_task_id, user_prompt, provider_config['id'], model_id, blob_shas
+                )
+                for carried_result in carried:
+                    events.emit('partial_result', carried_result, room=task_id)
+                    record_result(carried_result)
+                carried_indexes = {r['index'] for r in carried}
+                pending = [(i, file_path) for i, file_path in pending if i not in carried_indexes]
+                stored_results = stored_results + carried
+            # Analyse each distinct blob once; its result is fanned out to the other paths
+            unique_pending, duplicates = _group_duplicate_blobs(pending, blob_shas)
+            duplicate_count = len(pending) - len(unique_pending)
+            dedup_info = {
+                'unique_files': len(unique_pending),
+                'duplicate_files': duplicate_count,
+                'dedup_ratio': round(duplicate_count / len(pending), 3) if pending else 0.0,
+            }
+            if duplicate_count:
+                print(f"Task {task_id} found {duplicate_count}/{len(pending)} files with duplicate content; analysing {len(unique_pending)} unique blobs.")
+                events.emit('progress_update', {
+                    'message': f"{duplicate_count} of {len(pending)} files duplicate other files' content; analysing {len(unique_pending)} unique files.",
+                    **dedup_info,
+                }, room=task_id)
+            pending = unique_pending
+            # Sized for what is left to analyse, so resumed and incremental runs don't bulk-fetch the whole scope
+            source_paths = [file_path for _, file_path in pending]
+            files_queued = len(pending)
+            metrics.FILES_PENDING.inc(files_queued)
+            completed_offset = len(stored_results)  # Counted as already completed for progress
+            stored_results = None  # Results live on disk from here on
+
+        # Per-file fetches for small scopes, one streamed tarball for large uncached ones
+        fetch_content_func = content_sources.make_content_source(owner, repo, branch, source_paths, blob_shas)
+        print(f"Task {task_id} using '{fetch_content_func.name}' content source.")
+
+        if analysis_mode in PER_FILE_MODES and max_concurrency > 1 and len(pending) > 1:
+            final_status = _run_iterative_pool(
+                events, task_id, pending, len(scope), analyze_file, max_concurrency, record_result,
+                completed_offset=completed_offset, budget=usage_tracker, cancel_token=cancel_token, progress_extra=dedup_info
+            )
+
+        elif analysis_mode in PER_FILE_MODES:
             total_files = len(scope)
-            for i, file_path in enumerate(scope):
+            if content_sources.PREFETCH_FILES and len(pending) > 1:
+                # Download upcoming files while the LLM works on the current one (analyze_file picks this up)
+                fetch_content_func = content_sources.PrefetchingContentSource(
+                    fetch_content_func, owner, repo, branch, [file_path for _, file_path in pending]
+                )
+                print(f"Task {task_id} prefetching up to {fetch_content_func.max_files} files ahead.")
+            for i, file_path in pending:
                 # Check for cancellation before processing each file
                 if cancelled_tasks.get(task_id):
                     print(f"Task {task_id} cancelled by user request.")
                     final_status = 'cancelled'
                     break  # Exit the loop
+                if usage_tracker.exhausted():
+                    print(f"Task {task_id} stopped before {file_path}: budget exhausted.")
+                    final_status = 'budget_exceeded'
+                    break
 
                 # Emit progress update
-                progress_data = {'current_file': file_path, 'current_index': i, 'total_files': total_files}
+                # current_index counts finished files (duplicates included), so progress reaches 100%
+                progress_data = {'current_file': file_path, 'current_index': completed_offset, 'total_files': total_files, **dedup_info}
                 print(f"Task {task_id} emitting progress: {progress_data}")  # Log progress emit
-                socketio.emit('progress_update', progress_data, room=task_id)
-                socketio.sleep(0.1)  # Small sleep to allow event emission
+                events.emit('progress_update', progress_data, room=task_id)
 
                 # Process the file
-                print(f"Task {task_id} fetching content for: {file_path}")  # Log content fetch
-                content = fetch_content_func(owner, repo, file_path, branch)
-                partial_result = {'path': file_path}
-                if content is None:
-                    partial_result['error'] = 'Could not fetch content.'
-                # No need to check llm_service.client here, get_llm_completion handles initialization errors
-                else:
-                    try:
-                        print(f"Task {task_id} preparing LLM call for: {file_path}")
-                        # Use MAX_COMBINED_CHARS from llm_service
-                        prompt_content = content[:llm_service.MAX_COMBINED_CHARS // total_files if total_files > 0 else llm_service.MAX_COMBINED_CHARS]
-                        # Construct messages in OpenAI format (adapt in get_llm_completion if needed)
-                        messages = [{"role": "user", "content": f"{user_prompt}\n\nAnalyze the following content from file '{file_path}':\n---\n{prompt_content}\n---"}]
-
-                        # Call the generalized LLM service function
-                        response_text = llm_service.get_llm_completion(
-                            provider_config=provider_config,
-                            model_id=model_id,
-                            prompt_messages=messages
-                            # Add other potential kwargs like temperature if needed
-                        )
-                        partial_result['response'] = response_text
-                        print(f"Task {task_id} LLM call successful for: {file_path}")
-                    except Exception as e:
-                        print(f"Task {task_id} LLM call FAILED for {file_path}: {e}")
-                        partial_result['error'] = f'LLM API error: {e}'  # Generic error
+                try:
+                    partial_result = analyze_file(i, file_path)
+                except cancellation.TaskCancelled:
+                    print(f"Task {task_id} cancelled while processing {file_path}.")
+                    final_status = 'cancelled'
+                    break
 
                 # Emit partial result
                 print(f"Task {task_id} emitting partial result for: {file_path}")  # Log partial result emit
-                socketio.emit('partial_result', partial_result, room=task_id)
-                results.append(partial_result)  # Optionally collect results
+                events.emit('partial_result', partial_result, room=task_id)
+                completed_offset += record_result(partial_result)  # Checkpoint before moving on
+                # Advance by the whole duplicate group, as the pool path does, so the last files don't jump to 100%
+                events.emit('progress_update', {
+                    'current_file': file_path, 'current_index': completed_offset - 1, 'total_files': total_files,
+                    'completed_files': completed_offset, **dedup_info,
+                }, room=task_id)
 
-            if final_status != 'cancelled':
+            if final_status not in ('cancelled', 'budget_exceeded'):
                 final_status = 'completed'  # Mark as completed if loop finished naturally
 
         elif analysis_mode == 'combined':
             # Emit initial progress for combined mode
             print(f"Task {task_id} emitting combined progress: Fetching content...")  # Log combined progress
-            socketio.emit('progress_update', {'message': 'Fetching and combining content...'}, room=task_id)
-            socketio.sleep(0.1)
+            events.emit('progress_update', {'message': 'Fetching and combining content...'}, room=task_id)
 
             # Check for cancellation before potentially long processing
             if cancelled_tasks.get(task_id):
@@ -83,32 +767,30 @@ def run_analysis_task(socketio, task_id, analysis_mode, scope, user_prompt, owne
             else:
                 # --- Combined Mode LLM Call ---
                 print(f"Task {task_id} preparing combined LLM call...")
-                # Combine content
-                all_content_fetched = True
-                temp_combined_content = ""
-                for file_path in scope:
-                    content = fetch_content_func(owner, repo, file_path, branch)
-                    if content is None:
-                        temp_combined_content += f"\n\n--- Error fetching content for {file_path} ---\n\n"
-                        all_content_fetched = False
-                    else:
-                        temp_combined_content += f"\n\n--- Content from {file_path} ---\n{content}"
-
-                if len(temp_combined_content) > llm_service.MAX_COMBINED_CHARS:
-                    print(f"  Warning: Combined content exceeds {llm_service.MAX_COMBINED_CHARS} chars. Truncating.")
-                    combined_content = temp_combined_content[:llm_service.MAX_COMBINED_CHARS]
-                else:
-                    combined_content = temp_combined_content
+                if content_sources.PREFETCH_FILES and len(source_paths) > 1:
+                    # Download the next files while the current one is added to the prompt
+                    fetch_content_func = content_sources.PrefetchingContentSource(fetch_content_func, owner, repo, branch, source_paths)
+
+                def fetch_file(file_path):
+                    return fetch_content_func(owner, repo, file_path, branch)
 
+                # Fill the prompt budget file by file; files past it are never fetched
+                combined_content, combined_files = _assemble_combined(scope, fetch_file, llm_service.MAX_COMBINED_TOKENS, model_id, cancel_token)
+                if hasattr(fetch_content_func, 'stop'):
+                    fetch_content_func.stop()  # Drop read-ahead past the budget
+                if combined_files['partial_files'] or combined_files['skipped_files']:
+                    print(f"  Warning: Combined content exceeds {llm_service.MAX_COMBINED_TOKENS} tokens. "
+                          f"{len(combined_files['partial_files'])} file(s) truncated, {len(combined_files['skipped_files'])} skipped.")
+                included_paths = combined_files['included_files'] + combined_files['partial_files']
+
+                combined_cached = False
                 try:
-                    messages = [{"role": "user", "content": f"{user_prompt}\n\nAnalyze the combined content from the following files: {', '.join(scope)}\n---\n{combined_content}\n---"}]
-                    combined_response = llm_service.get_llm_completion(
-                        provider_config=provider_config,
-                        model_id=model_id,
-                        prompt_messages=messages
-                    )
+                    messages = [{"role": "user", "content": f"{user_prompt}\n\nAnalyze the combined content from the following files: {', '.join(included_paths)}\n---\n{combined_content}\n---"}]
+                    combined_response, combined_cached, _ = complete_cached(messages, token_event={})
                     error_msg = None  # Clear error if successful
-                    print(f"Task {task_id} combined LLM call successful.")
+                    print(f"Task {task_id} combined LLM call successful{' (cached)' if combined_cached else ''}.")
+                except (token_usage.BudgetExhausted, cancellation.TaskCancelled):
+                    raise  # Handled below, as for map-reduce
                 except Exception as e:
                     print(f"Task {task_id} combined LLM call FAILED: {e}")
                     combined_response = None
@@ -121,41 +803,95 @@ def run_analysis_task(socketio, task_id, analysis_mode, scope, user_prompt, owne
                     final_status = 'cancelled'
                 elif error_msg:
                     # Emit error for combined mode
-                    socketio.emit('task_error', {'error': error_msg}, room=task_id)
+                    events.emit('task_error', {'error': error_msg}, room=task_id)
                     final_status = 'error'
+                    error_message = error_msg
                 else:
                     # Emit final result for combined mode
-                    message = 'Combined processing complete.'
-                    if not all_content_fetched:
+                    message = f"Combined processing complete: {len(combined_files['included_files'])} files included"
+                    if combined_files['partial_files']:
+                        message += f", {len(combined_files['partial_files'])} in part"
+                    if combined_files['skipped_files']:
+                        message += f", {len(combined_files['skipped_files'])} skipped (prompt budget full)"
+                    message += '.'
+                    if combined_files['missing_files']:
                         message += ' Some file contents could not be fetched.'
                     final_result_data = {
                         'message': message,
-                        'combined_response': combined_response
+                        'combined_response': combined_response,
+                        'cached': combined_cached,
+                        **combined_files,
+                        'usage': usage_tracker.totals()
                     }
                     # For combined, we send the full result as 'final_result'
                     print(f"Task {task_id} emitting final combined result.")  # Log final result emit
-                    socketio.emit('final_result', final_result_data, room=task_id)
+                    events.emit('final_result', final_result_data, room=task_id)
+                    _safe_store(task_store.save_final_result, task_id, final_result_data)
                     final_status = 'completed'
 
+        elif analysis_mode == 'map_reduce':
+            def fetch_file(file_path):
+                return fetch_content_func(owner, repo, file_path, branch)
+
+            final_status, combined_response, map_reduce_info = _run_map_reduce(
+                events, task_id, scope, user_prompt, fetch_file, complete_cached, max_concurrency, budget=usage_tracker, cancel_token=cancel_token
+            )
+            if final_status == 'cancelled':
+                print(f"Task {task_id} map-reduce cancelled.")
+            else:
+                message = f"Map-reduce complete: {map_reduce_info['files']} files in {map_reduce_info['chunks']} chunks, {map_reduce_info['levels']} levels."
+                if map_reduce_info['missing_files']:
+                    message += ' Some file contents could not be fetched.'
+                print(f"Task {task_id} emitting final map-reduce result.")
+                final_result_data = {'message': message, 'combined_response': combined_response, **map_reduce_info, 'usage': usage_tracker.totals()}
+                events.emit('final_result', final_result_data, room=task_id)
+                _safe_store(task_store.save_final_result, task_id, final_result_data)
+
+        if analysis_mode in PER_FILE_MODES and final_status == 'completed' and budget_skipped:
+            final_status = 'budget_exceeded'  # The last files in flight were refused
+
+    except cancellation.TaskCancelled:
+        print(f"Task {task_id} cancelled by user request; in-flight work aborted.")
+        final_status = 'cancelled'
+    except token_usage.BudgetExhausted as e:
+        print(f"Task {task_id} stopped: {e}")
+        error_message = str(e)
+        events.emit('task_error', {'error': error_message}, room=task_id)
+        final_status = 'budget_exceeded'
     except Exception as e:
         print(f"Error in background task {task_id}: {e}")
-        socketio.emit('task_error', {'error': f'Unexpected error during processing: {e}'}, room=task_id)
+        error_message = f'Unexpected error during processing: {e}'
+        events.emit('task_error', {'error': error_message}, room=task_id)
         final_status = 'error'
     finally:
+        cancel_token.close()
+        cancellation.set_current(previous_cancel_token)
+        if hasattr(fetch_content_func, 'stop'):
+            fetch_content_func.stop()
+        if result_writer is not None:
+            result_writer.close()
         # Prepare final data for task_finished event
-        final_data = {'task_id': task_id, 'status': final_status}
-        if analysis_mode == 'iterative' and final_status == 'completed':
-            # Include collected results for iterative mode on completion
-            final_data['results'] = results
-            print(f"Task {task_id} completed with {len(results)} results.")
+        final_data = {'task_id': task_id, 'status': final_status, 'usage': usage_tracker.totals()}
+        if analysis_mode in PER_FILE_MODES and final_status in ('completed', 'budget_exceeded') and result_writer is not None:
+            # Results were already streamed; point at the NDJSON file instead of resending them
+            final_data['result_count'] = result_writer.count
+            final_data['results_url'] = f'/api/tasks/{task_id}/results'
+            if result_export.PARQUET_EXPORT and _safe_store(result_export.export_parquet, task_id):
+                final_data['parquet_url'] = f'/api/tasks/{task_id}/results?format=parquet'
+            print(f"Task {task_id} completed with {result_writer.count} results.")
         elif analysis_mode == 'combined' and final_status == 'completed':
             # For combined, the result was already sent via 'final_result'
             # We could potentially re-send it here if needed, but maybe not necessary
             pass
 
+        _safe_store(task_store.set_status, task_id, final_status, error_message)
+        metrics.FILES_PENDING.dec(files_queued - len(files_analysed))  # Files skipped by cancellation or errors
+        metrics.TASKS_IN_FLIGHT.dec()
+        metrics.ANALYSIS_TASKS.inc(mode=analysis_mode, status=final_status)
         # Emit task finished event regardless of outcome
-        socketio.emit('task_finished', final_data, room=task_id)
+        events.emit('task_finished', final_data, room=task_id)
+        events.close()
         print(f"Background task {task_id} finished with status: {final_status}")
-        # Clean up cancellation flag
-        if task_id in cancelled_tasks:
-            del cancelled_tasks[task_id]
+        # Clean up cancellation flag and ownership
+        _safe_store(cancelled_tasks.pop, task_id)
+        _safe_store(shared_state.release_task, task_id)
@@ -0,0 +1,168 @@
+"""
+Local stand-in for the parts of the GitHub API the backend uses: recursive trees
+(with ETags), blobs, contents, tarballs and GraphQL blob queries, over a synthetic
+repository. Latency and a simple request rate limit are configurable.
+"""
+import base64
+import hashlib
+import io
+import json
+import re
+import tarfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def git_blob_sha(data):
+    return hashlib.sha1(f'blob {len(data)}\0'.encode() + data).hexdigest()
+
+
+def make_files(file_count, file_size, seed=0):
+    """Synthetic markdown files spread over a few directories, ~file_size bytes each."""
+    files = {}
+    for i in range(file_count):
+        header = f'# Document {i} (seed {seed})\n\n'.encode()
+        line = f'Line of benchmark text for document {i}.\n'.encode()
+        body = (line * (max(0, file_size - len(header)) // len(line) + 1))[:max(0, file_size - len(header))]
+        files[f'docs/section-{i % 20:02d}/doc-{i:05d}.md'] = header + body
+    return files
+
+
+class FakeGitHub:
+    """Serves one repository (any owner/repo/branch name) from memory."""
+
+    def __init__(self, files, latency_seconds=0.0, rate_limit=0, rate_window_seconds=60.0):
+        self.files = files
+        self.shas = {path: git_blob_sha(data) for path, data in files.items()}
+        self.by_sha = {sha: files[path] for path, sha in self.shas.items()}
+        self.latency_seconds = latency_seconds
+        self.rate_limit = rate_limit  # Max requests per window (0 = unlimited)
+        self.rate_window_seconds = rate_window_seconds
+        self.etag = '"' + hashlib.sha1(''.join(sorted(self.shas.values())).encode()).hexdigest() + '"'
+        self.requests = 0
+        self.rate_limited = 0
+        self._window_start = time.monotonic()
+        self._window_count = 0
+        self._tarball = None
+        self._lock = threading.Lock()
+        self._server = None
+
+    def _check_rate_limit(self):
+        """Returns seconds until the window resets if this request is over the limit, else None."""
+        with self._lock:
+            self.requests += 1
+            if not self.rate_limit:
+                return None
+            now = time.monotonic()
+            if now - self._window_start >= self.rate_window_seconds:
+                self._window_start, self._window_count = now, 0
+            self._window_count += 1
+            if self._window_count > self.rate_limit:
+                self.rate_limited += 1
+                return max(0.0, self.rate_window_seconds - (now - self._window_start))
+            return None
+
+    def tarball(self):
+        with self._lock:
+            if self._tarball is None:
+                buffer = io.BytesIO()
+                with tarfile.open(fileobj=buffer, mode='w:gz') as archive:
+                    for path, data in self.files.items():
+                        info = tarfile.TarInfo(f'owner-repo-0000000/{path}')
+                        info.size = len(data)
+                        archive.addfile(info, io.BytesIO(data))
+                self._tarball = buffer.getvalue()
+            return self._tarball
+
+    def tree(self):
+        return [{'path': path, 'mode': '100644', 'type': 'blob', 'sha': sha, 'size': len(self.files[path])}
+                for path, sha in self.shas.items()]
+
+    def start(self, host='127.0.0.1', port=0):
+        """Starts serving on a daemon thread. Returns the API base URL."""
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def _send(self, status, body, headers=()):
+                if isinstance(body, (dict, list)):
+                    body = json.dumps(body).encode()
+                    headers = list(headers) + [('Content-Type', 'application/json')]
+                self.send_response(status)
+                for key, value in headers:
+                    self.send_header(key, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _begin(self):
+                """Applies latency and rate limiting. Returns False if the request was rejected."""
+                if fake.latency_seconds:
+                    time.sleep(fake.latency_seconds)
+                retry_after = fake._check_rate_limit()
+                if retry_after is not None:
+                    self._send(403, {'message': 'API rate limit exceeded'}, [
+                        ('Retry-After', str(int(retry_after) + 1)),
+                        ('X-RateLimit-Remaining', '0'),
+                        ('X-RateLimit-Reset', str(int(time.time() + retry_after) + 1)),
+                    ])
+                    return False
+                return True
+
+            def do_GET(self):
+                if not self._begin():
+                    return
+                path = self.path.split('?', 1)[0]
+                if '/git/trees/' in path:
+                    if self.headers.get('If-None-Match') == fake.etag:
+                        return self._send(304, b'', [('ETag', fake.etag)])
+                    return self._send(200, {'sha': 'bench', 'tree': fake.tree(), 'truncated': False}, [('ETag', fake.etag)])
+                if '/git/blobs/' in path:
+                    data = fake.by_sha.get(path.rsplit('/', 1)[1])
+                    if data is None:
+                        return self._send(404, {'message': 'Not Found'})
+                    return self._send(200, data, [('Content-Type', 'application/vnd.github.raw')])
+                if '/contents/' in path:
+                    file_path = path.split('/contents/', 1)[1]
+                    data = fake.files.get(file_path)
+                    if data is None:
+                        return self._send(404, {'message': 'Not Found'})
+                    return self._send(200, {'type': 'file', 'encoding': 'base64', 'path': file_path,
+                                            'sha': fake.shas[file_path], 'content': base64.b64encode(data).decode()})
+                if '/tarball/' in path:
+                    return self._send(200, fake.tarball(), [('Content-Type', 'application/x-gzip')])
+                self._send(404, {'message': 'Not Found'})
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                if not self._begin():
+                    return
+                if not self.path.split('?', 1)[0].endswith('/graphql'):
+                    return self._send(404, {'message': 'Not Found'})
+                variables = json.loads(body or b'{}').get('variables', {})
+                repository = {}
+                for name, expression in variables.items():
+                    match = re.match(r'e(\d+)$', name)
+                    if not match:
+                        continue
+                    data = fake.files.get(expression.split(':', 1)[1])
+                    repository[f'f{match.group(1)}'] = None if data is None else {
+                        'oid': git_blob_sha(data), 'text': data.decode('utf-8', 'replace'), 'isBinary': False, 'isTruncated': False,
+                    }
+                self._send(200, {'data': {'repository': repository}})
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name='fake-github', daemon=True).start()
+        return f'http://{host}:{self._server.server_port}'
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+
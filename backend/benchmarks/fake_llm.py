@@ -0,0 +1,119 @@
+"""
+Local stand-in for an OpenAI-compatible chat completions API. Responses are
+generated at a configurable tokens/sec (streamed or not), a configurable fraction
+of requests fail with 500 or 429, and usage is reported like the real API.
+"""
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeLLM:
+    """Serves /v1/models and /v1/chat/completions from memory."""
+
+    def __init__(self, tokens_per_second=200.0, output_tokens=64, error_rate=0.0, rate_limit_error_share=0.5, seed=0):
+        self.tokens_per_second = tokens_per_second  # 0 = instant
+        self.output_tokens = output_tokens
+        self.error_rate = error_rate
+        self.rate_limit_error_share = rate_limit_error_share  # Share of injected errors returned as 429
+        self.requests = 0
+        self.errors = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+
+    def _next_failure(self):
+        """Returns an HTTP status to fail this request with, or None."""
+        with self._lock:
+            self.requests += 1
+            if self.error_rate and self._random.random() < self.error_rate:
+                self.errors += 1
+                return 429 if self._random.random() < self.rate_limit_error_share else 500
+            return None
+
+    def _token_delay(self):
+        return 1.0 / self.tokens_per_second if self.tokens_per_second else 0.0
+
+    def start(self, host='127.0.0.1', port=0):
+        """Starts serving on a daemon thread. Returns the base URL (ending in /v1)."""
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def _send_json(self, status, payload, headers=()):
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                for key, value in headers:
+                    self.send_header(key, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _write_chunk(self, text):
+                data = text.encode()
+                self.wfile.write(f'{len(data):x}\r\n'.encode() + data + b'\r\n')
+                self.wfile.flush()
+
+            def do_GET(self):
+                if self.path.rstrip('/').endswith('/models'):
+                    return self._send_json(200, {'object': 'list', 'data': [{'id': 'bench-model', 'object': 'model', 'created': 0, 'owned_by': 'bench'}]})
+                self._send_json(404, {'error': {'message': 'Not Found'}})
+
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)) or b'{}')
+                if not self.path.rstrip('/').endswith('/chat/completions'):
+                    return self._send_json(404, {'error': {'message': 'Not Found'}})
+                failure = fake._next_failure()
+                if failure:
+                    return self._send_json(failure, {'error': {'message': 'Injected failure', 'type': 'server_error' if failure == 500 else 'rate_limit_error'}},
+                                           [('Retry-After', '0')] if failure == 429 else [])
+
+                prompt_chars = sum(len(str(m.get('content', ''))) for m in request.get('messages', []))
+                usage = {'prompt_tokens': prompt_chars // 4, 'completion_tokens': fake.output_tokens,
+                         'total_tokens': prompt_chars // 4 + fake.output_tokens}
+                model = request.get('model', 'bench-model')
+                tokens = [f' tok{i}' for i in range(fake.output_tokens)]
+                delay = fake._token_delay()
+
+                if request.get('stream'):
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'text/event-stream')
+                    self.send_header('Transfer-Encoding', 'chunked')
+                    self.end_headers()
+                    for token in tokens:
+                        if delay:
+                            time.sleep(delay)
+                        chunk = {'id': 'bench', 'object': 'chat.completion.chunk', 'created': 0, 'model': model,
+                                 'choices': [{'index': 0, 'delta': {'content': token}, 'finish_reason': None}]}
+                        self._write_chunk(f'data: {json.dumps(chunk)}\n\n')
+                    if (request.get('stream_options') or {}).get('include_usage'):
+                        chunk = {'id': 'bench', 'object': 'chat.completion.chunk', 'created': 0, 'model': model, 'choices': [], 'usage': usage}
+                        self._write_chunk(f'data: {json.dumps(chunk)}\n\n')
+                    self._write_chunk('data: [DONE]\n\n')
+                    self.wfile.write(b'0\r\n\r\n')
+                    return
+
+                if delay:
+                    time.sleep(delay * len(tokens))
+                self._send_json(200, {
+                    'id': 'bench', 'object': 'chat.completion', 'created': 0, 'model': model,
+                    'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': ''.join(tokens)}, 'finish_reason': 'stop'}],
+                    'usage': usage,
+                })
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name='fake-llm', daemon=True).start()
+        return f'http://{host}:{self._server.server_port}/v1'
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
@@ -0,0 +1,116 @@
+"""
+Local stand-in for the subset of the Redis protocol the shared-state backend uses:
+HELLO (RESP2 or RESP3), PING, GET, SET (with EX/PX/NX), DEL and EXISTS, with key
+expiry. Enough to run services/shared_state.RedisState against without a Redis server.
+"""
+import socketserver
+import threading
+import time
+
+
+class FakeRedis:
+    """Serves one in-memory keyspace."""
+
+    def __init__(self):
+        self._values = {}  # key -> (value, expires_at or None)
+        self._lock = threading.Lock()
+        self.commands = 0
+        self._server = None
+
+    def _get(self, key):
+        item = self._values.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._values[key]
+            return None
+        return value
+
+    def execute(self, args):
+        """Runs one command (a list of bytes). Returns a Python value to encode as the reply."""
+        name = args[0].decode().upper()
+        with self._lock:
+            self.commands += 1
+            if name == 'HELLO':
+                return {'server': 'redis', 'version': '7.2.0', 'proto': int(args[1]) if len(args) > 1 else 2, 'id': 1,
+                        'mode': 'standalone', 'role': 'master', 'modules': []}
+            if name == 'PING':
+                return 'PONG'
+            if name in ('CLIENT', 'SELECT'):
+                return 'OK'  # redis-py sends CLIENT SETINFO on connect
+            if name == 'GET':
+                return self._get(args[1])
+            if name == 'SET':
+                key, value, options = args[1], args[2], [a.decode().upper() for a in args[3:]]
+                ttl = None
+                if 'EX' in options:
+                    ttl = float(options[options.index('EX') + 1])
+                elif 'PX' in options:
+                    ttl = float(options[options.index('PX') + 1]) / 1000.0
+                if 'NX' in options and self._get(key) is not None:
+                    return None
+                self._values[key] = (value, time.monotonic() + ttl if ttl else None)
+                return 'OK'
+            if name == 'DEL':
+                return sum(1 for key in args[1:] if self._get(key) is not None and self._values.pop(key, None))
+            if name == 'EXISTS':
+                return sum(1 for key in args[1:] if self._get(key) is not None)
+        return RuntimeError(f"ERR unknown command '{name}'")
+
+    def start(self, host='127.0.0.1', port=0):
+        """Starts serving on a daemon thread. Returns a redis:// URL."""
+        fake = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def _read_command(self):
+                line = self.rfile.readline()
+                if not line:
+                    return None
+                if not line.startswith(b'*'):
+                    return line.split()  # Inline command
+                args = []
+                for _ in range(int(line[1:])):
+                    length = int(self.rfile.readline()[1:])
+                    args.append(self.rfile.read(length + 2)[:-2])
+                return args
+
+            protocol = 2  # Switched by HELLO
+
+            def _encode(self, value):
+                if value is None:
+                    return b'_\r\n' if self.protocol == 3 else b'$-1\r\n'
+                if isinstance(value, dict):
+                    if self.protocol == 3:
+                        return f'%{len(value)}\r\n'.encode() + b''.join(self._encode(k) + self._encode(v) for k, v in value.items())
+                    value = [item for pair in value.items() for item in pair]
+                if isinstance(value, list):
+                    return f'*{len(value)}\r\n'.encode() + b''.join(self._encode(item) for item in value)
+                if isinstance(value, RuntimeError):
+                    return f'-{value}\r\n'.encode()
+                if isinstance(value, int):
+                    return f':{value}\r\n'.encode()
+                if isinstance(value, str):
+                    return f'+{value}\r\n'.encode()
+                return b'$%d\r\n%s\r\n' % (len(value), value)
+
+            def handle(self):
+                while True:
+                    args = self._read_command()
+                    if not args:
+                        return
+                    reply = fake.execute(args)
+                    if isinstance(reply, dict) and 'proto' in reply:
+                        self.protocol = reply['proto']
+                    self.wfile.write(self._encode(reply))
+                    self.wfile.flush()
+
+        self._server = socketserver.ThreadingTCPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name='fake-redis', daemon=True).start()
+        return f'redis://{host}:{self._server.server_address[1]}/0'
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
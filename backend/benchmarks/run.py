@@ -0,0 +1,108 @@
+"""
+Benchmark harness: starts a fake GitHub and a fake OpenAI-compatible server, then runs
+every (flow, scope size, concurrency) combination in its own process and reports
+files/s, p50/p95 latency per stage and peak RSS.
+
+    cd backend
+    python -m benchmarks.run --scopes 10,100,500 --concurrency 1,4,8 --flows direct,api
+
+Stages: 'tree' (get_blob_shas), 'fetch' (one file's content), 'llm' (one completion),
+'submit' (the /api/process request, api flow only).
+"""
+import argparse
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+from benchmarks.fake_github import FakeGitHub, make_files
+from benchmarks.fake_llm import FakeLLM
+from benchmarks.scenario import RESULT_MARKER
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+
+def _int_list(value):
+    return [int(item) for item in value.split(',') if item.strip()]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark run_analysis_task and the /api/process + Socket.IO flow against local fakes.')
+    parser.add_argument('--scopes', type=_int_list, default=[10, 100], help='Comma-separated scope sizes (files per task).')
+    parser.add_argument('--concurrency', type=_int_list, default=[1, 4], help='Comma-separated max_concurrency values.')
+    parser.add_argument('--flows', default='direct,api', help="Comma-separated flows: 'direct' (run_analysis_task) and/or 'api' (/api/process + Socket.IO).")
+    parser.add_argument('--mode', default='iterative', choices=['iterative', 'combined', 'map_reduce'])
+    parser.add_argument('--llm-engine', choices=['sync', 'async'], help='Override analysis.llm_engine.')
+    parser.add_argument('--stream', action='store_true', help='Stream tokens (partial_token events).')
+    parser.add_argument('--file-size', type=int, default=4096, help='Bytes per synthetic file.')
+    parser.add_argument('--github-latency-ms', type=float, default=30.0, help='Added latency per GitHub request.')
+    parser.add_argument('--github-rate-limit', type=int, default=0, help='Max GitHub requests per window (0 = unlimited).')
+    parser.add_argument('--github-rate-window', type=float, default=60.0, help='Rate limit window in seconds.')
+    parser.add_argument('--llm-tokens-per-second', type=float, default=500.0, help='Fake LLM generation speed (0 = instant).')
+    parser.add_argument('--llm-output-tokens', type=int, default=64, help='Tokens per fake completion.')
+    parser.add_argument('--llm-error-rate', type=float, default=0.0, help='Fraction of LLM requests failing with 500/429.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for synthetic content and injected errors.')
+    parser.add_argument('--timeout', type=float, default=600.0, help='Per-scenario timeout in seconds.')
+    parser.add_argument('--output', help='Also write all results as JSON to this file.')
+    return parser.parse_args(argv)
+
+
+def run_scenario(params, timeout):
+    """Runs one scenario in a child process and returns its parsed result."""
+    completed = subprocess.run(
+        [sys.executable, '-m', 'benchmarks.scenario', json.dumps(params)],
+        cwd=BACKEND_DIR, capture_output=True, text=True, timeout=timeout,
+    )
+    for line in reversed(completed.stdout.splitlines()):
+        if line.startswith(RESULT_MARKER):
+            return json.loads(line[len(RESULT_MARKER):])
+    raise RuntimeError(f"Scenario {params} produced no result (exit {completed.returncode}):\n{completed.stderr[-2000:]}")
+
+
+def format_row(result):
+    def stage(name):
+        stats = result['stages'].get(name)
+        return f"{stats['p50_ms']:>8.1f} {stats['p95_ms']:>8.1f}" if stats else f"{'-':>8} {'-':>8}"
+    return (f"{result['flow']:<7}{result['scope_size']:>6}{result['concurrency']:>5}  {result['status']:<10}"
+            f"{result['files_per_second']:>9.1f}{result['wall_seconds']:>9.2f}  {stage('fetch')}  {stage('llm')}"
+            f"{result['peak_rss_mb']:>9.1f}{result['events']:>8}")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    flows = [flow.strip() for flow in args.flows.split(',') if flow.strip()]
+
+    github = FakeGitHub(make_files(max(args.scopes), args.file_size, args.seed), args.github_latency_ms / 1000.0,
+                        args.github_rate_limit, args.github_rate_window)
+    llm = FakeLLM(args.llm_tokens_per_second, args.llm_output_tokens, args.llm_error_rate, seed=args.seed)
+    github_url, llm_url = github.start(), llm.start()
+    print(f"Fake GitHub at {github_url}, fake LLM at {llm_url}")
+
+    print(f"{'flow':<7}{'files':>6}{'conc':>5}  {'status':<10}{'files/s':>9}{'wall s':>9}  "
+          f"{'fetch p50':>8} {'p95':>8}  {'llm p50':>8} {'p95':>8}{'rss MB':>9}{'events':>8}")
+    results = []
+    try:
+        for flow in flows:
+            for scope_size in args.scopes:
+                for concurrency in args.concurrency:
+                    params = {
+                        'flow': flow, 'mode': args.mode, 'scope_size': scope_size, 'concurrency': concurrency,
+                        'stream': args.stream, 'llm_engine': args.llm_engine, 'timeout_seconds': args.timeout,
+                        'owner': 'bench', 'repo': 'bench', 'branch': 'main', 'github_url': github_url, 'llm_url': llm_url,
+                    }
+                    result = run_scenario(params, args.timeout + 30)
+                    results.append(result)
+                    print(format_row(result), flush=True)
+    finally:
+        github.stop()
+        llm.stop()
+
+    print(f"GitHub requests: {github.requests} ({github.rate_limited} rate limited); LLM requests: {llm.requests} ({llm.errors} injected errors)")
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2))
+        print(f"Results written to {args.output}")
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,233 @@
+"""
+Runs one benchmark scenario in a fresh process and prints its measurements as one
+JSON line prefixed with RESULT_MARKER (the backend itself logs to stdout). Started by
+benchmarks.run; the fake servers live in the parent process so they don't share this
+process's CPU, GIL or memory accounting.
+
+    python -m benchmarks.scenario '{"flow": "direct", "scope_size": 100, ...}'
+"""
+import json
+import math
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+BENCH_PROVIDER_ID = 'bench'
+BENCH_MODEL_ID = 'bench-model'
+TERMINAL_STATUSES = ('completed', 'cancelled', 'error', 'interrupted', 'budget_exceeded')
+RESULT_MARKER = 'BENCH_RESULT '
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile; None for an empty list."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+class StageTimer:
+    """Collects wall-clock durations per named stage from wrapped functions."""
+
+    def __init__(self):
+        self.samples = {}
+        self._lock = threading.Lock()
+
+    def wrap(self, stage, func):
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - started
+                with self._lock:
+                    self.samples.setdefault(stage, []).append(elapsed)
+        timed.__name__ = getattr(func, '__name__', stage)
+        return timed
+
+    def summary(self):
+        return {
+            stage: {
+                'count': len(values),
+                'p50_ms': round(percentile(values, 0.50) * 1000, 2),
+                'p95_ms': round(percentile(values, 0.95) * 1000, 2),
+            }
+            for stage, values in sorted(self.samples.items())
+        }
+
+
+class RecordingEmitter:
+    """socketio stand-in for the direct flow: records when results and task_finished arrive."""
+
+    def __init__(self):
+        self.result_times = []
+        self.events = 0
+        self.finished = None
+
+    def emit(self, event, data, room=None):
+        self.events += 1
+        now = time.perf_counter()
+        if event == 'event_batch':
+            self.result_times.extend(now for _ in data.get('results', ()))
+        elif event == 'partial_result':
+            self.result_times.append(now)
+        elif event == 'task_finished':
+            self.finished = data
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    def start_background_task(self, target, *args, **kwargs):
+        thread = threading.Thread(target=target, args=args, kwargs=kwargs, daemon=True)
+        thread.start()
+        return thread
+
+
+def _configure(params, workdir):
+    """Points the backend at the fake servers and isolates its caches in workdir."""
+    os.environ.setdefault('OPENAI_API_KEY', 'benchmark')
+    os.environ.setdefault('ANTHROPIC_API_KEY', 'benchmark')
+    sys.path.insert(0, str(BACKEND_DIR))
+
+    from config import CONFIG
+    CONFIG['llm_providers']['providers'].append({
+        'id': BENCH_PROVIDER_ID, 'name': 'Benchmark', 'api_key': 'benchmark', 'enabled': True,
+        'base_url': params['llm_url'], 'stream_usage': True, 'models': [{'id': BENCH_MODEL_ID, 'name': 'Benchmark'}],
+    })
+
+    from services import github_service, blob_cache, completion_cache, task_store, shared_state, result_export
+    import background_tasks
+    github_service.GITHUB_API_BASE = params['github_url']
+    github_service.GITHUB_GRAPHQL_URL = f"{params['github_url']}/graphql"
+    blob_cache.BLOB_CACHE_DIR = Path(workdir) / 'blobs'
+    completion_cache.COMPLETION_CACHE_ENABLED = bool(params.get('completion_cache', False))
+    completion_cache.COMPLETION_CACHE_PATH = Path(workdir) / 'completions.sqlite3'
+    task_store.TASK_DB_PATH = Path(workdir) / 'tasks.sqlite3'
+    result_export.RESULTS_DIR = Path(workdir) / 'results'
+    shared_state.SHARED_STATE_BACKEND = 'memory'  # The Socket.IO test client can't use a message queue
+    if params.get('llm_engine'):
+        background_tasks.LLM_ENGINE = params['llm_engine']
+    return CONFIG
+
+
+def _instrument(timer):
+    from services import github_service, llm_service, llm_async, content_sources
+
+    github_service.get_blob_shas = timer.wrap('tree', github_service.get_blob_shas)
+    make_content_source = content_sources.make_content_source
+
+    def timed_make_content_source(*args, **kwargs):
+        source = make_content_source(*args, **kwargs)
+        timed = timer.wrap('fetch', source)
+        timed.name = source.name
+        return timed
+
+    content_sources.make_content_source = timed_make_content_source
+    llm_service.get_llm_completion = timer.wrap('llm', llm_service.get_llm_completion)
+    llm_service.stream_llm_completion = timer.wrap('llm', llm_service.stream_llm_completion)
+    llm_async.complete = timer.wrap('llm', llm_async.complete)
+
+
+def _scope(params):
+    from services import github_service
+    paths = sorted(github_service.get_blob_shas(params['owner'], params['repo'], params['branch']))
+    return paths[:params['scope_size']]
+
+
+def run_direct(params, scope):
+    """Calls run_analysis_task in this thread, as the background task would."""
+    import background_tasks
+    emitter = RecordingEmitter()
+    task_id = f'bench-{uuid.uuid4()}'
+    started = time.perf_counter()
+    background_tasks.run_analysis_task(
+        emitter, task_id, params['mode'], scope, 'Summarise this document.', params['owner'], params['repo'], params['branch'],
+        next(p for p in background_tasks.CONFIG['llm_providers']['providers'] if p['id'] == BENCH_PROVIDER_ID),
+        BENCH_MODEL_ID, max_concurrency=params['concurrency'], stream=params.get('stream', False),
+    )
+    finished = time.perf_counter()
+    status = (emitter.finished or {}).get('status', 'unknown')
+    return started, finished, status, emitter.result_times, emitter.events
+
+
+def run_api(params, scope):
+    """POSTs /api/process and follows the task over a Socket.IO test client."""
+    import main
+    from services import task_store
+
+    socket_client = main.socketio.test_client(main.app)
+    http_client = main.app.test_client()
+    started = time.perf_counter()
+    response = http_client.post('/api/process', json={
+        'owner': params['owner'], 'repo': params['repo'], 'branch': params['branch'], 'scope': scope,
+        'user_prompt': 'Summarise this document.', 'analysis_mode': params['mode'],
+        'provider_id': BENCH_PROVIDER_ID, 'model_id': BENCH_MODEL_ID,
+        'max_concurrency': params['concurrency'], 'stream': params.get('stream', False),
+    })
+    submitted = time.perf_counter()
+    if response.status_code != 202:
+        raise RuntimeError(f'/api/process returned {response.status_code}: {response.get_json()}')
+    task_id = response.get_json()['task_id']
+    socket_client.emit('join', {'task_id': task_id})
+
+    result_times, events, status = [], 0, None
+    deadline = started + params.get('timeout_seconds', 600)
+    while status is None and time.perf_counter() < deadline:
+        for packet in socket_client.get_received():
+            events += 1
+            now = time.perf_counter()
+            args = (packet.get('args') or [{}])[0]
+            if packet['name'] == 'event_batch':
+                result_times.extend(now for _ in args.get('results', ()))
+            elif packet['name'] == 'partial_result':
+                result_times.append(now)
+            elif packet['name'] == 'task_finished':
+                status = args.get('status')
+        if status is None:
+            # Events sent before the join are missed; the task store still has the outcome
+            task = task_store.get_task(task_id)
+            if task and task['status'] in TERMINAL_STATUSES and time.perf_counter() - submitted > 1.0:
+                status = task['status']
+            else:
+                time.sleep(0.01)
+    finished = time.perf_counter()
+    socket_client.disconnect()
+    return started, finished, status or 'timeout', result_times, events, submitted - started
+
+
+def main(argv):
+    params = json.loads(argv[1])
+    with tempfile.TemporaryDirectory(prefix='bench-') as workdir:
+        _configure(params, workdir)
+        timer = StageTimer()
+        scope = _scope(params)
+        _instrument(timer)
+
+        submit_seconds = None
+        if params['flow'] == 'api':
+            started, finished, status, result_times, events, submit_seconds = run_api(params, scope)
+        else:
+            started, finished, status, result_times, events = run_direct(params, scope)
+
+    wall = finished - started
+    stages = timer.summary()
+    if submit_seconds is not None:
+        stages['submit'] = {'count': 1, 'p50_ms': round(submit_seconds * 1000, 2), 'p95_ms': round(submit_seconds * 1000, 2)}
+    peak_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss  # Kilobytes on Linux
+    print(RESULT_MARKER + json.dumps({
+        'flow': params['flow'], 'mode': params['mode'], 'scope_size': len(scope), 'concurrency': params['concurrency'],
+        'status': status, 'wall_seconds': round(wall, 3), 'files_per_second': round(len(scope) / wall, 2) if wall else None,
+        'results': len(result_times), 'events': events,
+        'first_result_ms': round((min(result_times) - started) * 1000, 2) if result_times else None,
+        'stages': stages, 'peak_rss_mb': round(peak_rss_kb / 1024, 1),
+    }))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,99 @@
+"""
+Checks the Redis shared-state backend against the local Redis stand-in
+(benchmarks/fake_redis.py), playing two workers: this process ("A") runs tasks,
+a second RedisState client ("B") stands in for another worker behind the load balancer.
+
+    cd backend
+    uv run --extra redis python -m benchmarks.shared_state_check
+
+Exits non-zero if a check fails. The Socket.IO message queue (Redis pub/sub) is not covered.
+"""
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+from benchmarks.fake_github import FakeGitHub, make_files
+from benchmarks.fake_llm import FakeLLM
+from benchmarks.fake_redis import FakeRedis
+from benchmarks import scenario
+
+
+def main():
+    failures = []
+
+    def check(name, ok, detail=''):
+        print(f"{'PASS' if ok else 'FAIL'} {name}{f' ({detail})' if detail and not ok else ''}")
+        if not ok:
+            failures.append(name)
+
+    fake_redis = FakeRedis()
+    redis_url = fake_redis.start()
+    github = FakeGitHub(make_files(20, 2000))
+    llm = FakeLLM(tokens_per_second=100, output_tokens=40)
+    params = {'owner': 'bench', 'repo': 'docs', 'branch': 'main', 'github_url': github.start(), 'llm_url': llm.start(), 'scope_size': 20}
+
+    with tempfile.TemporaryDirectory() as workdir:
+        config = scenario._configure(params, workdir)
+        from services import shared_state, task_store
+        import background_tasks
+        shared_state.SHARED_STATE_BACKEND = 'redis'
+        shared_state.REDIS_URL = redis_url
+        shared_state._state = None
+        worker_b = shared_state.RedisState(redis_url)
+
+        # Cancellation flags written by one worker are seen by the other
+        task_id = str(uuid.uuid4())
+        worker_b.set(f'cancel:{task_id}', '1', ttl=60)
+        check('cancel flag set by another worker is visible', background_tasks.cancelled_tasks.get(task_id) is True)
+        background_tasks.cancelled_tasks.pop(task_id)
+        check('cancel flag cleared for every worker', worker_b.get(f'cancel:{task_id}') is None)
+
+        # Ownership is visible to other workers, lapses with its TTL and is released explicitly
+        shared_state.claim_task(task_id)
+        check('task owner visible to another worker', worker_b.get(f'owner:{task_id}') == shared_state.WORKER_ID)
+        shared_state.release_task(task_id)
+        check('released task has no owner', worker_b.get(f'owner:{task_id}') is None)
+        worker_b.set(f'owner:{task_id}', 'dead-worker', ttl=1)
+        time.sleep(1.2)
+        check('owner of a dead worker lapses after its TTL', shared_state.get_task_owner(task_id) is None)
+
+        # A task left running by a dead worker is swept once its ownership has lapsed
+        task_store.create_task(task_id, {})
+        task_store.set_status(task_id, 'running')
+        worker_b.set(f'owner:{task_id}', 'restarted-worker', ttl=1)
+        is_alive = lambda tid: shared_state.get_task_owner(tid) is not None  # noqa: E731
+        check('task of a live owner is not swept', task_id not in task_store.mark_interrupted_tasks(is_alive=is_alive))
+        time.sleep(1.2)
+        check('task is swept once its owner lapsed', task_id in task_store.mark_interrupted_tasks(is_alive=is_alive))
+
+        # A cancel sent to worker B stops a task running on worker A
+        provider = next(p for p in config['llm_providers']['providers'] if p['id'] == scenario.BENCH_PROVIDER_ID)
+        scope = scenario._scope(params)
+        emitter = scenario.RecordingEmitter()
+        task_id = str(uuid.uuid4())
+        task_store.create_task(task_id, {})
+        runner = threading.Thread(target=background_tasks.run_analysis_task, args=(
+            emitter, task_id, 'iterative', scope, 'Summarise.', params['owner'], params['repo'], params['branch'], provider, scenario.BENCH_MODEL_ID,
+        ), kwargs={'max_concurrency': 2, 'stream': True}, daemon=True)
+        runner.start()
+        deadline = time.monotonic() + 10
+        while worker_b.get(f'owner:{task_id}') is None and time.monotonic() < deadline:
+            time.sleep(0.05)
+        check('running task is owned by worker A', worker_b.get(f'owner:{task_id}') == shared_state.WORKER_ID)
+        worker_b.set(f'cancel:{task_id}', '1', ttl=60)
+        runner.join(timeout=30)
+        status = (emitter.finished or {}).get('status')
+        check('cancel from worker B stops the task on worker A', status == 'cancelled', f'status {status}')
+        check('finished task releases ownership', worker_b.get(f'owner:{task_id}') is None)
+
+    fake_redis.stop()
+    github.stop()
+    llm.stop()
+    print(f"{len(failures)} check(s) failed." if failures else "All shared-state checks passed.")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
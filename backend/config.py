@@ -36,6 +36,19 @@ def substitute_env_vars(config_value):
     else:
         return config_value
 
+def validate_rate_limits(rate_limits, owner_label):
+    """Checks an optional rate_limits mapping ({rpm, tpm}) on a provider or model."""
+    if rate_limits is None:
+        return
+    if not isinstance(rate_limits, dict):
+        raise ConfigurationError(f"{owner_label} has 'rate_limits' that is not a dictionary.")
+    for key, value in rate_limits.items():
+        if key not in ('rpm', 'tpm'):
+            raise ConfigurationError(f"{owner_label} has unknown rate limit '{key}' (expected 'rpm' or 'tpm').")
+        if value is not None and (not isinstance(value, (int, float)) or isinstance(value, bool) or value <= 0):
+            raise ConfigurationError(f"{owner_label} rate limit '{key}' must be a positive number.")
+
+
 def validate_config(config):
     """Checks for mandatory configuration keys and required API keys for enabled providers."""
     if not isinstance(config, dict):
@@ -103,6 +116,8 @@ def validate_config(config):
              if not isinstance(model, dict): raise ConfigurationError(f"Model at index {j} for provider '{provider_id}' is not a dictionary.")
              if not model.get('id'): raise ConfigurationError(f"Model at index {j} for provider '{provider_id}' is missing mandatory 'id'.")
              if not model.get('name'): raise ConfigurationError(f"Model '{model.get('id')}' for provider '{provider_id}' is missing mandatory 'name'.")
+             validate_rate_limits(model.get('rate_limits'), f"Model '{model.get('id')}' for provider '{provider_id}'")
+        validate_rate_limits(provider.get('rate_limits'), f"Provider '{provider_id}'")
 
         # --- Check for missing API keys ONLY for ENABLED providers that require them ---
         is_local_provider = provider_id in ['lmstudio', 'ollama'] # Example IDs for local
@@ -18,9 +18,20 @@ except SystemExit as e:
      sys.exit(1)
 
 
+# Shared state (cancellation flags, task ownership, Socket.IO message queue) lets several
+# workers run behind a load balancer; the default in-process backend needs no message queue
+try:
+    from services import shared_state
+    message_queue = shared_state.get_state().message_queue
+except Exception as e:
+    print(f"Exiting due to shared state configuration error: {e}")
+    import sys
+    sys.exit(1)
+
+
 # --- Flask App Setup ---
 app = Flask(__name__)
-socketio = SocketIO(app, cors_allowed_origins="*")
+socketio = SocketIO(app, cors_allowed_origins="*", message_queue=message_queue)
 CORS(app) # Allow all origins for all routes
 
 # Import and register routes AFTER app and socketio are created
@@ -45,11 +56,52 @@ except ImportError as e:
      sys.exit(1)
 
 
+DEBUG = True
+
+
+def recover_interrupted_tasks():
+    """
+    Marks tasks left running by a previous process as interrupted and optionally resumes them.
+    Repeated on a timer: ownership of a worker that died less than owner_ttl_seconds ago (e.g.
+    this process's predecessor) still looks alive at startup, and other workers can die later.
+    """
+    import os
+    # With the debug reloader only the child process (WERKZEUG_RUN_MAIN) actually serves requests
+    if DEBUG and os.environ.get('WERKZEUG_RUN_MAIN') != 'true':
+        return
+    _sweep_interrupted_tasks()
+
+    def sweep_loop():
+        while True:
+            socketio.sleep(shared_state.OWNER_TTL_SECONDS)
+            _sweep_interrupted_tasks(min_idle_seconds=shared_state.OWNER_TTL_SECONDS)
+
+    socketio.start_background_task(sweep_loop)
+
+
+def _sweep_interrupted_tasks(min_idle_seconds=0):
+    from services import task_store
+    from background_tasks import resume_task
+    try:
+        interrupted = task_store.mark_interrupted_tasks(
+            is_alive=lambda task_id: shared_state.get_task_owner(task_id) is not None, min_idle_seconds=min_idle_seconds
+        )
+    except Exception as e:
+        print(f"Warning: Could not recover tasks from the task store: {e}")
+        return
+    if interrupted and CONFIG.get('task_store', {}).get('auto_resume', False):
+        for task_id in interrupted:
+            ok, error_message = resume_task(socketio, task_id)
+            if not ok:
+                print(f"Could not auto-resume task {task_id}: {error_message}")
+
+
 # --- Main Execution ---
 if __name__ == '__main__':
+    recover_interrupted_tasks()
     # Use socketio.run() instead of app.run()
     print("Starting Flask-SocketIO server...")
     # Note: allow_unsafe_werkzeug=True might be needed for debug mode with older SocketIO/Werkzeug versions
     # but try without it first for better security practice if possible with current versions.
     # socketio.run(app, debug=True, port=5001, allow_unsafe_werkzeug=True)
-    socketio.run(app, debug=True, port=5001)
+    socketio.run(app, debug=DEBUG, port=5001)
@@ -1,4 +1,5 @@
-from flask import Blueprint, request, jsonify, current_app # Import current_app
+from flask import Blueprint, request, jsonify, current_app, Response, send_file # Import current_app
+import json
 import uuid
 import os
 import re
@@ -7,8 +8,9 @@ import re
 try:
     # Assuming 'backend' is the root package for execution context
     from config import CONFIG
-    from services import github_service, llm_service
-    from background_tasks import run_analysis_task, cancelled_tasks
+    from services import github_service, llm_service, http_session, health, task_store, path_index, metrics, result_export
+    from background_tasks import run_analysis_task, resume_task, cancelled_tasks, resolve_max_concurrency, estimate_task_usage
+    from services import token_usage
     # DO NOT import socketio from main here to avoid circular import
 except ImportError as e:
     print(f"CRITICAL Error importing modules in routes.py: {e}. Ensure all modules exist and backend is run correctly.")
@@ -19,75 +21,120 @@ except ImportError as e:
     def check_provider_config(cfg): return False, {"message": "Import failed"}
     github_service = type('obj', (object,), {'check_github_token': check_github_token})
     llm_service = type('obj', (object,), {'check_provider_config': check_provider_config})
+    http_session = type('obj', (object,), {'get_latency_stats': staticmethod(lambda: {})})
+    health = type('obj', (object,), {
+        'ensure_prober_started': staticmethod(lambda socketio: None),
+        'get_status_snapshot': staticmethod(lambda: {'github_ok': False, 'github_error': {"message": "Import failed"}, 'provider_statuses': {}}),
+        'check_provider_cached': staticmethod(check_provider_config),
+    })
+    task_store = type('obj', (object,), {
+        'create_task': staticmethod(lambda task_id, params: None),
+        'get_task': staticmethod(lambda task_id: None),
+        'get_results': staticmethod(lambda task_id: []),
+    })
+    path_index = type('obj', (object,), {'get_index': staticmethod(lambda owner, repo, branch: None), 'MAX_PATTERN_LENGTH': 500})
+    metrics = type('obj', (object,), {'render': staticmethod(lambda: '')})
+    result_export = None
     cancelled_tasks = {}
     def run_analysis_task(*args, **kwargs): pass
+    def resume_task(socketio, task_id): return False, "Import failed"
+    def resolve_max_concurrency(requested=None): return 1
+    def estimate_task_usage(*args, **kwargs): return None
+    token_usage = type('obj', (object,), {'get_pricing': staticmethod(lambda provider_config, model_id: None)})
 
 
 # Create a Blueprint
 api_bp = Blueprint('api_bp', __name__, url_prefix='/api')
 
+MAX_FILES_PAGE_SIZE = 5000  # Upper bound for /api/files?limit=
+MAX_RESULTS_PAGE_SIZE = 1000  # Upper bound for /api/tasks/<id>/results?limit=
+
 
 @api_bp.route('/files', methods=['GET'])
 def get_files():
-    """Endpoint to get the file tree for a specified repo and branch."""
+    """
+    Endpoint to get the file tree for a specified repo and branch.
+    Queries run against a server-side path index built once per tree. Optional query
+    params: prefix, glob, contains, case_sensitive, limit + cursor (pagination),
+    count=1 (total matches) and dirs=1 (subdirectories of 'dir', or of prefix's directory, with file counts).
+    Without limit the full filtered list is returned.
+    """
     owner = request.args.get('owner', CONFIG['github_defaults']['owner'])
     repo = request.args.get('repo', CONFIG['github_defaults']['repo'])
     branch = request.args.get('branch', CONFIG['github_defaults']['branch'])
-    tree = github_service.fetch_repo_tree(owner, repo, branch)
-    if tree is None:
+    index = path_index.get_index(owner, repo, branch)
+    if index is None:
         return jsonify({'error': f'Could not fetch file tree for {owner}/{repo} branch: {branch}'}), 500
 
     # Get requested extensions from query param, default to config
     extensions_str = request.args.get('extensions')
-    if extensions_str:
+    if extensions_str == '*':
+        allowed_extensions = None  # All files
+    elif extensions_str:
         # Split by comma, strip whitespace, remove empty strings, ensure dot prefix
         allowed_extensions = [f".{ext.strip().lstrip('.')}" for ext in extensions_str.split(',') if ext.strip()]
     else:
         # Use default from config
         allowed_extensions = CONFIG['github_defaults'].get('file_extensions', ['.md']) # Default to .md if missing
 
-    # Filter files based on the allowed extensions
-    filtered_files = [
-        {'path': item['path'], 'type': item['type']}
-        for item in tree
-        if item.get('type') == 'blob' and any(item.get('path', '').endswith(ext) for ext in allowed_extensions)
-    ]
-    return jsonify({'owner': owner, 'repo': repo, 'branch': branch, 'files': filtered_files})
+    prefix = request.args.get('prefix', '')
+    glob = request.args.get('glob')
+    contains = request.args.get('contains')
+    case_sensitive = request.args.get('case_sensitive', 'false').lower() in ('1', 'true', 'yes')
+    cursor = request.args.get('cursor')
+    limit = request.args.get('limit')
+    if limit is not None:
+        if not limit.isdigit() or int(limit) < 1:
+            return jsonify({'error': 'Invalid "limit": must be a positive integer.'}), 400
+        limit = min(int(limit), MAX_FILES_PAGE_SIZE)
+    if glob and len(glob) > path_index.MAX_PATTERN_LENGTH:
+        return jsonify({'error': f'Patterns are limited to {path_index.MAX_PATTERN_LENGTH} characters.'}), 400
+
+    try:
+        paths, next_cursor, total = index.query(
+            prefix=prefix, extensions=allowed_extensions, glob=glob, contains=contains,
+            case_sensitive=case_sensitive, cursor=cursor, limit=limit,
+            with_total=request.args.get('count', '0').lower() in ('1', 'true', 'yes')
+        )
+    except re.error as e:
+        return jsonify({'error': f'Invalid pattern: {e}'}), 400
+
+    response = {'owner': owner, 'repo': repo, 'branch': branch, 'files': [{'path': path, 'type': 'blob'} for path in paths]}
+    if limit is not None:
+        response['next_cursor'] = next_cursor
+    if total is not None:
+        response['total'] = total
+    if request.args.get('dirs', '0').lower() in ('1', 'true', 'yes'):
+        directory = request.args.get('dir', prefix.rsplit('/', 1)[0] if '/' in prefix else '')
+        response['directories'] = index.directory_counts(directory, allowed_extensions, case_sensitive)
+    return jsonify(response)
 
 
 @api_bp.route('/status', methods=['GET'])
 def check_status():
-    """Checks the validity of configured GitHub token and ALL configured LLM providers."""
-    github_ok, github_error_obj = github_service.check_github_token()
+    """
+    Returns the validity of the configured GitHub token and ALL enabled LLM providers.
+    Answers from the health cache, which a background prober keeps fresh.
+    """
+    socketio_instance = current_app.extensions.get('socketio')
+    if socketio_instance:
+        health.ensure_prober_started(socketio_instance)
+    return jsonify(health.get_status_snapshot())
 
-    provider_statuses = {}
-    llm_providers_config = CONFIG.get('llm_providers', {}).get('providers', [])
 
-    if not llm_providers_config:
-         print("Warning: No LLM providers found in configuration for status check.")
-    else:
-        # Iterate only over enabled providers for status check
-        for provider_config in llm_providers_config:
-            if not provider_config.get('enabled', True):
-                # print(f"Skipping status check for disabled provider: {provider_config.get('id', 'N/A')}") # Reduce noise
-                continue
-
-            provider_id = provider_config.get('id')
-            if not provider_id:
-                print("Warning: Found enabled provider config without an ID during status check.")
-                continue
-            # Check each provider
-            provider_ok, provider_error_obj = llm_service.check_provider_config(provider_config)
-            provider_statuses[provider_id] = {
-                'ok': provider_ok,
-                'error': provider_error_obj
-            }
+@api_bp.route('/status/http', methods=['GET'])
+def get_http_stats():
+    """Returns per-call latency stats for outbound GitHub API requests."""
+    return jsonify({'calls': http_session.get_latency_stats()})
 
-    return jsonify({
-        'github_ok': github_ok,
-        'github_error': github_error_obj,
-        'provider_statuses': provider_statuses
-    })
+
+@api_bp.route('/metrics', methods=['GET'])
+def get_metrics():
+    """
+    Per-stage latency histograms (GitHub, LLM, provider checks, Socket.IO emits) and
+    task/file throughput counters and gauges, in the Prometheus text format.
+    """
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 
 @api_bp.route('/config/defaults', methods=['GET'])
@@ -119,7 +166,8 @@ def get_config_defaults():
 def process_docs_start():
     """
     Endpoint to START the documentation processing task in the background.
-    Returns a task ID to the client.
+    Returns a task ID to the client, with a pre-flight estimate of the task's tokens and
+    cost. With "dry_run": true only the estimate is returned and nothing is started.
     """
     # Access socketio instance via application context
     socketio_instance = current_app.extensions.get('socketio')
@@ -139,13 +187,31 @@ def process_docs_start():
     analysis_mode = data.get('analysis_mode', 'iterative')
     provider_id = data.get('provider_id')
     model_id = data.get('model_id')
+    max_concurrency = data.get('max_concurrency')  # Optional per-task override of analysis.max_concurrent_files
+    stream = data.get('stream')  # Optional per-task override of analysis.stream_tokens
+    base_ref = data.get('base_ref')  # Incremental mode: analyse only files changed since this ref
+    previous_task_id = data.get('previous_task_id')  # Incremental mode: task to carry unchanged results over from
+    token_budget = data.get('token_budget')  # Optional: stop starting LLM calls after this many tokens (0 = unlimited)
+    cost_budget = data.get('cost_budget')  # Optional: same, in USD (needs pricing for the model in config)
+    dry_run = data.get('dry_run', False)
 
     # --- Input Validation ---
     if not user_prompt: return jsonify({'error': 'Missing "user_prompt" in request'}), 400
     if not scope or not isinstance(scope, list) or len(scope) == 0: return jsonify({'error': 'Missing or empty "scope" (list of file paths) in request'}), 400
-    if analysis_mode not in ['iterative', 'combined']: return jsonify({'error': f'Invalid "analysis_mode": {analysis_mode}. Must be "iterative" or "combined".'}), 400
+    if analysis_mode not in ['iterative', 'combined', 'map_reduce', 'incremental']: return jsonify({'error': f'Invalid "analysis_mode": {analysis_mode}. Must be "iterative", "combined", "map_reduce" or "incremental".'}), 400
+    if analysis_mode == 'incremental':
+        if not base_ref or not isinstance(base_ref, str): return jsonify({'error': 'Missing "base_ref" (branch, tag or commit SHA) for incremental mode.'}), 400
+        if previous_task_id is not None and not task_store.get_task(previous_task_id): return jsonify({'error': f'Previous task "{previous_task_id}" not found.'}), 400
     if not provider_id: return jsonify({'error': 'Missing "provider_id" in request'}), 400
     if not model_id: return jsonify({'error': 'Missing "model_id" in request'}), 400
+    if max_concurrency is not None and (not isinstance(max_concurrency, int) or isinstance(max_concurrency, bool) or max_concurrency < 1):
+        return jsonify({'error': 'Invalid "max_concurrency": must be a positive integer.'}), 400
+    if stream is not None and not isinstance(stream, bool): return jsonify({'error': 'Invalid "stream": must be a boolean.'}), 400
+    if token_budget is not None and (not isinstance(token_budget, int) or isinstance(token_budget, bool) or token_budget < 0):
+        return jsonify({'error': 'Invalid "token_budget": must be a non-negative integer.'}), 400
+    if cost_budget is not None and (not isinstance(cost_budget, (int, float)) or isinstance(cost_budget, bool) or cost_budget < 0):
+        return jsonify({'error': 'Invalid "cost_budget": must be a non-negative number.'}), 400
+    if not isinstance(dry_run, bool): return jsonify({'error': 'Invalid "dry_run": must be a boolean.'}), 400
 
     # Find the provider config from loaded CONFIG
     # Important: Use the main CONFIG here, not just enabled_providers sent to frontend
@@ -156,9 +222,23 @@ def process_docs_start():
     # Check if the selected model is valid for the provider
     if not any(m['id'] == model_id for m in provider_config.get('models', [])):
         return jsonify({'error': f'Model "{model_id}" not found for provider "{provider_id}".'}), 400
+    if cost_budget and not token_usage.get_pricing(provider_config, model_id):
+        return jsonify({'error': f'No pricing configured for "{provider_id}/{model_id}"; "cost_budget" needs it.'}), 400
+
+    # Pre-flight estimate from the tree's file sizes (no content is fetched); the task reuses the tree maps
+    blob_shas = blob_sizes = None
+    try:
+        blob_shas = github_service.get_blob_shas(owner, repo, branch)
+        blob_sizes = github_service.get_blob_sizes(owner, repo, branch)
+        estimate = estimate_task_usage(analysis_mode, scope, user_prompt, owner, repo, branch, provider_config, model_id, blob_shas, blob_sizes)
+    except Exception as e:
+        print(f"Warning: Could not estimate usage for the task: {e}")
+        estimate = None
+    if dry_run:
+        return jsonify({'estimate': estimate}), 200
 
-    # Check API key status for the *selected* provider before starting task
-    provider_ok, provider_error_obj = llm_service.check_provider_config(provider_config)
+    # Check API key status for the *selected* provider before starting task (cached; live only when missing/stale)
+    provider_ok, provider_error_obj = health.check_provider_cached(provider_config)
     if not provider_ok:
         error_message = provider_error_obj.get('message', 'Provider configuration check failed.')
         return jsonify({'error': error_message}), 503
@@ -167,6 +247,29 @@ def process_docs_start():
     task_id = str(uuid.uuid4())
     print(f"Received request to start task {task_id} for mode '{analysis_mode}' using {provider_id}/{model_id}")
     if task_id in cancelled_tasks: del cancelled_tasks[task_id]
+    # Persist the parameters (provider by id, never its key) so the task can be resumed after a restart.
+    # A broken store (locked or unwritable database) doesn't block the task, it just can't be resumed.
+    persisted = True
+    try:
+        task_store.create_task(task_id, {
+            'analysis_mode': analysis_mode,
+            'scope': scope,
+            'user_prompt': user_prompt,
+            'owner': owner,
+            'repo': repo,
+            'branch': branch,
+            'provider_id': provider_id,
+            'model_id': model_id,
+            'max_concurrency': max_concurrency,
+            'stream': stream,
+            'base_ref': base_ref,
+            'previous_task_id': previous_task_id,
+            'token_budget': token_budget,
+            'cost_budget': cost_budget,
+        })
+    except Exception as e:
+        print(f"Warning: Could not persist task {task_id}, running it without checkpoints: {e}")
+        persisted = False
 
     # Use the socketio instance obtained from app context
     socketio_instance.start_background_task(
@@ -180,9 +283,94 @@ def process_docs_start():
         repo=repo,
         branch=branch,
         provider_config=provider_config, # Pass full config for selected provider
-        model_id=model_id
+        model_id=model_id,
+        max_concurrency=max_concurrency,
+        stream=stream,
+        base_ref=base_ref,
+        previous_task_id=previous_task_id,
+        token_budget=token_budget,
+        cost_budget=cost_budget,
+        blob_shas=blob_shas or None,  # Empty when the tree was unavailable; the task fetches it again
+        blob_sizes=blob_sizes or None
     )
-    return jsonify({'message': 'Analysis task started', 'task_id': task_id}), 202
+    return jsonify({
+        'message': 'Analysis task started', 'task_id': task_id, 'max_concurrency': resolve_max_concurrency(max_concurrency), 'estimate': estimate,
+        'persisted': persisted,
+    }), 202
+
+
+@api_bp.route('/tasks/<task_id>', methods=['GET'])
+def get_task(task_id):
+    """Returns a stored task's status, parameters and checkpointed results."""
+    task = task_store.get_task(task_id)
+    if not task:
+        return jsonify({'error': f'Task "{task_id}" not found.'}), 404
+    task['results'] = task_store.get_results(task_id)
+    return jsonify(task)
+
+
+@api_bp.route('/tasks/<task_id>/results', methods=['GET'])
+def get_task_results(task_id):
+    """
+    Downloads a per-file task's results, streamed from its NDJSON file (one result per line,
+    in completion order; readable while the task runs). Supports Range requests. Optional
+    query params: limit + cursor return a JSON page instead, format=parquet the Parquet export.
+    """
+    if result_export is None or not task_store.get_task(task_id):
+        return jsonify({'error': f'Task "{task_id}" not found.'}), 404
+    try:
+        ndjson_path = result_export.ndjson_path(task_id)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if not ndjson_path.exists():
+        return jsonify({'error': f'Task "{task_id}" has no per-file results file.'}), 404
+
+    if request.args.get('format', 'ndjson') == 'parquet':
+        parquet_path = result_export.parquet_path(task_id)
+        try:
+            if not parquet_path.exists() or parquet_path.stat().st_mtime < ndjson_path.stat().st_mtime:
+                result_export.export_parquet(task_id)  # Missing or stale (the task wrote more results since)
+        except result_export.ParquetUnavailable as e:
+            return jsonify({'error': str(e)}), 501
+        return send_file(parquet_path, mimetype='application/vnd.apache.parquet', as_attachment=True,
+                         download_name=f'{task_id}.parquet', conditional=True)
+
+    limit = request.args.get('limit')
+    if limit is None:
+        # Whole file (or the requested byte ranges), streamed from disk
+        return send_file(ndjson_path, mimetype='application/x-ndjson', as_attachment=True,
+                         download_name=f'{task_id}.ndjson', conditional=True)
+    cursor = request.args.get('cursor', '0')
+    if not limit.isdigit() or int(limit) < 1:
+        return jsonify({'error': 'Invalid "limit": must be a positive integer.'}), 400
+    if not cursor.isdigit():
+        return jsonify({'error': 'Invalid "cursor".'}), 400
+    limit, offset = min(int(limit), MAX_RESULTS_PAGE_SIZE), int(cursor)  # The cursor is a byte offset into the file
+    try:
+        lines = list(result_export.iter_results(task_id, offset=offset, limit=limit))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    results = [json.loads(line) for _, line in lines]
+    return jsonify({
+        'task_id': task_id,
+        'results': results,
+        'next_cursor': str(lines[-1][0]) if len(results) == limit else None,
+    })
+
+
+@api_bp.route('/tasks/<task_id>/resume', methods=['POST'])
+def resume_stored_task(task_id):
+    """Restarts an interrupted, cancelled or failed task from its last checkpoint."""
+    socketio_instance = current_app.extensions.get('socketio')
+    if not socketio_instance:
+        print("CRITICAL: SocketIO instance not found in app extensions.")
+        return jsonify({'error': 'Server configuration error: SocketIO not initialized.'}), 500
+    if not task_store.get_task(task_id):
+        return jsonify({'error': f'Task "{task_id}" not found.'}), 404
+    ok, error_message = resume_task(socketio_instance, task_id)
+    if not ok:
+        return jsonify({'error': error_message}), 409
+    return jsonify({'message': 'Analysis task resumed', 'task_id': task_id}), 202
 
 
 @api_bp.route('/version', methods=['GET'])
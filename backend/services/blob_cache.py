@@ -0,0 +1,139 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+# Import the loaded config for cache location and size cap
+try:
+    from config import CONFIG
+except ImportError:
+    print("ERROR: Could not import CONFIG from config.py in blob_cache.py.")
+    CONFIG = {'cache': {}}  # Fallback
+
+CACHE_CONFIG = CONFIG.get('cache', {}) or {}
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+BLOB_CACHE_DIR = Path(CACHE_CONFIG.get('blob_dir') or BACKEND_DIR / '.cache' / 'blobs')
+if not BLOB_CACHE_DIR.is_absolute():
+    BLOB_CACHE_DIR = BACKEND_DIR / BLOB_CACHE_DIR
+BLOB_CACHE_MAX_BYTES = int(CACHE_CONFIG.get('blob_max_mb', 512)) * 1024 * 1024
+
+# sha -> size in bytes, least recently used first. Loaded lazily from disk.
+_index = None
+_total_bytes = 0
+_lock = threading.Lock()
+
+
+def git_blob_sha(data):
+    """Computes the git object id of a blob, matching the 'sha' GitHub reports in trees."""
+    header = f"blob {len(data)}\0".encode()
+    return hashlib.sha1(header + data).hexdigest()
+
+
+def _blob_path(sha):
+    return BLOB_CACHE_DIR / sha[:2] / sha
+
+
+def _load_index():
+    """Builds the LRU index from files on disk, oldest modification time first."""
+    global _index, _total_bytes
+    entries = []
+    if BLOB_CACHE_DIR.is_dir():
+        for path in BLOB_CACHE_DIR.glob('??/*'):
+            if path.is_file() and not path.name.endswith('.tmp'):
+                stat = path.stat()
+                entries.append((stat.st_mtime, path.name, stat.st_size))
+    entries.sort()
+    _index = OrderedDict((sha, size) for _, sha, size in entries)
+    _total_bytes = sum(_index.values())
+    print(f"Blob cache loaded: {len(_index)} blobs, {_total_bytes / (1024 * 1024):.1f} MB in {BLOB_CACHE_DIR}")
+
+
+def _evict_locked():
+    global _total_bytes
+    while _total_bytes > BLOB_CACHE_MAX_BYTES and _index:
+        sha, size = _index.popitem(last=False)
+        _total_bytes -= size
+        try:
+            _blob_path(sha).unlink()
+        except FileNotFoundError:
+            pass
+
+
+def get(sha):
+    """Returns cached blob bytes for sha, or None. Marks the blob as recently used."""
+    if not sha:
+        return None
+    with _lock:
+        if _index is None:
+            _load_index()
+        if sha not in _index:
+            return None
+        _index.move_to_end(sha)
+    path = _blob_path(sha)
+    try:
+        data = path.read_bytes()
+        os.utime(path)  # Persist recency for the next index load
+        return data
+    except FileNotFoundError:
+        with _lock:
+            _forget_locked(sha)
+        return None
+
+
+def _forget_locked(sha):
+    global _total_bytes
+    size = _index.pop(sha, None)
+    if size is not None:
+        _total_bytes -= size
+
+
+def contains(sha):
+    """Returns True if a blob with this sha is cached, without reading it."""
+    if not sha:
+        return False
+    with _lock:
+        if _index is None:
+            _load_index()
+        return sha in _index
+
+
+def put(sha, data):
+    """Stores blob bytes under sha (verified against the content), evicting LRU blobs over the size cap."""
+    global _total_bytes
+    if not sha or data is None:
+        return False
+    if git_blob_sha(data) != sha:
+        print(f"Warning: Refusing to cache blob {sha}: content hash does not match.")
+        return False
+    if len(data) > BLOB_CACHE_MAX_BYTES:
+        return False
+    path = _blob_path(sha)
+    with _lock:
+        if _index is None:
+            _load_index()
+        if sha in _index:
+            _index.move_to_end(sha)
+            return True
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{sha}.{threading.get_ident()}.tmp")
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)  # Atomic, so readers never see partial blobs
+    except OSError as e:
+        print(f"Warning: Could not write blob {sha} to cache: {e}")
+        return False
+    with _lock:
+        if sha not in _index:
+            _index[sha] = len(data)
+            _total_bytes += len(data)
+        _evict_locked()
+    return True
+
+
+def get_stats():
+    """Returns blob count and size for status reporting."""
+    with _lock:
+        if _index is None:
+            _load_index()
+        return {'blobs': len(_index), 'bytes': _total_bytes, 'max_bytes': BLOB_CACHE_MAX_BYTES}
@@ -0,0 +1,134 @@
+import threading
+from contextlib import contextmanager
+
+# Import the loaded config for the cancel polling interval
+try:
+    from config import CONFIG
+except ImportError:
+    print("ERROR: Could not import CONFIG from config.py in cancellation.py.")
+    CONFIG = {'analysis': {}}  # Fallback
+
+# How often a running task polls its (shared-state) cancellation flag
+CANCEL_POLL_SECONDS = max(0.05, float((CONFIG.get('analysis', {}) or {}).get('cancel_poll_ms', 250)) / 1000.0)
+
+_local = threading.local()
+
+
+class TaskCancelled(Exception):
+    """Raised inside a task's fetches and LLM calls once the task has been cancelled."""
+    metric_outcome = 'cancelled'  # Label used by metrics.timed
+
+
+class CancelToken:
+    """
+    Cooperative cancellation for one task. Long-running work checks `cancelled` (or calls
+    raise_if_cancelled()) between steps, and registers on_cancel() callbacks that abort
+    blocking I/O right away, e.g. closing a response or stream, or cancelling a future.
+    """
+
+    def __init__(self, name=None):
+        self.name = name
+        self._event = threading.Event()
+        self._callbacks = {}  # handle -> callback
+        self._next_handle = 0
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def cancel(self):
+        """Marks the token cancelled and runs the registered callbacks (once)."""
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks = list(self._callbacks.values())
+            self._callbacks.clear()
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"Warning: Cancel callback for {self.name} failed: {e}")
+
+    def on_cancel(self, callback):
+        """
+        Runs callback when the token is cancelled (at once if it already is).
+        Returns a handle for remove_callback(), or None if it ran immediately.
+        """
+        with self._lock:
+            if not self._event.is_set():
+                self._next_handle += 1
+                self._callbacks[self._next_handle] = callback
+                return self._next_handle
+        callback()
+        return None
+
+    def remove_callback(self, handle):
+        if handle is not None:
+            with self._lock:
+                self._callbacks.pop(handle, None)
+
+    @contextmanager
+    def registered(self, callback):
+        """Keeps callback registered for the duration of the block."""
+        handle = self.on_cancel(callback)
+        try:
+            yield
+        finally:
+            self.remove_callback(handle)
+
+    def wait(self, timeout):
+        """Sleeps up to timeout seconds, waking early on cancel. Returns True if cancelled."""
+        return self._event.wait(timeout)
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise TaskCancelled(f"Task {self.name} was cancelled.")
+
+    def watch(self, is_cancelled, interval=None):
+        """
+        Polls is_cancelled() (e.g. the shared-state flag a cancel request sets) on a daemon
+        thread and cancels the token when it returns True. Stopped by close().
+        """
+        interval = CANCEL_POLL_SECONDS if interval is None else interval
+
+        def poll():
+            while not self._closed.wait(interval):
+                try:
+                    if is_cancelled():
+                        print(f"Cancelling in-flight work for task {self.name}.")
+                        self.cancel()
+                        return
+                except Exception as e:
+                    print(f"Warning: Could not poll cancellation for task {self.name}: {e}")
+
+        threading.Thread(target=poll, name=f'cancel-watch-{str(self.name)[:8]}', daemon=True).start()
+        return self
+
+    def close(self):
+        """Stops the watcher; the token keeps its current state."""
+        self._closed.set()
+
+
+def current():
+    """The CancelToken bound to this thread, or None."""
+    return getattr(_local, 'token', None)
+
+
+def set_current(token):
+    """Binds token to this thread (None unbinds). Returns the previously bound token."""
+    previous = current()
+    _local.token = token
+    return previous
+
+
+@contextmanager
+def bound(token):
+    """Binds token to this thread for the duration of the block (for worker threads)."""
+    previous = set_current(token)
+    try:
+        yield token
+    finally:
+        set_current(previous)
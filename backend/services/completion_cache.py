@@ -0,0 +1,131 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+# Import the loaded config for cache location, TTL and size
+try:
+    from config import CONFIG
+except ImportError:
+    print("ERROR: Could not import CONFIG from config.py in completion_cache.py.")
+    CONFIG = {'cache': {}}  # Fallback
+
+CACHE_CONFIG = CONFIG.get('cache', {}) or {}
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+COMPLETION_CACHE_ENABLED = bool(CACHE_CONFIG.get('completion_cache_enabled', True))
+COMPLETION_CACHE_PATH = Path(CACHE_CONFIG.get('completion_db') or BACKEND_DIR / '.cache' / 'completions.sqlite3')
+if not COMPLETION_CACHE_PATH.is_absolute():
+    COMPLETION_CACHE_PATH = BACKEND_DIR / COMPLETION_CACHE_PATH
+COMPLETION_TTL_SECONDS = float(CACHE_CONFIG.get('completion_ttl_hours', 168)) * 3600
+COMPLETION_MAX_ENTRIES = int(CACHE_CONFIG.get('completion_max_entries', 20000))
+# Run eviction every N writes rather than on each one
+_EVICT_EVERY = 100
+
+_conn = None
+_lock = threading.Lock()
+_writes_since_evict = 0
+
+
+def _get_conn():
+    """Opens (and creates) the SQLite cache on first use. Caller must hold _lock."""
+    global _conn
+    if _conn is None:
+        COMPLETION_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(COMPLETION_CACHE_PATH, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS completions (
+                key TEXT PRIMARY KEY,
+                provider_id TEXT NOT NULL,
+                model_id TEXT NOT NULL,
+                response TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_completions_last_used ON completions (last_used)')
+        conn.commit()
+        _conn = conn
+    return _conn
+
+
+def _normalise_messages(prompt_messages):
+    """Drops formatting noise (line endings, trailing whitespace) that does not change the prompt."""
+    normalised = []
+    for msg in prompt_messages:
+        content = str(msg.get('content', '')).replace('\r\n', '\n')
+        content = '\n'.join(line.rstrip() for line in content.split('\n')).strip()
+        normalised.append({'role': msg.get('role'), 'content': content})
+    return normalised
+
+
+def make_key(provider_id, model_id, prompt_messages, blob_sha=None, **kwargs):
+    """Builds the cache key from provider, model, a hash of the normalised messages, the source blob sha and call kwargs."""
+    messages_hash = hashlib.sha256(
+        json.dumps(_normalise_messages(prompt_messages), sort_keys=True, ensure_ascii=False).encode('utf-8')
+    ).hexdigest()
+    key_material = json.dumps({
+        'provider_id': provider_id,
+        'model_id': model_id,
+        'messages': messages_hash,
+        'blob_sha': blob_sha,
+        'kwargs': kwargs,
+    }, sort_keys=True, default=str)
+    return hashlib.sha256(key_material.encode('utf-8')).hexdigest()
+
+
+def get(key):
+    """Returns the cached response text for key, or None if missing, expired or disabled."""
+    if not COMPLETION_CACHE_ENABLED:
+        return None
+    now = time.time()
+    try:
+        with _lock:
+            conn = _get_conn()
+            row = conn.execute('SELECT response, created_at FROM completions WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > COMPLETION_TTL_SECONDS:
+                conn.execute('DELETE FROM completions WHERE key = ?', (key,))
+                conn.commit()
+                return None
+            conn.execute('UPDATE completions SET last_used = ? WHERE key = ?', (now, key))
+            conn.commit()
+            return row[0]
+    except sqlite3.Error as e:
+        print(f"Warning: Completion cache read failed: {e}")
+        return None
+
+
+def put(key, provider_id, model_id, response):
+    """Stores a successful completion, evicting expired and least recently used entries periodically."""
+    global _writes_since_evict
+    if not COMPLETION_CACHE_ENABLED or response is None:
+        return
+    now = time.time()
+    try:
+        with _lock:
+            conn = _get_conn()
+            conn.execute(
+                'INSERT OR REPLACE INTO completions (key, provider_id, model_id, response, created_at, last_used) VALUES (?, ?, ?, ?, ?, ?)',
+                (key, provider_id, model_id, response, now, now)
+            )
+            _writes_since_evict += 1
+            if _writes_since_evict >= _EVICT_EVERY:
+                _evict_locked(conn, now)
+                _writes_since_evict = 0
+            conn.commit()
+    except sqlite3.Error as e:
+        print(f"Warning: Completion cache write failed: {e}")
+
+
+def _evict_locked(conn, now):
+    conn.execute('DELETE FROM completions WHERE created_at < ?', (now - COMPLETION_TTL_SECONDS,))
+    (count,) = conn.execute('SELECT COUNT(*) FROM completions').fetchone()
+    if count > COMPLETION_MAX_ENTRIES:
+        conn.execute(
+            'DELETE FROM completions WHERE key IN (SELECT key FROM completions ORDER BY last_used ASC LIMIT ?)',
+            (count - COMPLETION_MAX_ENTRIES,)
+        )
@@ -0,0 +1,243 @@
+import threading
+
+from services import github_service, blob_cache, cancellation
+
+# Import the loaded config for source selection thresholds
+try:
+    from config import CONFIG
+except ImportError:
+    print("ERROR: Could not import CONFIG from config.py in content_sources.py.")
+    CONFIG = {'content_sources': {}}  # Fallback
+
+CONTENT_SOURCES_CONFIG = CONFIG.get('content_sources', {}) or {}
+# Scopes with at least this many files missing from the blob cache are read from one tarball
+ARCHIVE_MIN_FILES = int(CONTENT_SOURCES_CONFIG.get('archive_min_files', 200))
+# Medium scopes (between these bounds) are fetched in batched GraphQL queries
+GRAPHQL_MIN_FILES = int(CONTENT_SOURCES_CONFIG.get('graphql_min_files', 20))
+GRAPHQL_BATCH_SIZE = max(1, int(CONTENT_SOURCES_CONFIG.get('graphql_batch_size', 50)))
+# Read-ahead for sequential analysis: files fetched ahead of the one being analysed,
+# capped by total buffered size (characters of decoded text, ~bytes for typical docs)
+PREFETCH_FILES = max(0, int(CONTENT_SOURCES_CONFIG.get('prefetch_files', 4)))
+PREFETCH_MAX_BYTES = max(1, int(CONTENT_SOURCES_CONFIG.get('prefetch_max_mb', 8) * 1024 * 1024))
+
+
+class PerFileContentSource:
+    """Fetches each file on demand (blob cache first, then the GitHub API)."""
+
+    name = 'per_file'
+
+    def __init__(self, blob_shas):
+        self.blob_shas = blob_shas
+
+    def __call__(self, owner, repo, file_path, branch):
+        return github_service.fetch_file_content(owner, repo, file_path, branch, sha=self.blob_shas.get(file_path))
+
+
+class ArchiveContentSource(PerFileContentSource):
+    """
+    Serves uncached files from a single branch tarball, downloaded lazily on first use
+    on a background thread. Extracted files go straight to the blob cache and only their
+    SHAs are kept here, so memory doesn't grow with the scope; each file can be taken as
+    soon as it has been extracted. Anything the archive could not provide falls back to
+    a per-file fetch. The download runs under the first caller's cancellation token.
+    """
+
+    name = 'archive'
+
+    def __init__(self, owner, repo, branch, paths, blob_shas):
+        super().__init__(blob_shas)
+        self.owner, self.repo, self.branch = owner, repo, branch
+        self.paths = set(paths)
+        self._extracted = {}  # path -> blob sha, for files in the blob cache not yet handed out
+        self._started = False
+        self._done = False
+        self._stopped = False
+        self._cond = threading.Condition()
+
+    def _ensure_started(self):
+        with self._cond:
+            if self._started:
+                return
+            self._started = True
+        cancel_token = cancellation.current()
+        threading.Thread(target=self._download, args=(cancel_token,), name='content-archive', daemon=True).start()
+
+    def _download(self, cancel_token):
+        try:
+            with cancellation.bound(cancel_token):
+                github_service.fetch_archive_contents(self.owner, self.repo, self.branch, self.paths, on_file=self._on_file)
+        except Exception as e:
+            print(f"Archive download for '{self.owner}/{self.repo}' failed: {e}")
+        finally:
+            with self._cond:
+                self._done = True
+                self._cond.notify_all()
+
+    def _on_file(self, path, sha):
+        with self._cond:
+            self._extracted[path] = sha
+            self._cond.notify_all()
+            return not self._stopped
+
+    def __call__(self, owner, repo, file_path, branch):
+        sha = None
+        if (owner, repo, branch) == (self.owner, self.repo, self.branch) and file_path in self.paths:
+            self._ensure_started()
+            cancel_token = cancellation.current()
+            with self._cond:
+                while file_path not in self._extracted and not self._done:
+                    if cancel_token is not None:
+                        cancel_token.raise_if_cancelled()
+                    self._cond.wait(cancellation.CANCEL_POLL_SECONDS)
+                sha = self._extracted.pop(file_path, None)
+        if sha:
+            # Served from the blob cache the archive was extracted into
+            return github_service.fetch_file_content(owner, repo, file_path, branch, sha=sha)
+        return super().__call__(owner, repo, file_path, branch)
+
+    def stop(self):
+        """Stops the archive download after the file being extracted."""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+
+
+class GraphQLContentSource(PerFileContentSource):
+    """
+    Serves uncached files from batched GraphQL queries. A batch is fetched the first
+    time one of its paths is requested, so memory holds at most a few batches.
+    """
+
+    name = 'graphql'
+
+    def __init__(self, owner, repo, branch, paths, blob_shas, batch_size=None):
+        super().__init__(blob_shas)
+        self.owner, self.repo, self.branch = owner, repo, branch
+        batch_size = batch_size or GRAPHQL_BATCH_SIZE
+        self._batches = [paths[i:i + batch_size] for i in range(0, len(paths), batch_size)]
+        self._batch_of = {path: i for i, batch in enumerate(self._batches) for path in batch}
+        self._batch_locks = [threading.Lock() for _ in self._batches]
+        self._contents = {}
+        self._loaded = set()
+        self._lock = threading.Lock()
+
+    def _ensure_batch(self, batch_index):
+        with self._batch_locks[batch_index]:
+            if batch_index in self._loaded:
+                return
+            contents = github_service.fetch_contents_graphql(self.owner, self.repo, self.branch, self._batches[batch_index]) or {}
+            with self._lock:
+                self._contents.update(contents)
+                self._loaded.add(batch_index)
+
+    def __call__(self, owner, repo, file_path, branch):
+        batch_index = self._batch_of.get(file_path)
+        if batch_index is not None and (owner, repo, branch) == (self.owner, self.repo, self.branch):
+            self._ensure_batch(batch_index)
+            with self._lock:
+                if file_path in self._contents:
+                    return self._contents.pop(file_path)
+        return super().__call__(owner, repo, file_path, branch)
+
+
+class PrefetchingContentSource:
+    """
+    Wraps another source and reads ahead through an ordered list of paths on a
+    producer thread, so downloads overlap the LLM work on the current file. The
+    buffer is bounded by file count and total size (one oversized file is still
+    let through so the producer can't stall). Paths requested before the producer
+    got to them are fetched directly and skipped by the producer. The producer runs
+    under the creating thread's cancellation token and stops once it is cancelled.
+    """
+
+    def __init__(self, source, owner, repo, branch, paths, max_files=None, max_bytes=None):
+        self.source = source
+        self.name = f"{getattr(source, 'name', 'custom')}+prefetch"
+        self.owner, self.repo, self.branch = owner, repo, branch
+        self.max_files = max(1, max_files or PREFETCH_FILES)
+        self.max_bytes = max_bytes or PREFETCH_MAX_BYTES
+        self._paths = list(paths)
+        self._next = 0
+        self._buffer = {}  # path -> content (None = fetch failed)
+        self._buffered_bytes = 0
+        self._in_progress = None
+        self._taken = set()
+        self._stopped = False
+        self._cond = threading.Condition()
+        self._cancel_token = cancellation.current()
+        self._thread = threading.Thread(target=self._produce, name='content-prefetch', daemon=True)
+        self._thread.start()
+
+    def _is_full(self):
+        return len(self._buffer) >= self.max_files or (self._buffer and self._buffered_bytes >= self.max_bytes)
+
+    def _produce(self):
+        with cancellation.bound(self._cancel_token):
+            self._produce_all()
+
+    def _produce_all(self):
+        while True:
+            with self._cond:
+                while not self._stopped and self._is_full():
+                    self._cond.wait()
+                while self._next < len(self._paths) and self._paths[self._next] in self._taken:
+                    self._next += 1
+                if self._stopped or self._next >= len(self._paths) or (self._cancel_token and self._cancel_token.cancelled):
+                    return
+                file_path = self._paths[self._next]
+                self._next += 1
+                self._in_progress = file_path
+
+            try:
+                content = self.source(self.owner, self.repo, file_path, self.branch)
+            except cancellation.TaskCancelled:
+                content = None  # The task is stopping; whoever takes this file sees the cancel too
+            except Exception as e:
+                print(f"Prefetch of {file_path} failed: {e}")
+                content = None
+
+            with self._cond:
+                self._in_progress = None
+                if not self._stopped and file_path not in self._taken:
+                    self._buffer[file_path] = content
+                    self._buffered_bytes += len(content or '')
+                self._cond.notify_all()
+
+    def __call__(self, owner, repo, file_path, branch):
+        if (owner, repo, branch) == (self.owner, self.repo, self.branch):
+            with self._cond:
+                # Wait if the producer is downloading this very file right now
+                while self._in_progress == file_path and file_path not in self._buffer:
+                    self._cond.wait()
+                self._taken.add(file_path)
+                if file_path in self._buffer:
+                    content = self._buffer.pop(file_path)
+                    self._buffered_bytes -= len(content or '')
+                    self._cond.notify_all()
+                    return content
+        return self.source(owner, repo, file_path, branch)
+
+    def stop(self):
+        """Stops reading ahead and drops anything buffered."""
+        with self._cond:
+            self._stopped = True
+            self._buffer.clear()
+            self._buffered_bytes = 0
+            self._cond.notify_all()
+        if hasattr(self.source, 'stop'):
+            self.source.stop()
+
+
+def make_content_source(owner, repo, branch, scope, blob_shas):
+    """
+    Picks how a task reads file contents, based on how much of the scope is not cached yet.
+    The returned callable has the same signature as github_service.fetch_file_content.
+    """
+    uncached = [path for path in scope if not blob_cache.contains(blob_shas.get(path))]
+    if len(uncached) >= ARCHIVE_MIN_FILES:
+        print(f"Using archive content source for {len(uncached)} uncached files in '{owner}/{repo}' branch '{branch}'.")
+        return ArchiveContentSource(owner, repo, branch, uncached, blob_shas)
+    if len(uncached) >= GRAPHQL_MIN_FILES and github_service.GITHUB_TOKEN:
+        print(f"Using GraphQL content source for {len(uncached)} uncached files in '{owner}/{repo}' branch '{branch}'.")
+        return GraphQLContentSource(owner, repo, branch, uncached, blob_shas)
+    return PerFileContentSource(blob_shas)
@@ -0,0 +1,89 @@
+import threading
+import time
+
+from services import metrics
+
+# Import the loaded config for the batching window
+try:
+    from config import CONFIG
+except ImportError:
+    print("ERROR: Could not import CONFIG from config.py in event_batcher.py.")
+    CONFIG = {'analysis': {}}  # Fallback
+
+# Progress, results and streamed tokens emitted within this window go out as one
+# 'event_batch' event (0 = emit every event on its own, as before)
+EVENT_BATCH_SECONDS = max(0.0, float((CONFIG.get('analysis', {}) or {}).get('event_batch_ms', 100)) / 1000.0)
+
+
+class BatchingEmitter:
+    """
+    Stands in for socketio when emitting a task's events. 'progress_update' (only the
+    latest is kept), 'partial_result' and 'partial_token' (consecutive tokens for the same
+    file are concatenated) are buffered and flushed as a single 'event_batch'
+    {tokens, results, progress} at most every `window` seconds. Any other event flushes
+    the buffer first, so ordering relative to final_result/task_finished is preserved.
+    """
+
+    BATCHED_EVENTS = ('progress_update', 'partial_result', 'partial_token')
+
+    def __init__(self, socketio, room, window=None):
+        self.socketio = socketio
+        self.room = room
+        self.window = EVENT_BATCH_SECONDS if window is None else window
+        self._lock = threading.Lock()
+        self._tokens, self._results, self._progress = [], [], None
+        self._closed = threading.Event()
+        self._flusher = None
+        if self.window > 0:
+            self._flusher = threading.Thread(target=self._flush_loop, name=f'event-batch-{str(room)[:8]}', daemon=True)
+            self._flusher.start()
+
+    def emit(self, event, data, room=None):
+        if self.window <= 0 or event not in self.BATCHED_EVENTS:
+            self.flush()
+            self._emit(event, data, room or self.room)
+            return
+        metrics.SOCKETIO_COALESCED_EVENTS.inc(event=event)
+        with self._lock:
+            if event == 'progress_update':
+                self._progress = data
+            elif event == 'partial_result':
+                self._results.append(data)
+            else:
+                last = self._tokens[-1] if self._tokens else None
+                if last is not None and last.get('path') == data.get('path') and last.get('index') == data.get('index'):
+                    last['token'] += data['token']
+                else:
+                    self._tokens.append(dict(data))
+
+    def sleep(self, seconds):
+        self.socketio.sleep(seconds)
+
+    def flush(self):
+        with self._lock:
+            if not (self._tokens or self._results or self._progress):
+                return
+            batch = {'tokens': self._tokens, 'results': self._results, 'progress': self._progress}
+            self._tokens, self._results, self._progress = [], [], None
+            # Emit under the lock so concurrent flushes can't reorder batches
+            self._emit('event_batch', batch, self.room)
+
+    def _emit(self, event, data, room):
+        started = time.perf_counter()
+        try:
+            self.socketio.emit(event, data, room=room)
+        finally:
+            metrics.SOCKETIO_EMIT_SECONDS.observe(time.perf_counter() - started, event=event)
+            metrics.SOCKETIO_EVENTS.inc(event=event)
+
+    def _flush_loop(self):
+        while not self._closed.wait(self.window):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Warning: Could not flush event batch for room {self.room}: {e}")
+
+    def close(self):
+        """Stops the periodic flusher and sends anything still buffered."""
+        self._closed.set()
+        self.flush()
@@ -1,8 +1,14 @@
 # import os # Unused
 import requests
 import base64
+import tarfile
+import threading
+import time
+from collections import OrderedDict
 # from pathlib import Path # Unused
 
+from services import http_session, blob_cache, metrics
+
 # Import the loaded and substituted config
 try:
     from config import CONFIG
@@ -14,7 +20,20 @@ except ImportError:
 # Use .get for safety in case keys are missing
 GITHUB_CONFIG = CONFIG.get('github_defaults', {})
 GITHUB_TOKEN = GITHUB_CONFIG.get('token')  # This now holds the actual token value or None
-GITHUB_API_BASE = 'https://api.github.com'  # Keep this constant for now
+# Overridable so a GitHub Enterprise host or a local stub server can be used
+GITHUB_API_BASE = (GITHUB_CONFIG.get('api_base') or 'https://api.github.com').rstrip('/')
+GITHUB_GRAPHQL_URL = GITHUB_CONFIG.get('graphql_url') or f'{GITHUB_API_BASE}/graphql'
+
+_CACHE_CONFIG = CONFIG.get('cache', {}) or {}
+# Within this window a cached tree is served without even a conditional request
+TREE_REVALIDATE_SECONDS = float(_CACHE_CONFIG.get('tree_revalidate_seconds', 5))
+TREE_CACHE_MAX_ENTRIES = int(_CACHE_CONFIG.get('tree_cache_max_entries', 32))
+
+# Parsed trees per (owner, repo, branch): {'etag', 'sha', 'tree', 'validated_at'}
+_tree_cache = OrderedDict()
+_tree_cache_lock = threading.Lock()
+# One lock per tree key so concurrent callers share a single refresh
+_tree_refresh_locks = {}
 
 
 def get_github_headers():
@@ -27,17 +46,95 @@ def get_github_headers():
     return headers
 
 
-def fetch_file_content(owner, repo, file_path, branch):
-    """Fetches the content of a specific file from GitHub API."""
+def _decode_blob(data, label):
+    """Decodes blob bytes as UTF-8 text, returning None for binary/undecodable content."""
+    try:
+        return data.decode('utf-8')
+    except UnicodeDecodeError:
+        print(f"Warning: Content of '{label}' is not valid UTF-8 text.")
+        return None
+
+
+def fetch_blob(owner, repo, sha):
+    """Fetches raw blob bytes by git SHA, using the local blob cache first. Returns bytes or None."""
+    cached = blob_cache.get(sha)
+    if cached is not None:
+        return cached
+
+    api_url = f'{GITHUB_API_BASE}/repos/{owner}/{repo}/git/blobs/{sha}'
+    print(f"Fetching blob: {api_url}")  # Debug print
+    try:
+        headers = get_github_headers()
+        headers['Accept'] = 'application/vnd.github.raw'  # Raw bytes, no base64/JSON overhead
+        response = http_session.get(api_url, name='fetch_blob', headers=headers)
+        response.raise_for_status()
+        data = response.content
+        if not blob_cache.put(sha, data):
+            print(f"Warning: Blob {sha} for '{owner}/{repo}' was not cached.")
+        return data
+    except requests.exceptions.HTTPError as http_err:
+        print(f"HTTP error fetching blob {sha} for '{owner}/{repo}': {http_err}")
+        return None
+    except requests.exceptions.RequestException as req_err:
+        print(f"Request error fetching blob {sha} for '{owner}/{repo}': {req_err}")
+        return None
+
+
+def get_blob_shas(owner, repo, branch):
+    """Returns a {path: blob_sha} map for a branch, or an empty dict if the tree is unavailable."""
+    tree = fetch_repo_tree(owner, repo, branch)
+    if not tree:
+        return {}
+    return {item['path']: item['sha'] for item in tree if item.get('type') == 'blob' and item.get('sha')}
+
+
+def get_blob_sizes(owner, repo, branch):
+    """Returns a {path: size_in_bytes} map for a branch, or an empty dict if the tree is unavailable."""
+    tree = fetch_repo_tree(owner, repo, branch)
+    if not tree:
+        return {}
+    return {item['path']: item['size'] for item in tree if item.get('type') == 'blob' and item.get('size') is not None}
+
+
+def get_changed_paths(owner, repo, base_ref, head_ref):
+    """
+    Compares the trees of two refs. Returns the set of blob paths added or modified
+    in head_ref relative to base_ref, or None if either tree is unavailable.
+    """
+    base_shas = get_blob_shas(owner, repo, base_ref)
+    head_shas = get_blob_shas(owner, repo, head_ref)
+    if not base_shas or not head_shas:
+        return None
+    return {path for path, sha in head_shas.items() if base_shas.get(path) != sha}
+
+
+def _result_outcome(result):
+    return 'error' if result is None else 'success'
+
+
+@metrics.timed(metrics.GITHUB_REQUEST_SECONDS, outcome=_result_outcome, operation='fetch_file_content')
+def fetch_file_content(owner, repo, file_path, branch, sha=None):
+    """
+    Fetches the content of a specific file from GitHub API.
+    When the blob sha (from the repo tree) is known, the content is served from the
+    local blob cache or fetched by sha; otherwise the contents API is used.
+    """
+    if sha:
+        data = fetch_blob(owner, repo, sha)
+        if data is not None:
+            return _decode_blob(data, f'{owner}/{repo}/{file_path}')
+        print(f"Falling back to contents API for '{owner}/{repo}/{file_path}'.")
+
     api_url = f'{GITHUB_API_BASE}/repos/{owner}/{repo}/contents/{file_path}?ref={branch}'
     print(f"Fetching content: {api_url}")  # Debug print
     try:
-        response = requests.get(api_url, headers=get_github_headers())
+        response = http_session.get(api_url, name='fetch_file_content', headers=get_github_headers())
         response.raise_for_status()  # Raise HTTPError for bad responses (4xx or 5xx)
         data = response.json()
         if data.get('encoding') == 'base64' and 'content' in data:
             decoded_bytes = base64.b64decode(data['content'])
-            return decoded_bytes.decode('utf-8')
+            blob_cache.put(data.get('sha'), decoded_bytes)  # Warm the cache for the next run
+            return _decode_blob(decoded_bytes, f'{owner}/{repo}/{file_path}')
         elif 'content' in data:  # Handle potential non-base64 content if API provides it
             return data['content']
         else:
@@ -54,41 +151,204 @@ def fetch_file_content(owner, repo, file_path, branch):
         return None
 
 
+def _get_tree_refresh_lock(key):
+    with _tree_cache_lock:
+        return _tree_refresh_locks.setdefault(key, threading.Lock())
+
+
+def _store_tree(key, entry):
+    with _tree_cache_lock:
+        _tree_cache[key] = entry
+        _tree_cache.move_to_end(key)
+        while len(_tree_cache) > TREE_CACHE_MAX_ENTRIES:
+            evicted_key, _ = _tree_cache.popitem(last=False)
+            _tree_refresh_locks.pop(evicted_key, None)
+
+
+def get_cached_tree_entry(owner, repo, branch):
+    """Returns the cached tree entry ({'etag', 'sha', 'tree', 'validated_at'}) without any request, or None."""
+    with _tree_cache_lock:
+        return _tree_cache.get((owner, repo, branch))
+
+
+@metrics.timed(metrics.GITHUB_REQUEST_SECONDS, outcome=_result_outcome, operation='fetch_repo_tree')
 def fetch_repo_tree(owner, repo, branch):
-    """Fetches the file tree for a specific branch from GitHub API."""
+    """
+    Fetches the file tree for a specific branch from GitHub API.
+    Parsed trees are cached per (owner, repo, branch) and revalidated with
+    If-None-Match; a 304 reuses the cached tree and does not count against the
+    rate limit. Concurrent callers for the same tree share one refresh.
+    The returned list is shared with the cache and must not be mutated.
+    """
     # Validate branch name format (basic check)
     if not branch or not isinstance(branch, str) or '..' in branch or branch.startswith('-'):
         print(f"Warning: Invalid branch name format provided: '{branch}'")
         # Decide how to handle: return None, raise error, or default? Returning None for now.
         return None
 
-    api_url = f'{GITHUB_API_BASE}/repos/{owner}/{repo}/git/trees/{branch}?recursive=1'
-    print(f"Fetching tree: {api_url}")  # Debug print
+    key = (owner, repo, branch)
+    requested_at = time.monotonic()
+    with _get_tree_refresh_lock(key):
+        cached = get_cached_tree_entry(owner, repo, branch)
+        # Someone else refreshed while we waited for the lock, or the entry is still fresh
+        if cached and (cached['validated_at'] >= requested_at or time.monotonic() - cached['validated_at'] < TREE_REVALIDATE_SECONDS):
+            return cached['tree']
+
+        api_url = f'{GITHUB_API_BASE}/repos/{owner}/{repo}/git/trees/{branch}?recursive=1'
+        headers = get_github_headers()
+        if cached and cached.get('etag'):
+            headers['If-None-Match'] = cached['etag']
+        print(f"Fetching tree: {api_url}{' (conditional)' if 'If-None-Match' in headers else ''}")  # Debug print
+        try:
+            response = http_session.get(api_url, name='fetch_repo_tree', headers=headers)
+            if response.status_code == 304 and cached:
+                _store_tree(key, {**cached, 'validated_at': time.monotonic()})
+                return cached['tree']
+            response.raise_for_status()  # Raise HTTPError for bad responses (4xx or 5xx)
+            data = response.json()
+            if 'tree' not in data:
+                print(f"Warning: 'tree' key not found in response for '{owner}/{repo}' branch '{branch}'. Response: {data}")
+                return None
+            if data.get('truncated'):
+                print(f"Warning: Tree for '{owner}/{repo}' branch '{branch}' was truncated by GitHub.")
+            _store_tree(key, {
+                'etag': response.headers.get('ETag'),
+                'sha': data.get('sha'),
+                'tree': data['tree'],
+                'validated_at': time.monotonic(),
+            })
+            return data['tree']  # Return the list of tree objects
+        except requests.exceptions.HTTPError as http_err:
+            # Specifically check for 404 which likely means the branch/repo doesn't exist
+            if http_err.response.status_code == 404:
+                print(f"Error 404: Repository '{owner}/{repo}' or branch '{branch}' not found.")
+                with _tree_cache_lock:
+                    _tree_cache.pop(key, None)  # The branch is gone, don't serve it stale
+                return None
+            print(f"HTTP error fetching GitHub tree for '{owner}/{repo}' branch '{branch}': {http_err} - Response: {http_err.response.text}")
+        except requests.exceptions.RequestException as req_err:
+            print(f"Request error fetching GitHub tree for '{owner}/{repo}' branch '{branch}': {req_err}")
+        except Exception as e:
+            print(f"An unexpected error occurred while fetching repo tree for '{owner}/{repo}' branch '{branch}': {e}")
+
+        if cached:
+            print(f"Serving stale cached tree for '{owner}/{repo}' branch '{branch}'.")
+            return cached['tree']
+        return None
+
+
+@metrics.timed(metrics.GITHUB_REQUEST_SECONDS, outcome=_result_outcome, operation='fetch_archive')
+def fetch_archive_contents(owner, repo, branch, paths, on_file=None):
+    """
+    Downloads the branch tarball once and extracts only the requested paths into the
+    blob cache. The archive is stream-decompressed member by member (never held in
+    memory) and the download stops as soon as every requested path has been seen.
+    on_file(path, sha) is called as each file lands in the cache; returning False stops
+    the download early. Returns {path: blob_sha} for the files cached (paths missing
+    from the archive, or too large to cache, are left out), or None if the archive
+    could not be downloaded.
+    """
+    wanted = set(paths)
+    extracted = {}
+    seen = set()
+    api_url = f'{GITHUB_API_BASE}/repos/{owner}/{repo}/tarball/{branch}'
+    print(f"Fetching archive: {api_url} for {len(wanted)} files")  # Debug print
     try:
-        response = requests.get(api_url, headers=get_github_headers())
-        response.raise_for_status()  # Raise HTTPError for bad responses (4xx or 5xx)
-        data = response.json()
-        if 'tree' not in data:
-            print(f"Warning: 'tree' key not found in response for '{owner}/{repo}' branch '{branch}'. Response: {data}")
-            return None
-        return data['tree']  # Return the list of tree objects
+        response = http_session.get(api_url, name='fetch_archive', headers=get_github_headers(), stream=True)
+        with response:
+            response.raise_for_status()
+            response.raw.decode_content = True  # Undo any transfer Content-Encoding; the tar.gz itself is decoded below
+            with tarfile.open(fileobj=response.raw, mode='r|gz') as archive:
+                for member in archive:
+                    if not member.isfile():
+                        continue
+                    # Members are prefixed with a '<owner>-<repo>-<sha>/' directory
+                    _, _, path = member.name.partition('/')
+                    if path not in wanted or path in seen:
+                        continue
+                    seen.add(path)
+                    data = archive.extractfile(member).read()
+                    sha = blob_cache.git_blob_sha(data)
+                    cached = blob_cache.put(sha, data)
+                    del data  # Only the cached copy is kept
+                    if cached:
+                        extracted[path] = sha
+                        if on_file is not None and on_file(path, sha) is False:
+                            print(f"Archive download for '{owner}/{repo}' stopped early after {len(seen)} files.")
+                            break
+                    if len(seen) == len(wanted):
+                        break
+        print(f"Archive for '{owner}/{repo}' branch '{branch}' yielded {len(extracted)}/{len(wanted)} files.")
+        return extracted
     except requests.exceptions.HTTPError as http_err:
-        # Specifically check for 404 which likely means the branch/repo doesn't exist
-        if http_err.response.status_code == 404:
-            print(f"Error 404: Repository '{owner}/{repo}' or branch '{branch}' not found.")
-        else:
-            print(f"HTTP error fetching GitHub tree for '{owner}/{repo}' branch '{branch}': {http_err} - Response: {http_err.response.text}")
+        print(f"HTTP error fetching archive for '{owner}/{repo}' branch '{branch}': {http_err}")
         return None
     except requests.exceptions.RequestException as req_err:
-        print(f"Request error fetching GitHub tree for '{owner}/{repo}' branch '{branch}': {req_err}")
+        print(f"Request error fetching archive for '{owner}/{repo}' branch '{branch}': {req_err}")
         return None
-    except Exception as e:
-        print(f"An unexpected error occurred while fetching repo tree for '{owner}/{repo}' branch '{branch}': {e}")
+    except (tarfile.TarError, EOFError, OSError) as tar_err:
+        print(f"Error reading archive for '{owner}/{repo}' branch '{branch}': {tar_err}")
         return None
 
 
-def check_github_token():
-    """Checks the validity of the configured GitHub token loaded from config."""
+def _build_blob_query(count):
+    """Builds a repository query with one aliased object(expression:) field per path."""
+    variables = ''.join(f', $e{i}: String!' for i in range(count))
+    fields = '\n'.join(
+        f'    f{i}: object(expression: $e{i}) {{ ... on Blob {{ oid text isBinary isTruncated }} }}'
+        for i in range(count)
+    )
+    return f'query($owner: String!, $name: String!{variables}) {{\n  repository(owner: $owner, name: $name) {{\n{fields}\n  }}\n}}'
+
+
+@metrics.timed(metrics.GITHUB_REQUEST_SECONDS, outcome=_result_outcome, operation='fetch_graphql')
+def fetch_contents_graphql(owner, repo, branch, paths):
+    """
+    Fetches the text of many files in one GraphQL query using aliased
+    object(expression: "branch:path") fields. Expressions are passed as variables.
+    Returns {path: text} for blobs GitHub returned in full; binary, truncated or
+    missing paths are left out so the caller can fall back to a per-file fetch.
+    Returns None if the query failed outright (GraphQL requires a token).
+    """
+    if not GITHUB_TOKEN:
+        print("Warning: GraphQL content fetch requires a GITHUB_TOKEN; skipping.")
+        return None
+    paths = list(paths)
+    variables = {'owner': owner, 'name': repo}
+    variables.update({f'e{i}': f'{branch}:{path}' for i, path in enumerate(paths)})
+    payload = {'query': _build_blob_query(len(paths)), 'variables': variables}
+    headers = get_github_headers()
+    headers['Accept'] = 'application/json'
+    print(f"Fetching {len(paths)} files via GraphQL: {GITHUB_GRAPHQL_URL}")  # Debug print
+    try:
+        response = http_session.request('POST', GITHUB_GRAPHQL_URL, name='fetch_contents_graphql', headers=headers, json=payload)
+        response.raise_for_status()
+        body = response.json()
+    except requests.exceptions.HTTPError as http_err:
+        print(f"HTTP error fetching GraphQL contents for '{owner}/{repo}' branch '{branch}': {http_err}")
+        return None
+    except (requests.exceptions.RequestException, ValueError) as req_err:
+        print(f"Request error fetching GraphQL contents for '{owner}/{repo}' branch '{branch}': {req_err}")
+        return None
+
+    if body.get('errors'):
+        print(f"Warning: GraphQL errors for '{owner}/{repo}' branch '{branch}': {body['errors'][:3]}")
+    repository = (body.get('data') or {}).get('repository')
+    if repository is None:
+        return None
+
+    contents = {}
+    for i, path in enumerate(paths):
+        blob = repository.get(f'f{i}')
+        if not blob or blob.get('isBinary') or blob.get('isTruncated') or blob.get('text') is None:
+            continue
+        contents[path] = blob['text']
+        blob_cache.put(blob.get('oid'), blob['text'].encode('utf-8'))
+    return contents
+
+
+def check_github_token(timeout=None):
+    """Checks the validity of the configured GitHub token loaded from config. An optional timeout disables retries."""
     if not GITHUB_TOKEN:
         # Check if it was missing because the placeholder wasn't in config.yaml
         # or if the env var itself was missing. config.py logs the latter.
@@ -100,7 +360,7 @@ def check_github_token():
     masked_headers = {k: ('Authorization: token ***' if k.lower() == 'authorization' else v) for k, v in headers.items()}
 
     try:
-        response = requests.get(user_url, headers=headers)
+        response = http_session.get(user_url, name='check_github_token', headers=headers, timeout=timeout, max_retries=0 if timeout else None)
         response.raise_for_status()  # Raises HTTPError for 4xx/5xx
         print("GitHub token check successful.")
         return True, None  # Return True and no error object
@@ -0,0 +1,169 @@
+import concurrent.futures
+import threading
+import time
+
+from services import github_service, llm_service
+
+# Import the loaded config for probe schedule and provider list
+try:
+    from config import CONFIG
+except ImportError:
+    print("ERROR: Could not import CONFIG from config.py in health.py.")
+    CONFIG = {'health': {}, 'llm_providers': {'providers': []}}  # Fallback
+
+HEALTH_CONFIG = CONFIG.get('health', {}) or {}
+PROBE_INTERVAL_SECONDS = float(HEALTH_CONFIG.get('interval_seconds', 60))
+# Results older than this are reported as stale and trigger an out-of-band refresh
+STATUS_TTL_SECONDS = float(HEALTH_CONFIG.get('ttl_seconds', 180))
+PROBE_TIMEOUT_SECONDS = float(HEALTH_CONFIG.get('probe_timeout_seconds', 10))
+# Failed validations are trusted for a shorter time than successful ones
+NEGATIVE_TTL_SECONDS = float(HEALTH_CONFIG.get('negative_ttl_seconds', 30))
+
+GITHUB_KEY = 'github'
+
+# key ('github' or provider id) -> {'ok', 'error', 'checked_at'}
+_statuses = {}
+_statuses_lock = threading.Lock()
+_refresh_lock = threading.Lock()  # Only one probe round at a time
+_prober_started = False
+_prober_lock = threading.Lock()
+
+
+def _enabled_providers():
+    return [p for p in CONFIG.get('llm_providers', {}).get('providers', []) if p.get('enabled', True) and p.get('id')]
+
+
+def _store(key, ok, error):
+    with _statuses_lock:
+        _statuses[key] = {'ok': ok, 'error': error, 'checked_at': time.time()}
+
+
+def probe_all():
+    """Checks GitHub and every enabled provider in parallel, each bounded by probe_timeout_seconds."""
+    if not _refresh_lock.acquire(blocking=False):
+        # A round is already running; wait for it instead of starting another
+        with _refresh_lock:
+            return
+    try:
+        checks = {GITHUB_KEY: lambda: github_service.check_github_token(timeout=PROBE_TIMEOUT_SECONDS)}
+        for provider_config in _enabled_providers():
+            checks[provider_config['id']] = (lambda cfg: lambda: llm_service.check_provider_config(cfg, timeout=PROBE_TIMEOUT_SECONDS))(provider_config)
+
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(checks), thread_name_prefix='health-probe')
+        futures = {executor.submit(check): key for key, check in checks.items()}
+        done, not_done = concurrent.futures.wait(futures, timeout=PROBE_TIMEOUT_SECONDS + 2)
+        for future in done:
+            try:
+                ok, error = future.result()
+            except Exception as e:
+                ok, error = False, {"message": f"Health probe failed: {e}", "details": {"error_type": type(e).__name__, "message": str(e)}}
+            _store(futures[future], ok, error)
+        for future in not_done:
+            _store(futures[future], False, {"message": f"Health probe timed out after {PROBE_TIMEOUT_SECONDS:.0f}s.", "details": None})
+        executor.shutdown(wait=False, cancel_futures=True)  # Don't block on a hung endpoint
+    finally:
+        _refresh_lock.release()
+
+
+def _refresh_in_background():
+    if not _refresh_lock.locked():
+        threading.Thread(target=probe_all, name='health-refresh', daemon=True).start()
+
+
+def _prober_loop(socketio):
+    print(f"Health prober started (interval={PROBE_INTERVAL_SECONDS}s, ttl={STATUS_TTL_SECONDS}s).")
+    while True:
+        try:
+            probe_all()
+        except Exception as e:
+            print(f"Health prober round failed: {e}")
+        socketio.sleep(PROBE_INTERVAL_SECONDS)
+
+
+def ensure_prober_started(socketio):
+    """Starts the scheduled background prober once per process."""
+    global _prober_started
+    with _prober_lock:
+        if not _prober_started:
+            _prober_started = True
+            socketio.start_background_task(_prober_loop, socketio)
+
+
+def get_cached_status(key, max_age=None):
+    """Returns the cached {'ok', 'error', 'checked_at'} for key if newer than max_age (default ttl), else None."""
+    max_age = STATUS_TTL_SECONDS if max_age is None else max_age
+    with _statuses_lock:
+        status = _statuses.get(key)
+    if status and time.time() - status['checked_at'] <= max_age:
+        return dict(status)
+    return None
+
+
+def invalidate(key):
+    """Drops a cached status so the next reader re-checks it."""
+    with _statuses_lock:
+        _statuses.pop(key, None)
+
+
+def get_status_snapshot():
+    """
+    Returns the /api/status payload from cache. Only the very first call (nothing
+    probed yet) waits for a probe round; stale entries are flagged and refreshed
+    in the background.
+    """
+    expected = [GITHUB_KEY] + [p['id'] for p in _enabled_providers()]
+    with _statuses_lock:
+        missing = [key for key in expected if key not in _statuses]
+    if missing:
+        probe_all()
+
+    now = time.time()
+    with _statuses_lock:
+        snapshot = {key: dict(_statuses[key]) for key in expected if key in _statuses}
+    if any(now - status['checked_at'] > STATUS_TTL_SECONDS for status in snapshot.values()):
+        _refresh_in_background()
+
+    def entry(key):
+        status = snapshot.get(key) or {'ok': False, 'error': {"message": "Status not available yet.", "details": None}, 'checked_at': None}
+        return {
+            'ok': status['ok'],
+            'error': status['error'],
+            'checked_at': status['checked_at'],
+            'stale': status['checked_at'] is None or now - status['checked_at'] > STATUS_TTL_SECONDS,
+        }
+
+    github = entry(GITHUB_KEY)
+    return {
+        'github_ok': github['ok'],
+        'github_error': github['error'],
+        'github_checked_at': github['checked_at'],
+        'provider_statuses': {key: entry(key) for key in expected if key != GITHUB_KEY},
+    }
+
+
+def check_provider_cached(provider_config):
+    """
+    Provider validation for the job submission hot path. Returns the cached
+    (ok, error) when fresh - ttl_seconds for successes, negative_ttl_seconds for
+    failures - and only runs a live check when the cached state is missing or stale.
+    """
+    provider_id = provider_config['id']
+    cached = get_cached_status(provider_id)
+    if cached and (cached['ok'] or time.time() - cached['checked_at'] <= NEGATIVE_TTL_SECONDS):
+        return cached['ok'], cached['error']
+    print(f"No fresh validation cached for {provider_id}; running live check.")
+    ok, error = llm_service.check_provider_config(provider_config, timeout=PROBE_TIMEOUT_SECONDS)
+    _store(provider_id, ok, error)
+    return ok, error
+
+
+def record_auth_failure(provider_id, e):
+    """Marks a provider as failed when a completion is rejected for auth reasons."""
+    print(f"Auth error from provider '{provider_id}' during completion; invalidating cached validation.")
+    _store(provider_id, False, {
+        "message": f"Invalid or inactive API key for provider '{provider_id}'.",
+        "details": {"error_type": type(e).__name__, "message": str(e)},
+    })
+
+
+llm_service.register_auth_error_listener(record_auth_failure)
@@ -0,0 +1,216 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from services import cancellation
+
+# Import the loaded config for pool sizing and retry policy
+try:
+    from config import CONFIG
+except ImportError:
+    print("ERROR: Could not import CONFIG from config.py in http_session.py.")
+    CONFIG = {'http': {}, 'analysis': {}}  # Fallback
+
+HTTP_CONFIG = CONFIG.get('http', {}) or {}
+_ANALYSIS_CONFIG = CONFIG.get('analysis', {}) or {}
+
+# Keep-alive pool sized to the largest number of concurrent workers a task may use
+POOL_MAXSIZE = int(HTTP_CONFIG.get('pool_maxsize') or max(
+    int(_ANALYSIS_CONFIG.get('max_concurrent_files', 4)),
+    int(_ANALYSIS_CONFIG.get('max_concurrent_files_limit', 16)),
+))
+TIMEOUT_SECONDS = float(HTTP_CONFIG.get('timeout_seconds', 30))
+MAX_RETRIES = int(HTTP_CONFIG.get('max_retries', 4))
+BACKOFF_BASE_SECONDS = float(HTTP_CONFIG.get('backoff_base_seconds', 0.5))
+BACKOFF_MAX_SECONDS = float(HTTP_CONFIG.get('backoff_max_seconds', 30))
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+# Body chunk size when a cancellable request reads its response
+BODY_CHUNK_BYTES = 64 * 1024
+
+_session = None
+_session_lock = threading.Lock()
+
+# Per-call latency stats, keyed by call name (e.g. 'fetch_file_content')
+_latency_stats = {}
+_stats_lock = threading.Lock()
+
+
+def get_session():
+    """Returns the shared requests.Session, creating it (and its connection pool) on first use."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                # Retries are handled in request() so Retry-After and secondary rate limits are honoured
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=POOL_MAXSIZE, max_retries=0)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                print(f"Initialized shared HTTP session (pool_maxsize={POOL_MAXSIZE}, timeout={TIMEOUT_SECONDS}s, max_retries={MAX_RETRIES})")
+                _session = session
+    return _session
+
+
+def _is_secondary_rate_limit(response):
+    """GitHub signals secondary (abuse) rate limits with a 403 plus Retry-After or an explanatory body."""
+    if response.status_code != 403:
+        return False
+    if response.headers.get('Retry-After') or response.headers.get('X-RateLimit-Remaining') == '0':
+        return True
+    try:
+        return 'secondary rate limit' in response.text.lower()
+    except Exception:
+        return False
+
+
+def _should_retry(response):
+    return response.status_code in RETRY_STATUS_CODES or _is_secondary_rate_limit(response)
+
+
+def _retry_after_seconds(response):
+    """Parses Retry-After (seconds or HTTP date) or X-RateLimit-Reset into a delay, or None."""
+    retry_after = response.headers.get('Retry-After')
+    if retry_after:
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+    if response.headers.get('X-RateLimit-Remaining') == '0' and response.headers.get('X-RateLimit-Reset'):
+        try:
+            return max(0.0, float(response.headers['X-RateLimit-Reset']) - time.time())
+        except ValueError:
+            pass
+    return None
+
+
+def _backoff_seconds(attempt):
+    """Exponential backoff with full jitter."""
+    return random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * (2 ** attempt)))
+
+
+def _record(name, elapsed, ok, retries, status_code):
+    with _stats_lock:
+        stats = _latency_stats.setdefault(name, {
+            'calls': 0, 'errors': 0, 'retries': 0,
+            'total_seconds': 0.0, 'max_seconds': 0.0, 'last_status': None,
+        })
+        stats['calls'] += 1
+        stats['retries'] += retries
+        stats['total_seconds'] += elapsed
+        stats['max_seconds'] = max(stats['max_seconds'], elapsed)
+        stats['last_status'] = status_code
+        if not ok:
+            stats['errors'] += 1
+
+
+def _send_cancellable(session, method, url, timeout, cancel_token, kwargs):
+    """
+    Sends a request whose body download a cancel can cut short: the body is streamed and
+    the response is closed from the cancelling thread, which also drops its connection.
+    With stream=True the caller reads the body and the close aborts its reads; the callback
+    is dropped when the caller closes the response. (Waiting for the response headers can't
+    be interrupted; the timeout bounds that.)
+    """
+    stream = kwargs.get('stream', False)
+    response = session.request(method, url, timeout=timeout, **{**kwargs, 'stream': True})
+    if stream:
+        handle = cancel_token.on_cancel(response.close)
+        close = response.close
+
+        def close_and_unregister():
+            cancel_token.remove_callback(handle)
+            close()
+
+        response.close = close_and_unregister  # Also what `with response:` calls
+        return response
+    try:
+        with cancel_token.registered(response.close):
+            chunks = []
+            for chunk in response.iter_content(BODY_CHUNK_BYTES):
+                cancel_token.raise_if_cancelled()
+                chunks.append(chunk)
+            response._content = b''.join(chunks)  # What requests itself does when stream=False
+    except Exception as e:
+        response.close()
+        if cancel_token.cancelled:
+            raise cancellation.TaskCancelled(f"{method} {url} aborted: task cancelled.") from e
+        raise
+    return response
+
+
+def request(method, url, name=None, timeout=None, max_retries=None, **kwargs):
+    """
+    Sends a request through the shared session with a timeout and retries.
+    Retries on connection errors, 5xx, 429 and GitHub secondary rate limits, waiting
+    for Retry-After when given (if it fits within backoff_max_seconds) and jittered
+    exponential backoff otherwise. Returns the final response; raises the last
+    requests exception if every attempt failed to connect.
+    Inside a task (a cancellation token bound to the thread), a cancel aborts the body
+    download and any backoff wait with cancellation.TaskCancelled.
+    """
+    name = name or f"{method.upper()} {url.split('?')[0]}"
+    timeout = TIMEOUT_SECONDS if timeout is None else timeout
+    max_retries = MAX_RETRIES if max_retries is None else max_retries
+    session = get_session()
+    cancel_token = cancellation.current()
+
+    start = time.perf_counter()
+    attempt = 0
+    while True:
+        if cancel_token:
+            cancel_token.raise_if_cancelled()
+        try:
+            if cancel_token:
+                response = _send_cancellable(session, method, url, timeout, cancel_token, kwargs)
+            else:
+                response = session.request(method, url, timeout=timeout, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            if cancel_token and cancel_token.cancelled:
+                raise cancellation.TaskCancelled(f"{method} {url} aborted: task cancelled.") from e
+            if attempt >= max_retries:
+                _record(name, time.perf_counter() - start, False, attempt, None)
+                raise
+            delay = _backoff_seconds(attempt)
+            print(f"HTTP {method} {url} failed ({type(e).__name__}), retrying in {delay:.2f}s (attempt {attempt + 1}/{max_retries})")
+        else:
+            if not _should_retry(response) or attempt >= max_retries:
+                _record(name, time.perf_counter() - start, response.status_code < 400, attempt, response.status_code)
+                return response
+            delay = _retry_after_seconds(response)
+            if delay is None:
+                delay = _backoff_seconds(attempt)
+            elif delay > BACKOFF_MAX_SECONDS:
+                # e.g. primary rate limit exhausted for the hour: waiting would just stall the worker
+                print(f"HTTP {method} {url} returned {response.status_code}; retry window {delay:.0f}s exceeds backoff_max_seconds, giving up.")
+                _record(name, time.perf_counter() - start, False, attempt, response.status_code)
+                return response
+            print(f"HTTP {method} {url} returned {response.status_code}, retrying in {delay:.2f}s (attempt {attempt + 1}/{max_retries})")
+            response.close()  # Release the connection back to the pool before sleeping
+        if cancel_token:
+            if cancel_token.wait(delay):
+                raise cancellation.TaskCancelled(f"{method} {url} aborted during backoff: task cancelled.")
+        else:
+            time.sleep(delay)
+        attempt += 1
+
+
+def get(url, **kwargs):
+    """GET through the shared session. See request()."""
+    return request('GET', url, **kwargs)
+
+
+def get_latency_stats():
+    """Returns a snapshot of per-call latency stats with derived averages."""
+    with _stats_lock:
+        snapshot = {name: dict(stats) for name, stats in _latency_stats.items()}
+    for stats in snapshot.values():
+        stats['avg_seconds'] = stats['total_seconds'] / stats['calls'] if stats['calls'] else 0.0
+    return snapshot
@@ -0,0 +1,237 @@
+import asyncio
+import concurrent.futures
+import threading
+import time
+
+from services import cancellation, llm_service, metrics, token_usage
+
+# Import the loaded config for per-provider rate limits
+try:
+    from config import CONFIG
+except ImportError:
+    print("ERROR: Could not import CONFIG from config.py in llm_async.py.")
+    CONFIG = {'llm_providers': {'providers': []}}  # Fallback
+
+# Output tokens assumed for TPM reservation when the call does not set max_tokens
+DEFAULT_OUTPUT_TOKENS_ESTIMATE = token_usage.DEFAULT_OUTPUT_TOKENS_ESTIMATE
+
+_loop = None
+_loop_lock = threading.Lock()
+_async_clients = {}
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at capacity-per-minute. acquire() waits until
+    the requested amount is available; amounts above capacity are clamped so a single
+    large request can still proceed once the bucket is full.
+    """
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self.rate = float(per_minute) / 60.0
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount=1):
+        amount = min(float(amount), self.capacity)
+        async with self._lock:  # FIFO-ish: one waiter refills/sleeps at a time
+            while True:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+    def adjust(self, delta):
+        """Returns (delta > 0) or charges (delta < 0) tokens after the real cost is known."""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + delta)
+
+
+class RateLimiter:
+    """Requests-per-minute and tokens-per-minute buckets for one provider/model pair."""
+
+    def __init__(self, rpm=None, tpm=None):
+        self.rpm = TokenBucket(rpm) if rpm else None
+        self.tpm = TokenBucket(tpm) if tpm else None
+
+    async def acquire(self, estimated_tokens):
+        if self.rpm:
+            await self.rpm.acquire(1)
+        if self.tpm:
+            await self.tpm.acquire(estimated_tokens)
+
+    def settle(self, estimated_tokens, actual_tokens):
+        if self.tpm and actual_tokens is not None:
+            self.tpm.adjust(estimated_tokens - actual_tokens)
+
+
+def get_rate_limits(provider_config, model_id):
+    """Returns the effective {'rpm', 'tpm'} for a model: model-level rate_limits override provider-level ones."""
+    limits = dict(provider_config.get('rate_limits') or {})
+    model_config = next((m for m in provider_config.get('models', []) if m.get('id') == model_id), {})
+    limits.update(model_config.get('rate_limits') or {})
+    return {'rpm': limits.get('rpm'), 'tpm': limits.get('tpm')}
+
+
+def _get_limiter(provider_config, model_id):
+    key = (provider_config['id'], model_id)
+    with _limiters_lock:
+        if key not in _limiters:
+            limits = get_rate_limits(provider_config, model_id)
+            _limiters[key] = RateLimiter(**limits)
+            if limits['rpm'] or limits['tpm']:
+                print(f"Rate limiter for {key[0]}/{key[1]}: rpm={limits['rpm']} tpm={limits['tpm']}")
+        return _limiters[key]
+
+
+def _get_loop():
+    """Starts the engine's event loop in a daemon thread on first use."""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, name='llm-async-engine', daemon=True)
+            thread.start()
+            _loop = loop
+            print("Async LLM engine started.")
+    return _loop
+
+
+def _get_async_client(provider_config):
+    """Initializes (and caches) the provider's async client. Runs on the engine loop."""
+    provider_id = provider_config['id']
+    if provider_id in _async_clients:
+        return _async_clients[provider_id]
+    api_key = provider_config.get('api_key')
+    if llm_service.is_openai_compatible(provider_config):
+        from openai import AsyncOpenAI
+        client = AsyncOpenAI(api_key=api_key, base_url=provider_config.get('base_url'))
+    elif provider_id == 'anthropic':
+        from anthropic import AsyncAnthropic
+        if not api_key: raise ValueError("API key not found in config for Anthropic.")
+        client = AsyncAnthropic(api_key=api_key)
+    elif provider_id == 'google':
+        import google.generativeai as genai
+        if not api_key: raise ValueError("API key not found in config for Google GenAI.")
+        genai.configure(api_key=api_key)
+        client = genai
+    else:
+        raise ValueError(f"LLM provider '{provider_id}' is not supported yet.")
+    _async_clients[provider_id] = client
+    return client
+
+
+async def _call_provider(client, provider_config, model_id, prompt_messages, on_token, kwargs):
+    """Returns (text, usage or None) from the provider's async API, streaming when on_token is given."""
+    provider_id = provider_config['id']
+    parts = []
+
+    if llm_service.is_openai_compatible(provider_config):
+        if on_token:
+            stream = await client.chat.completions.create(
+                model=model_id, messages=prompt_messages, stream=True, **{**llm_service.stream_usage_kwargs(provider_config), **kwargs}
+            )
+            usage = None
+            try:
+                async for chunk in stream:
+                    if chunk.choices and chunk.choices[0].delta and chunk.choices[0].delta.content:
+                        parts.append(chunk.choices[0].delta.content)
+                        on_token(chunk.choices[0].delta.content)
+                    if getattr(chunk, 'usage', None):
+                        usage = token_usage.usage_from_response(chunk.usage)
+            finally:
+                await stream.close()  # Frees the connection at once, also when the call is cancelled
+            return "".join(parts).strip(), usage
+        response = await client.chat.completions.create(model=model_id, messages=prompt_messages, **kwargs)
+        return response.choices[0].message.content.strip(), token_usage.usage_from_response(getattr(response, 'usage', None))
+
+    if provider_id == 'anthropic':
+        api_kwargs = llm_service._build_anthropic_kwargs(model_id, prompt_messages, kwargs)
+        if on_token:
+            async with client.messages.stream(**api_kwargs) as stream:
+                async for text in stream.text_stream:
+                    parts.append(text)
+                    on_token(text)
+                message = await stream.get_final_message()
+        else:
+            message = await client.messages.create(**api_kwargs)
+            parts = [message.content[0].text] if message.content else []
+        return "".join(parts).strip(), token_usage.usage_from_response(getattr(message, 'usage', None))
+
+    if provider_id == 'google':
+        model = client.GenerativeModel(model_id)
+        text_prompt = "\n".join([msg['content'] for msg in prompt_messages if msg['role'] == 'user'])
+        if on_token:
+            response = await model.generate_content_async(text_prompt, stream=True)
+            async for chunk in response:
+                try:
+                    text = chunk.text
+                except ValueError:
+                    continue
+                parts.append(text)
+                on_token(text)
+            return "".join(parts).strip(), token_usage.usage_from_response(getattr(response, 'usage_metadata', None))
+        response = await model.generate_content_async(text_prompt)
+        return response.text.strip(), token_usage.usage_from_response(getattr(response, 'usage_metadata', None))
+
+    raise ValueError(f"LLM provider '{provider_id}' is not supported yet.")
+
+
+async def complete_async(provider_config, model_id, prompt_messages, on_token=None, on_usage=None, **kwargs):
+    """
+    Gets a completion on the engine loop, waiting for RPM/TPM capacity first.
+    on_usage(usage) receives the call's token usage, counted locally if the provider doesn't report it.
+    """
+    provider_id = provider_config['id']
+    client = _get_async_client(provider_config)
+    limiter = _get_limiter(provider_config, model_id)
+    estimated = token_usage.count_message_tokens(prompt_messages, model_id) + kwargs.get('max_tokens', DEFAULT_OUTPUT_TOKENS_ESTIMATE)
+
+    await limiter.acquire(estimated)
+    try:
+        print(f"Attempting async completion with {provider_id}/{model_id}")
+        text, usage = await _call_provider(client, provider_config, model_id, prompt_messages, on_token, kwargs)
+    except Exception as e:
+        print(f"Error getting async completion from {provider_id} / {model_id}: {e}")
+        llm_service.notify_if_auth_error(provider_id, e)
+        raise
+    usage = usage or token_usage.estimate_usage(prompt_messages, text, model_id)
+    limiter.settle(estimated, usage['total_tokens'])
+    if on_usage:
+        on_usage(usage)
+    return text
+
+
+def submit(provider_config, model_id, prompt_messages, on_token=None, on_usage=None, **kwargs):
+    """Schedules a completion on the engine from any thread. Returns a concurrent.futures.Future."""
+    return asyncio.run_coroutine_threadsafe(
+        complete_async(provider_config, model_id, prompt_messages, on_token=on_token, on_usage=on_usage, **kwargs), _get_loop()
+    )
+
+
+@metrics.timed(metrics.LLM_REQUEST_SECONDS, labels=llm_service.llm_metric_labels, operation='async')
+def complete(provider_config, model_id, prompt_messages, on_token=None, on_usage=None, cancel_token=None, **kwargs):
+    """
+    Blocking wrapper around submit() with the same contract as llm_service.get_llm_completion.
+    Cancelling cancel_token cancels the coroutine on the engine loop, which aborts its HTTP
+    request (or its wait for rate limit capacity) and raises cancellation.TaskCancelled.
+    """
+    if cancel_token is None:
+        return submit(provider_config, model_id, prompt_messages, on_token=on_token, on_usage=on_usage, **kwargs).result()
+    cancel_token.raise_if_cancelled()
+    future = submit(provider_config, model_id, prompt_messages, on_token=on_token, on_usage=on_usage, **kwargs)
+    try:
+        with cancel_token.registered(future.cancel):
+            return future.result()
+    except concurrent.futures.CancelledError as e:
+        raise cancellation.TaskCancelled(f"Async completion from {provider_config['id']}/{model_id} aborted: task cancelled.") from e
@@ -1,4 +1,6 @@
+import contextlib
 import os
+import threading
 from pathlib import Path
 # from dotenv import load_dotenv, dotenv_values # Handled in config.py now
 
@@ -9,6 +11,8 @@ except ImportError:
     print("ERROR: Could not import CONFIG from config.py. Ensure config.py exists in the backend root.")
     CONFIG = {'llm_providers': {'providers': [], 'default_provider': None, 'default_model': None}}  # Fallback
 
+from services import cancellation, metrics, token_usage
+
 
 # --- LLM Client Initialization (Dynamic) ---
 _llm_clients = {}
@@ -67,15 +71,119 @@ def _initialize_client(provider_config):
         raise e # Re-raise
 
 
+# --- Auth Error Notification ---
+# Callbacks (provider_id, exception) run when a completion fails with an auth error,
+# e.g. so cached provider validation can be invalidated.
+_auth_error_listeners = []
+
+
+def register_auth_error_listener(listener):
+    """Registers a callback(provider_id, exception) for auth failures seen during completions."""
+    if listener not in _auth_error_listeners:
+        _auth_error_listeners.append(listener)
+
+
+def is_auth_error(e):
+    """True if the exception looks like a rejected/invalid API key."""
+    return "invalid_api_key" in str(e).lower() or "incorrect api key" in str(e).lower() or \
+           getattr(e, 'code', None) == 'invalid_api_key' or "authentication" in type(e).__name__.lower() or \
+           "authentication_error" in str(type(e)).lower() or \
+           (hasattr(e, 'status_code') and e.status_code == 401)
+
+
+def notify_if_auth_error(provider_id, e):
+    """Informs registered listeners when a completion error is an auth failure."""
+    if not is_auth_error(e):
+        return
+    for listener in list(_auth_error_listeners):
+        try:
+            listener(provider_id, e)
+        except Exception as listener_err:
+            print(f"Warning: Auth error listener failed: {listener_err}")
+
+
 # --- Service Functions ---
 
 MAX_COMBINED_CHARS = 15000
+# Rough chars-per-token ratio used for budgeting when no tokenizer is involved
+CHARS_PER_TOKEN = token_usage.CHARS_PER_TOKEN
+# Prompt content budget in tokens, counted with token_usage (same size as MAX_COMBINED_CHARS at the fallback ratio)
+MAX_COMBINED_TOKENS = MAX_COMBINED_CHARS // CHARS_PER_TOKEN
+
+
+def is_openai_compatible(provider_config):
+    """True for providers served through the OpenAI client (OpenAI itself or any base_url gateway)."""
+    return provider_config['id'] == 'openai' or provider_config.get('is_openai_compatible', False) or bool(provider_config.get('base_url'))
+
+
+def stream_usage_kwargs(provider_config):
+    """
+    Asks OpenAI-compatible streams to end with a usage chunk. On by default for OpenAI only,
+    since some compatible servers reject stream_options; set stream_usage per provider.
+    """
+    if provider_config.get('stream_usage', provider_config['id'] == 'openai'):
+        return {'stream_options': {'include_usage': True}}
+    return {}
+
+
+def _report_usage(on_usage, usage, prompt_messages, text, model_id):
+    """Passes provider-reported usage (or a local count when there is none) to on_usage."""
+    if on_usage:
+        on_usage(usage or token_usage.estimate_usage(prompt_messages, text, model_id))
+
 
+def _close_on_cancel(cancel_token, close):
+    """Keeps close() registered to abort a stream while cancel_token is live (no-op without a token)."""
+    return cancel_token.registered(close) if cancel_token else contextlib.nullcontext()
 
-def check_provider_config(provider_config):
+
+def _call_cancellable(cancel_token, call):
+    """
+    Runs a blocking, non-streaming provider call. With a cancel_token the call runs on a
+    helper thread and a cancel ends the wait at once with cancellation.TaskCancelled: the
+    SDKs can't abort a request still waiting for its response (closing the client doesn't
+    interrupt the socket read), so the abandoned call finishes in the background and its
+    result is dropped.
+    """
+    if cancel_token is None:
+        return call()
+    cancel_token.raise_if_cancelled()
+    outcome = {}
+    done = threading.Event()
+
+    def run():
+        try:
+            outcome['result'] = call()
+        except BaseException as e:
+            outcome['error'] = e
+        finally:
+            done.set()
+
+    threading.Thread(target=run, name=f'llm-call-{str(cancel_token.name)[:8]}', daemon=True).start()
+    with cancel_token.registered(done.set):
+        done.wait()
+    if 'error' in outcome:
+        raise outcome['error']
+    if 'result' not in outcome:
+        raise cancellation.TaskCancelled(f"Completion aborted: task {cancel_token.name} was cancelled.")
+    return outcome['result']
+
+
+def llm_metric_labels(provider_config, model_id, *args, **kwargs):
+    """Histogram labels for a completion call, taken from its arguments."""
+    return {'provider': provider_config['id'], 'model': model_id}
+
+
+def _check_labels(provider_config, *args, **kwargs):
+    return {'provider': provider_config['id']}
+
+
+@metrics.timed(metrics.PROVIDER_CHECK_SECONDS, labels=_check_labels, outcome=lambda result: 'success' if result[0] else 'error')
+def check_provider_config(provider_config, timeout=None):
     """
     Checks if the required API key is present, attempts to initialize the client,
     and performs a lightweight API call to validate the client/key.
+    An optional timeout (seconds) bounds the live call and disables SDK retries.
     Returns (bool: ok, error_object: {message, details} | None)
     """
     provider_id = provider_config['id']
@@ -101,16 +209,21 @@ def check_provider_config(provider_config):
 
     # 3. Perform Live API Check (if applicable and client initialized)
     try:
+        if timeout is not None and hasattr(client, 'with_options'):
+            client = client.with_options(timeout=timeout, max_retries=0) # Don't let a dead endpoint stall the check
         if provider_id == 'openai' or provider_config.get('is_openai_compatible', False) or provider_config.get('base_url'):
             print(f"Attempting API validation call for {provider_id} (OpenAI compatible)...")
             client.models.list()
         elif provider_id == 'anthropic':
             print(f"Attempting API validation call for {provider_id} (Anthropic)...")
-            client.messages.create(
-                 model=provider_config['models'][0]['id'], # Use first configured model
-                 messages=[{"role": "user", "content": "Hi"}],
-                 max_tokens=1
-            )
+            if hasattr(client, 'models'):
+                client.models.list(limit=1) # Free endpoint, no billed completion
+            else:
+                client.messages.create(
+                     model=provider_config['models'][0]['id'], # Use first configured model
+                     messages=[{"role": "user", "content": "Hi"}],
+                     max_tokens=1
+                )
         elif provider_id == 'google':
             print(f"Attempting API validation call for {provider_id} (Google)...")
             models = client.list_models()
@@ -126,9 +239,7 @@ def check_provider_config(provider_config):
         error_msg = f"API key validation failed for provider '{provider_id}'."
         print(f"Check failed for {provider_id}: {e}")
         # Simplify common error message
-        if "invalid_api_key" in str(e).lower() or "incorrect API key" in str(e).lower() or \
-           getattr(e, 'code', None) == 'invalid_api_key' or "authentication_error" in str(type(e)).lower() or \
-           (hasattr(e, 'status_code') and e.status_code == 401):
+        if is_auth_error(e):
              error_msg = f"Invalid or inactive API key for provider '{provider_id}'."
         elif "connection error" in str(e).lower() or (hasattr(e, 'status_code') and e.status_code >= 500):
              error_msg = f"Connection error during validation for provider '{provider_id}'. Check network or base URL."
@@ -138,8 +249,39 @@ def check_provider_config(provider_config):
         return False, {"message": error_msg, "details": {"error_type": type(e).__name__, "message": str(e)}}
 
 
-def get_llm_completion(provider_config, model_id, prompt_messages, **kwargs):
-    """Gets completion from the specified LLM provider and model."""
+def _build_anthropic_kwargs(model_id, prompt_messages, kwargs):
+    """Converts OpenAI-style messages into Anthropic messages.create arguments."""
+    # --- Corrected Anthropic Message Formatting ---
+    system_prompt = None
+    messages_anthropic = []
+    for msg in prompt_messages:
+        if msg['role'] == 'system':
+            system_prompt = msg['content'] # Extract system prompt
+        elif msg['role'] in ['user', 'assistant']:
+            messages_anthropic.append(msg) # Keep user/assistant messages
+
+    # Construct arguments for the API call
+    api_kwargs = {
+        "model": model_id,
+        "messages": messages_anthropic,
+        "max_tokens": kwargs.get('max_tokens', 1024),
+        **{k: v for k, v in kwargs.items() if k not in ['max_tokens', 'model', 'messages']} # Add other kwargs safely
+    }
+    # Only include the system parameter if system_prompt is not None
+    if system_prompt:
+        api_kwargs['system'] = system_prompt
+    # --- End Correction ---
+    return api_kwargs
+
+
+@metrics.timed(metrics.LLM_REQUEST_SECONDS, labels=llm_metric_labels, operation='complete')
+def get_llm_completion(provider_config, model_id, prompt_messages, on_usage=None, cancel_token=None, **kwargs):
+    """
+    Gets completion from the specified LLM provider and model.
+    on_usage(usage) receives the call's token usage (see token_usage.make_usage).
+    With a cancel_token, a cancel stops the wait at once with cancellation.TaskCancelled
+    (see _call_cancellable).
+    """
     provider_id = provider_config['id']
     client = _initialize_client(provider_config) # Get potentially cached client/exception
 
@@ -153,41 +295,21 @@ def get_llm_completion(provider_config, model_id, prompt_messages, **kwargs):
         if provider_id == 'openai' or provider_config.get('is_openai_compatible', False) or provider_config.get('base_url'):
             from openai import OpenAI
             if not isinstance(client, OpenAI): raise TypeError(f"Client for {provider_id} is not an OpenAI compatible instance.")
-            response = client.chat.completions.create(model=model_id, messages=prompt_messages, **kwargs)
-            return response.choices[0].message.content.strip()
+            response = _call_cancellable(cancel_token, lambda: client.chat.completions.create(model=model_id, messages=prompt_messages, **kwargs))
+            text = response.choices[0].message.content.strip()
+            _report_usage(on_usage, token_usage.usage_from_response(getattr(response, 'usage', None)), prompt_messages, text, model_id)
+            return text
 
         elif provider_id == 'anthropic':
             from anthropic import Anthropic
             if not isinstance(client, Anthropic): raise TypeError(f"Client for {provider_id} is not an Anthropic compatible instance.")
 
-            # --- Corrected Anthropic Message Formatting ---
-            system_prompt = None
-            messages_anthropic = []
-            for msg in prompt_messages:
-                if msg['role'] == 'system':
-                    system_prompt = msg['content'] # Extract system prompt
-                elif msg['role'] in ['user', 'assistant']:
-                    messages_anthropic.append(msg) # Keep user/assistant messages
-
-            # Construct arguments for the API call
-            api_kwargs = {
-                "model": model_id,
-                "messages": messages_anthropic,
-                "max_tokens": kwargs.get('max_tokens', 1024),
-                **{k: v for k, v in kwargs.items() if k not in ['max_tokens', 'model', 'messages']} # Add other kwargs safely
-            }
-            # Only include the system parameter if system_prompt is not None
-            if system_prompt:
-                api_kwargs['system'] = system_prompt
-
             # Call API with constructed arguments
-            response = client.messages.create(**api_kwargs)
-            # --- End Correction ---
+            response = _call_cancellable(cancel_token, lambda: client.messages.create(**_build_anthropic_kwargs(model_id, prompt_messages, kwargs)))
 
-            if response.content and len(response.content) > 0:
-                return response.content[0].text.strip()
-            else:
-                return ""
+            text = response.content[0].text.strip() if response.content and len(response.content) > 0 else ""
+            _report_usage(on_usage, token_usage.usage_from_response(getattr(response, 'usage', None)), prompt_messages, text, model_id)
+            return text
 
         elif provider_id == 'google':
             import google.generativeai as genai
@@ -195,12 +317,96 @@ def get_llm_completion(provider_config, model_id, prompt_messages, **kwargs):
             model = client.GenerativeModel(model_id)
             # Google's API might prefer a simpler text prompt structure
             text_prompt = "\n".join([msg['content'] for msg in prompt_messages if msg['role'] == 'user'])
-            response = model.generate_content(text_prompt)
-            return response.text.strip()
+            response = _call_cancellable(cancel_token, lambda: model.generate_content(text_prompt))
+            text = response.text.strip()
+            _report_usage(on_usage, token_usage.usage_from_response(getattr(response, 'usage_metadata', None)), prompt_messages, text, model_id)
+            return text
 
         else:
             raise ValueError(f"LLM provider '{provider_id}' is not supported yet.")
 
+    except cancellation.TaskCancelled:
+        raise
     except Exception as e:
         print(f"Error getting completion from {provider_id} / {model_id}: {e}")
+        notify_if_auth_error(provider_id, e)
+        raise e # Re-raise the exception so the caller knows something went wrong
+
+
+@metrics.timed(metrics.LLM_REQUEST_SECONDS, labels=llm_metric_labels, operation='stream')
+def stream_llm_completion(provider_config, model_id, prompt_messages, on_token=None, on_usage=None, cancel_token=None, **kwargs):
+    """
+    Streams a completion from the specified LLM provider and model.
+    Calls on_token(text) for each incremental chunk as it arrives and returns the
+    assembled (stripped) response text, like get_llm_completion (including on_usage).
+    When cancel_token (a cancellation.CancelToken) is cancelled the stream is closed at
+    once, releasing its connection, and cancellation.TaskCancelled is raised.
+    """
+    provider_id = provider_config['id']
+    client = _initialize_client(provider_config) # Get potentially cached client/exception
+
+    if isinstance(client, Exception): # Check if initialization failed previously
+         raise client # Re-raise the initialization error
+    if not client:
+        raise ValueError(f"Could not initialize client for provider '{provider_id}'. Check configuration and dependencies.")
+
+    parts = []
+    usage = None
+
+    def emit(text):
+        if cancel_token:
+            cancel_token.raise_if_cancelled()
+        if text:
+            parts.append(text)
+            if on_token:
+                on_token(text)
+
+    try:
+        if cancel_token:
+            cancel_token.raise_if_cancelled()
+        print(f"Attempting streaming completion with {provider_id}/{model_id}")
+        if provider_id == 'openai' or provider_config.get('is_openai_compatible', False) or provider_config.get('base_url'):
+            from openai import OpenAI
+            if not isinstance(client, OpenAI): raise TypeError(f"Client for {provider_id} is not an OpenAI compatible instance.")
+            stream = client.chat.completions.create(model=model_id, messages=prompt_messages, stream=True, **{**stream_usage_kwargs(provider_config), **kwargs})
+            with _close_on_cancel(cancel_token, stream.close):
+                for chunk in stream:
+                    if chunk.choices and chunk.choices[0].delta and chunk.choices[0].delta.content:
+                        emit(chunk.choices[0].delta.content)
+                    if getattr(chunk, 'usage', None):
+                        usage = token_usage.usage_from_response(chunk.usage)  # Final chunk when include_usage is set
+
+        elif provider_id == 'anthropic':
+            from anthropic import Anthropic
+            if not isinstance(client, Anthropic): raise TypeError(f"Client for {provider_id} is not an Anthropic compatible instance.")
+            with client.messages.stream(**_build_anthropic_kwargs(model_id, prompt_messages, kwargs)) as stream, _close_on_cancel(cancel_token, stream.close):
+                for text in stream.text_stream:
+                    emit(text)
+                usage = token_usage.usage_from_response(getattr(stream.get_final_message(), 'usage', None))
+
+        elif provider_id == 'google':
+            import google.generativeai as genai
+            if client is not genai: raise TypeError(f"Client for {provider_id} is not a Google GenAI compatible instance.")
+            model = client.GenerativeModel(model_id)
+            text_prompt = "\n".join([msg['content'] for msg in prompt_messages if msg['role'] == 'user'])
+            response = model.generate_content(text_prompt, stream=True)
+            for chunk in response:
+                try:
+                    emit(chunk.text)
+                except ValueError:
+                    continue # Chunk without text parts (e.g. safety metadata only)
+            usage = token_usage.usage_from_response(getattr(response, 'usage_metadata', None))
+
+        else:
+            raise ValueError(f"LLM provider '{provider_id}' is not supported yet.")
+
+        text = "".join(parts).strip()
+        _report_usage(on_usage, usage, prompt_messages, text, model_id)
+        return text
+
+    except Exception as e:
+        if cancel_token and cancel_token.cancelled:
+            raise cancellation.TaskCancelled(f"Completion from {provider_id}/{model_id} aborted: task cancelled.") from e
+        print(f"Error streaming completion from {provider_id} / {model_id}: {e}")
+        notify_if_auth_error(provider_id, e)
         raise e # Re-raise the exception so the caller knows something went wrong
@@ -0,0 +1,173 @@
+import functools
+import threading
+import time
+
+# Seconds; covers cached lookups through slow LLM completions
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+_registry = []
+_registry_lock = threading.Lock()
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(label_names, label_values, extra=()):
+    pairs = list(zip(label_names, label_values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """Base for labelled metrics: one child value per label-value tuple."""
+    type_name = None
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._children = {}
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"Metric {self.name} expects labels {self.label_names}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} {self.type_name}']
+        with self._lock:
+            children = sorted(self._children.items())
+        for label_values, child in children:
+            lines.extend(self._render_child(label_values, child))
+        return lines
+
+
+class Counter(_Metric):
+    type_name = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._children[key] = self._children.get(key, 0) + amount
+
+    def _render_child(self, label_values, value):
+        return [f'{self.name}{_format_labels(self.label_names, label_values)} {_format_value(value)}']
+
+
+class Gauge(_Metric):
+    type_name = 'gauge'
+
+    def __init__(self, name, help_text, label_names=()):
+        super().__init__(name, help_text, label_names)
+        if not self.label_names:
+            self._children[()] = 0  # Unlabelled gauges are exported from the start
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._children[key] = self._children.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._children[key] = value
+
+    def _render_child(self, label_values, value):
+        return [f'{self.name}{_format_labels(self.label_names, label_values)} {_format_value(value)}']
+
+
+class Histogram(_Metric):
+    type_name = 'histogram'
+
+    def __init__(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            child = self._children.get(key)
+            if child is None:
+                child = self._children[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    child['counts'][i] += 1
+            child['sum'] += value
+            child['count'] += 1
+
+    def _render_child(self, label_values, child):
+        lines = []
+        for bound, count in zip(self.buckets, child['counts']):
+            lines.append(f'{self.name}_bucket{_format_labels(self.label_names, label_values, [("le", _format_value(bound))])} {count}')
+        lines.append(f'{self.name}_bucket{_format_labels(self.label_names, label_values, [("le", "+Inf")])} {child["count"]}')
+        lines.append(f'{self.name}_sum{_format_labels(self.label_names, label_values)} {_format_value(child["sum"])}')
+        lines.append(f'{self.name}_count{_format_labels(self.label_names, label_values)} {child["count"]}')
+        return lines
+
+
+def timed(histogram, labels=None, outcome=None, **static_labels):
+    """
+    Decorator observing each call's duration on `histogram`. labels(*args, **kwargs)
+    returns extra labels from the call's arguments; outcome(result) names the outcome
+    (default 'success'). Exceptions are recorded with outcome 'error' (or their
+    metric_outcome attribute) and re-raised.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            call_labels = dict(static_labels)
+            if labels:
+                call_labels.update(labels(*args, **kwargs))
+            started = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            except BaseException as e:
+                histogram.observe(time.perf_counter() - started, outcome=getattr(e, 'metric_outcome', 'error'), **call_labels)
+                raise
+            histogram.observe(time.perf_counter() - started, outcome=outcome(result) if outcome else 'success', **call_labels)
+            return result
+        return wrapper
+    return decorator
+
+
+def render():
+    """All registered metrics in the Prometheus text exposition format (0.0.4)."""
+    with _registry_lock:
+        metrics = list(_registry)
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+# --- Metrics shared across modules ---
+GITHUB_REQUEST_SECONDS = Histogram(
+    'github_request_duration_seconds', 'GitHub content and tree lookups (including cache hits and retries).', ('operation', 'outcome'))
+LLM_REQUEST_SECONDS = Histogram(
+    'llm_request_duration_seconds', 'LLM completion calls.', ('provider', 'model', 'operation', 'outcome'))
+PROVIDER_CHECK_SECONDS = Histogram(
+    'provider_check_duration_seconds', 'Live provider configuration checks.', ('provider', 'outcome'))
+SOCKETIO_EMIT_SECONDS = Histogram(
+    'socketio_emit_duration_seconds', 'Time spent in socketio.emit per wire event.', ('event',),
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0))
+SOCKETIO_EVENTS = Counter('socketio_events_total', 'Events sent over Socket.IO.', ('event',))
+SOCKETIO_COALESCED_EVENTS = Counter('socketio_coalesced_events_total', 'Task events merged into event_batch messages.', ('event',))
+ANALYSIS_FILES = Counter('analysis_files_total', 'Files analysed.', ('mode', 'outcome'))
+ANALYSIS_TASKS = Counter('analysis_tasks_total', 'Finished analysis tasks.', ('mode', 'status'))
+TASKS_IN_FLIGHT = Gauge('analysis_tasks_in_flight', 'Analysis tasks currently running.')
+FILES_IN_FLIGHT = Gauge('analysis_files_in_flight', 'Files currently being fetched or analysed.')
+FILES_PENDING = Gauge('analysis_files_pending', 'Files queued in running tasks and not yet analysed.')
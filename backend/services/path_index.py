@@ -0,0 +1,228 @@
+import bisect
+import re
+import threading
+from collections import Counter, OrderedDict
+
+from services import github_service
+
+# Indexes are rebuilt only when the cached tree object changes (same bound as the tree cache)
+INDEX_CACHE_MAX_ENTRIES = github_service.TREE_CACHE_MAX_ENTRIES
+MAX_PATTERN_LENGTH = 500  # Bounds user-supplied glob patterns
+
+_indexes = OrderedDict()  # (owner, repo, branch) -> PathIndex
+_indexes_lock = threading.Lock()
+
+
+def _extension(path):
+    """'.md' for 'docs/a.md', '' for files without an extension."""
+    name = path.rsplit('/', 1)[-1]
+    dot = name.rfind('.')
+    return name[dot:] if dot > 0 else ''
+
+
+def _segment_regex(segment):
+    """
+    Regex for the glob of one path segment. Every '*' but the last is an atomic lazy group
+    (as in fnmatch): taking the first match of the text up to the next '*' never loses a
+    match, and it keeps the engine from backtracking across all ways to split the segment.
+    """
+    i, chunks, chunk = 0, [], []
+    while i < len(segment):
+        c = segment[i]
+        if c == '*':
+            chunks.append(''.join(chunk))
+            chunk = []
+            while i < len(segment) and segment[i] == '*':
+                i += 1
+            continue
+        if c == '?':
+            chunk.append('[^/]')
+        elif c == '[' and segment.find(']', i + 2) != -1:
+            end = segment.find(']', i + 2)
+            body = segment[i + 1:end]
+            chunk.append('(?!/)' + ('[^' + body[1:] + ']' if body.startswith('!') else '[' + body + ']'))
+            i = end
+        else:
+            chunk.append(re.escape(c))
+        i += 1
+    chunks.append(''.join(chunk))
+    if len(chunks) == 1:
+        return chunks[0]
+    return chunks[0] + ''.join(f'(?>[^/]*?{middle})' for middle in chunks[1:-1]) + '[^/]*' + chunks[-1]
+
+
+def glob_to_regex(pattern):
+    """
+    Translates a path glob to a regex: '*' and '?' stay within one path segment, a '**'
+    segment spans directories, '[...]' is a character class. Matching takes time linear in
+    the number of wildcards, so user-supplied globs can't stall a worker.
+    """
+    # Runs of segments between '**' segments; runs[0] is anchored at the start
+    runs, run = [], []
+    for segment in pattern.split('/'):
+        if segment == '**':
+            runs.append(run)
+            run = []
+        else:
+            run.append(_segment_regex(segment))
+    runs.append(run)
+    if len(runs) > 2:
+        runs = runs[:1] + [run for run in runs[1:-1] if run] + runs[-1:]  # 'a/**/**/b' is 'a/**/b'
+    out = ['/'.join(runs[0])]
+    for n, run in enumerate(runs[1:], start=1):
+        if n == 1 and runs[0]:
+            out.append('/')  # 'a/**' or 'a/**/b'
+        if not run:
+            out.append('.*')  # Trailing '**'
+        elif n < len(runs) - 1:
+            # Committing to the first directory the run matches at is safe: the next '**' absorbs the rest
+            out.append('(?>(?:.*?/)??' + '/'.join(run) + '/)')
+        else:
+            out.append('(?:.*/)?' + '/'.join(run))
+    return ''.join(out) + r'\Z'
+
+
+def _literal_prefix(pattern):
+    """The part of a glob before its first wildcard, usable to narrow the search range."""
+    match = re.search(r'[*?\[]', pattern)
+    return pattern[:match.start()] if match else pattern
+
+
+class PathIndex:
+    """
+    Index over a tree's blob paths, built once per tree: paths in sorted order (prefix
+    queries are a bisect range, and the sort position doubles as a pagination cursor),
+    a lower-cased copy for case-insensitive prefixes, extension buckets, and per-directory
+    file counts by extension (a flattened directory trie).
+    """
+
+    def __init__(self, tree):
+        self.paths = sorted(item['path'] for item in tree if item.get('type') == 'blob' and item.get('path'))
+        lowered = sorted((path.lower(), i) for i, path in enumerate(self.paths))
+        self._lower_keys = [key for key, _ in lowered]
+        self._lower_positions = [i for _, i in lowered]
+        self.ext_buckets = {}  # extension -> set of positions
+        self.dir_counts = {}  # directory ('' = root) -> Counter(extension -> files below, recursively)
+        self.subdirs = {}  # directory -> set of immediate subdirectory paths
+        self._dirs_lower = {}  # lower-cased directory -> directory, for case-insensitive lookups
+        for i, path in enumerate(self.paths):
+            ext = _extension(path)
+            self.ext_buckets.setdefault(ext, set()).add(i)
+            parts = path.split('/')[:-1]
+            parent = ''
+            self.dir_counts.setdefault('', Counter())[ext] += 1
+            for depth in range(len(parts)):
+                directory = '/'.join(parts[:depth + 1])
+                self.subdirs.setdefault(parent, set()).add(directory)
+                self.dir_counts.setdefault(directory, Counter())[ext] += 1
+                self._dirs_lower.setdefault(directory.lower(), directory)
+                parent = directory
+
+    def _prefix_positions(self, prefix, case_sensitive):
+        """Sorted positions of paths starting with prefix."""
+        if not prefix:
+            return range(len(self.paths))
+        if case_sensitive:
+            lo = bisect.bisect_left(self.paths, prefix)
+            hi = bisect.bisect_left(self.paths, prefix + '\U0010ffff')
+            return range(lo, hi)
+        key = prefix.lower()
+        lo = bisect.bisect_left(self._lower_keys, key)
+        hi = bisect.bisect_left(self._lower_keys, key + '\U0010ffff')
+        return sorted(self._lower_positions[lo:hi])
+
+    def _extension_positions(self, extensions):
+        """Positions of paths ending with any of the extensions (multi-dot ones like '.d.ts' included)."""
+        positions = set()
+        for ext in extensions:
+            bucket = self.ext_buckets.get(_extension('x' + ext), ())
+            if ext.count('.') > 1:
+                bucket = {i for i in bucket if self.paths[i].endswith(ext)}
+            positions.update(bucket)
+        return positions
+
+    def query(self, prefix='', extensions=None, glob=None, contains=None,
+              case_sensitive=False, cursor=None, limit=None, with_total=False):
+        """
+        Returns (paths, next_cursor, total). Filters combine with AND; results are in
+        path order and resume after `cursor` (the last path of the previous page).
+        total is None unless with_total is set (it requires scanning every match).
+        Raises re.error for invalid patterns.
+        """
+        flags = 0 if case_sensitive else re.IGNORECASE
+        matchers = []
+        if glob:
+            matchers.append(re.compile(glob_to_regex(glob), flags).match)
+            # Narrow the range by the glob's literal prefix when it is more specific
+            glob_prefix = _literal_prefix(glob)
+            if len(glob_prefix) > len(prefix) and (glob_prefix.startswith(prefix) if case_sensitive else glob_prefix.lower().startswith(prefix.lower())):
+                prefix = glob_prefix
+        if contains:
+            needle = contains if case_sensitive else contains.lower()
+            matchers.append((lambda p: needle in p) if case_sensitive else (lambda p: needle in p.lower()))
+
+        positions = self._prefix_positions(prefix, case_sensitive)
+        if cursor:
+            start = bisect.bisect_right(self.paths, cursor)
+            if isinstance(positions, range):
+                positions = range(max(start, positions.start), positions.stop)
+            else:
+                positions = [i for i in positions if i >= start]
+        if extensions is not None:
+            bucket = self._extension_positions(extensions)
+            if isinstance(positions, range) and len(bucket) < len(positions):
+                positions = sorted(i for i in bucket if i in positions)  # Small bucket: O(bucket) range checks
+            else:
+                positions = [i for i in positions if i in bucket]
+
+        page, total, next_cursor = [], 0, None
+        for i in positions:
+            path = self.paths[i]
+            if not all(matcher(path) for matcher in matchers):
+                continue
+            total += 1
+            if limit is None or len(page) < limit:
+                page.append(path)
+            elif next_cursor is None:
+                next_cursor = page[-1]
+                if not with_total:
+                    break
+        return page, next_cursor, (total if with_total or limit is None else None)
+
+    def directory_counts(self, directory='', extensions=None, case_sensitive=True):
+        """
+        Immediate subdirectories of `directory` with their (recursive) file counts for the
+        extensions. Counts are kept per final extension, so '.d.ts' is counted as '.ts'.
+        """
+        directory = directory.strip('/')
+        if not case_sensitive and directory not in self.subdirs:
+            directory = self._dirs_lower.get(directory.lower(), directory)
+        keys = None if extensions is None else {_extension('x' + ext) for ext in extensions}
+        result = []
+        for subdir in sorted(self.subdirs.get(directory, ())):
+            counts = self.dir_counts[subdir]
+            count = sum(counts.values()) if keys is None else sum(counts.get(key, 0) for key in keys)
+            if count:
+                result.append({'path': subdir, 'file_count': count})
+        return result
+
+
+def get_index(owner, repo, branch):
+    """Returns the PathIndex for a branch's tree (rebuilt only when the tree changes), or None."""
+    tree = github_service.fetch_repo_tree(owner, repo, branch)
+    if tree is None:
+        return None
+    key = (owner, repo, branch)
+    with _indexes_lock:
+        entry = _indexes.get(key)
+        if entry is not None and entry[0] is tree:
+            _indexes.move_to_end(key)
+            return entry[1]
+    index = PathIndex(tree)
+    with _indexes_lock:
+        _indexes[key] = (tree, index)
+        _indexes.move_to_end(key)
+        while len(_indexes) > INDEX_CACHE_MAX_ENTRIES:
+            _indexes.popitem(last=False)
+    print(f"Built path index for {owner}/{repo} branch '{branch}': {len(index.paths)} files, {len(index.dir_counts)} directories.")
+    return index
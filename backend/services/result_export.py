@@ -0,0 +1,143 @@
+import json
+import os
+import tempfile
+import threading
+from pathlib import Path
+
+# Import the loaded config for the results location
+try:
+    from config import CONFIG
+except ImportError:
+    print("ERROR: Could not import CONFIG from config.py in result_export.py.")
+    CONFIG = {'task_store': {}}  # Fallback
+
+TASK_STORE_CONFIG = CONFIG.get('task_store', {}) or {}
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+RESULTS_DIR = Path(TASK_STORE_CONFIG.get('results_dir') or BACKEND_DIR / '.data' / 'results')
+if not RESULTS_DIR.is_absolute():
+    RESULTS_DIR = BACKEND_DIR / RESULTS_DIR
+# Also write a Parquet copy when a per-file task finishes (needs pyarrow)
+PARQUET_EXPORT = bool(TASK_STORE_CONFIG.get('parquet_export', False))
+# Rows per Parquet row group; bounds memory while converting
+PARQUET_BATCH_ROWS = 1000
+
+# Parquet columns taken from each result (usage fields are flattened)
+PARQUET_COLUMNS = (
+    ('index', 'int64'), ('path', 'string'), ('response', 'string'), ('error', 'string'), ('cached', 'bool_'),
+    ('carried_over', 'bool_'), ('blob_sha', 'string'), ('duplicate_of', 'string'), ('prompt_tokens', 'int64'), ('completion_tokens', 'int64'),
+    ('total_tokens', 'int64'), ('cost', 'float64'),
+)
+
+
+class ParquetUnavailable(Exception):
+    """Raised when a Parquet export is requested but pyarrow is not installed."""
+
+
+def _safe_task_id(task_id):
+    # Task ids are uuid4 strings; refuse anything that could escape RESULTS_DIR
+    if not task_id or not all(c.isalnum() or c == '-' for c in task_id):
+        raise ValueError(f'Invalid task id "{task_id}".')
+    return task_id
+
+
+def ndjson_path(task_id):
+    return RESULTS_DIR / f'{_safe_task_id(task_id)}.ndjson'
+
+
+def parquet_path(task_id):
+    return RESULTS_DIR / f'{_safe_task_id(task_id)}.parquet'
+
+
+class ResultWriter:
+    """
+    Appends a task's per-file results to its NDJSON file, one JSON object per line, in
+    completion order (each carries its scope 'index'). Lines are flushed as they are
+    written, so the file can be downloaded while the task runs. Thread-safe.
+    Opening a writer starts the file afresh; a resumed task writes its stored results first.
+    """
+
+    def __init__(self, task_id):
+        self.task_id = task_id
+        self.path = ndjson_path(task_id)
+        self.count = 0
+        self._lock = threading.Lock()
+        RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, 'w', encoding='utf-8')
+
+    def write(self, result):
+        line = json.dumps(result, ensure_ascii=False) + '\n'
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            self.count += 1
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+
+def iter_results(task_id, offset=0, limit=None):
+    """
+    Yields (next_offset, raw_json_line) from a task's NDJSON file without loading it whole,
+    starting at byte offset `offset` (0, or a next_offset from an earlier call), so each
+    page costs only its own lines. Stops before a line still being written.
+    Raises ValueError if offset isn't at the start of a line.
+    """
+    path = ndjson_path(task_id)
+    if not path.exists():
+        return
+    with open(path, 'rb') as f:
+        if offset:
+            f.seek(offset - 1)
+            if f.read(1) != b'\n':
+                raise ValueError(f'Invalid cursor {offset}: not at the start of a result.')
+        count = 0
+        while limit is None or count < limit:
+            line = f.readline()
+            if not line.endswith(b'\n'):  # End of file, or a line still being written
+                return
+            count += 1
+            yield f.tell(), line.decode('utf-8')
+
+
+def _parquet_row(result):
+    usage = result.get('usage') or {}
+    row = {name: result.get(name) for name, _ in PARQUET_COLUMNS}
+    for key in ('prompt_tokens', 'completion_tokens', 'total_tokens', 'cost'):
+        row[key] = usage.get(key)
+    return row
+
+
+def export_parquet(task_id):
+    """
+    Converts a task's NDJSON results to Parquet in PARQUET_BATCH_ROWS row groups.
+    Returns the Parquet path. Raises ParquetUnavailable without pyarrow.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ParquetUnavailable('Parquet export requires pyarrow (uv sync --extra parquet).')
+
+    schema = pa.schema([(name, getattr(pa, type_name)()) for name, type_name in PARQUET_COLUMNS])
+    path = parquet_path(task_id)
+    # Unique per export, so concurrent exports of one task (task end, downloads) don't share a file
+    with tempfile.NamedTemporaryFile(dir=RESULTS_DIR, prefix=f'{task_id}.', suffix='.parquet.tmp', delete=False) as tmp:
+        tmp_path = tmp.name
+    try:
+        with pq.ParquetWriter(tmp_path, schema) as writer:
+            batch = []
+            for _, line in iter_results(task_id):
+                batch.append(_parquet_row(json.loads(line)))
+                if len(batch) >= PARQUET_BATCH_ROWS:
+                    writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+                    batch = []
+            if batch:
+                writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    print(f"Exported results of task {task_id} to {path}.")
+    return path
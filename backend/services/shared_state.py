@@ -0,0 +1,183 @@
+import os
+import socket
+import threading
+import time
+import uuid
+
+# Import the loaded config for the backend selection
+try:
+    from config import CONFIG, ConfigurationError
+except ImportError:
+    print("ERROR: Could not import CONFIG from config.py in shared_state.py.")
+    CONFIG = {'shared_state': {}}  # Fallback
+
+    class ConfigurationError(Exception):
+        pass
+
+SHARED_STATE_CONFIG = CONFIG.get('shared_state', {}) or {}
+SHARED_STATE_BACKEND = str(SHARED_STATE_CONFIG.get('backend', 'memory')).lower()
+REDIS_URL = SHARED_STATE_CONFIG.get('redis_url') or os.environ.get('REDIS_URL')
+KEY_PREFIX = SHARED_STATE_CONFIG.get('key_prefix', 'content-aissistant:')
+CANCEL_TTL_SECONDS = int(SHARED_STATE_CONFIG.get('cancel_ttl_seconds', 86400))
+# A worker refreshes ownership of its running tasks every OWNER_TTL_SECONDS / 3;
+# a task whose owner key expired belongs to a dead worker
+OWNER_TTL_SECONDS = int(SHARED_STATE_CONFIG.get('owner_ttl_seconds', 30))
+
+# Identifies this process among all workers sharing the state
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+_state = None
+_state_lock = threading.Lock()
+_claimed_tasks = set()
+_claimed_lock = threading.Lock()
+_heartbeat_started = False
+
+
+class InProcessState:
+    """Shared state for a single worker process (the default)."""
+    name = 'memory'
+    message_queue = None  # Socket.IO rooms stay in-process
+
+    def __init__(self):
+        self._values = {}  # key -> (value, expires_at or None)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._values.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._values[key]
+                return None
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._values[key] = (value, time.monotonic() + ttl if ttl else None)
+
+    def delete(self, key):
+        with self._lock:
+            self._values.pop(key, None)
+
+
+class RedisState:
+    """
+    Shared state in Redis (or anything speaking its protocol), so several workers
+    behind a load balancer see the same cancellation flags and task owners. The same
+    URL is used as the Socket.IO message queue so room emits reach every worker.
+    """
+    name = 'redis'
+
+    def __init__(self, url):
+        try:
+            import redis
+        except ImportError:
+            raise ConfigurationError("shared_state.backend is 'redis' but the 'redis' package is not installed (install the backend's 'redis' extra).")
+        self.message_queue = url
+        self._client = redis.Redis.from_url(url, decode_responses=True, socket_timeout=5, socket_connect_timeout=5)
+
+    def get(self, key):
+        return self._client.get(KEY_PREFIX + key)
+
+    def set(self, key, value, ttl=None):
+        self._client.set(KEY_PREFIX + key, value, ex=ttl)
+
+    def delete(self, key):
+        self._client.delete(KEY_PREFIX + key)
+
+
+def get_state():
+    """Returns the configured shared-state backend, creating it on first use."""
+    global _state
+    with _state_lock:
+        if _state is None:
+            if SHARED_STATE_BACKEND == 'redis':
+                if not REDIS_URL:
+                    raise ConfigurationError("shared_state.backend is 'redis' but no redis_url (or REDIS_URL) is set.")
+                _state = RedisState(REDIS_URL)
+            elif SHARED_STATE_BACKEND == 'memory':
+                _state = InProcessState()
+            else:
+                raise ConfigurationError(f"Unknown shared_state.backend '{SHARED_STATE_BACKEND}' (expected 'memory' or 'redis').")
+            print(f"Shared state backend: {_state.name} (worker {WORKER_ID}).")
+        return _state
+
+
+class CancellationFlags:
+    """
+    Dict-like view of the cancellation flags in the shared state, so a cancel received
+    by any worker reaches the task wherever it runs. Backend errors are logged and read
+    as "not cancelled" rather than failing the task.
+    """
+
+    def _key(self, task_id):
+        return f'cancel:{task_id}'
+
+    def get(self, task_id, default=None):
+        try:
+            return True if get_state().get(self._key(task_id)) else default
+        except ConfigurationError:
+            raise
+        except Exception as e:
+            print(f"Warning: Could not read cancellation flag for task {task_id}: {e}")
+            return default
+
+    def __getitem__(self, task_id):
+        value = self.get(task_id)
+        if value is None:
+            raise KeyError(task_id)
+        return value
+
+    def __contains__(self, task_id):
+        return self.get(task_id) is not None
+
+    def __setitem__(self, task_id, value):
+        if value:
+            get_state().set(self._key(task_id), '1', ttl=CANCEL_TTL_SECONDS)
+        else:
+            get_state().delete(self._key(task_id))
+
+    def __delitem__(self, task_id):
+        get_state().delete(self._key(task_id))
+
+    def pop(self, task_id, default=None):
+        value = self.get(task_id, default)
+        get_state().delete(self._key(task_id))
+        return value
+
+
+def _heartbeat_loop():
+    """Keeps this worker's task ownership keys alive."""
+    while True:
+        time.sleep(max(1, OWNER_TTL_SECONDS / 3))
+        with _claimed_lock:
+            task_ids = list(_claimed_tasks)
+        for task_id in task_ids:
+            try:
+                get_state().set(f'owner:{task_id}', WORKER_ID, ttl=OWNER_TTL_SECONDS)
+            except Exception as e:
+                print(f"Warning: Could not refresh ownership of task {task_id}: {e}")
+
+
+def claim_task(task_id):
+    """Records this worker as the owner of a running task."""
+    global _heartbeat_started
+    get_state().set(f'owner:{task_id}', WORKER_ID, ttl=OWNER_TTL_SECONDS)
+    with _claimed_lock:
+        _claimed_tasks.add(task_id)
+        if not _heartbeat_started:
+            _heartbeat_started = True
+            threading.Thread(target=_heartbeat_loop, name='task-owner-heartbeat', daemon=True).start()
+
+
+def release_task(task_id):
+    with _claimed_lock:
+        _claimed_tasks.discard(task_id)
+    get_state().delete(f'owner:{task_id}')
+
+
+def get_task_owner(task_id):
+    """Returns the id of the live worker running the task, or None."""
+    return get_state().get(f'owner:{task_id}')
@@ -0,0 +1,169 @@
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+# Import the loaded config for the store location
+try:
+    from config import CONFIG
+except ImportError:
+    print("ERROR: Could not import CONFIG from config.py in task_store.py.")
+    CONFIG = {'task_store': {}}  # Fallback
+
+TASK_STORE_CONFIG = CONFIG.get('task_store', {}) or {}
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+TASK_DB_PATH = Path(TASK_STORE_CONFIG.get('db_path') or BACKEND_DIR / '.data' / 'tasks.sqlite3')
+if not TASK_DB_PATH.is_absolute():
+    TASK_DB_PATH = BACKEND_DIR / TASK_DB_PATH
+
+# Statuses a task can be resumed from
+RESUMABLE_STATUSES = ('interrupted', 'cancelled', 'error')
+
+_conn = None
+_lock = threading.Lock()
+
+
+def _get_conn():
+    """Opens (and creates) the task database on first use. Caller must hold _lock."""
+    global _conn
+    if _conn is None:
+        TASK_DB_PATH.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(TASK_DB_PATH, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')  # WAL + NORMAL: durable across app crashes, cheap commits
+        conn.executescript('''
+            CREATE TABLE IF NOT EXISTS tasks (
+                task_id TEXT PRIMARY KEY,
+                params TEXT NOT NULL,
+                status TEXT NOT NULL,
+                error TEXT,
+                final_result TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS task_results (
+                task_id TEXT NOT NULL,
+                idx INTEGER NOT NULL,
+                path TEXT NOT NULL,
+                result TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (task_id, idx)
+            );
+        ''')
+        conn.commit()
+        _conn = conn
+    return _conn
+
+
+def _execute(sql, args=()):
+    with _lock:
+        conn = _get_conn()
+        cursor = conn.execute(sql, args)
+        conn.commit()
+        return cursor.rowcount
+
+
+def _query(sql, args=()):
+    with _lock:
+        return _get_conn().execute(sql, args).fetchall()
+
+
+def create_task(task_id, params):
+    """Records a new task with its (secret-free) parameters in 'queued' state."""
+    now = time.time()
+    _execute(
+        'INSERT OR REPLACE INTO tasks (task_id, params, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?)',
+        (task_id, json.dumps(params), 'queued', now, now)
+    )
+
+
+def set_status(task_id, status, error=None):
+    _execute('UPDATE tasks SET status = ?, error = ?, updated_at = ? WHERE task_id = ?', (status, error, time.time(), task_id))
+
+
+def save_result(task_id, index, result):
+    """Checkpoints one file result; committed before the caller moves on."""
+    now = time.time()
+    with _lock:
+        conn = _get_conn()
+        conn.execute(
+            'INSERT OR REPLACE INTO task_results (task_id, idx, path, result, created_at) VALUES (?, ?, ?, ?, ?)',
+            (task_id, index, result.get('path', ''), json.dumps(result), now)
+        )
+        conn.execute('UPDATE tasks SET updated_at = ? WHERE task_id = ?', (now, task_id))
+        conn.commit()
+
+
+def save_final_result(task_id, final_result):
+    """Stores the single result of a combined / map-reduce task."""
+    _execute('UPDATE tasks SET final_result = ?, updated_at = ? WHERE task_id = ?', (json.dumps(final_result), time.time(), task_id))
+
+
+def _row_to_task(row):
+    task_id, params, status, error, final_result, created_at, updated_at = row
+    return {
+        'task_id': task_id,
+        'params': json.loads(params),
+        'status': status,
+        'error': error,
+        'final_result': json.loads(final_result) if final_result else None,
+        'created_at': created_at,
+        'updated_at': updated_at,
+    }
+
+
+def get_task(task_id):
+    """Returns the task record (without per-file results), or None."""
+    rows = _query('SELECT task_id, params, status, error, final_result, created_at, updated_at FROM tasks WHERE task_id = ?', (task_id,))
+    return _row_to_task(rows[0]) if rows else None
+
+
+def get_results(task_id):
+    """Returns stored per-file results in scope order."""
+    rows = _query('SELECT result FROM task_results WHERE task_id = ? ORDER BY idx', (task_id,))
+    return [json.loads(row[0]) for row in rows]
+
+
+def find_latest_task(predicate, status='completed', exclude_task_id=None):
+    """Returns the most recent task in the given status for which predicate(params) is true, or None."""
+    rows = _query(
+        'SELECT task_id, params, status, error, final_result, created_at, updated_at FROM tasks WHERE status = ? ORDER BY updated_at DESC',
+        (status,)
+    )
+    for row in rows:
+        task = _row_to_task(row)
+        if task['task_id'] != exclude_task_id and predicate(task['params']):
+            return task
+    return None
+
+
+def count_results(task_id):
+    return _query('SELECT COUNT(*) FROM task_results WHERE task_id = ?', (task_id,))[0][0]
+
+
+def mark_interrupted_tasks(is_alive=None, min_idle_seconds=0):
+    """
+    Tasks still 'queued'/'running' without a live worker belong to a dead process. is_alive(task_id)
+    can exclude tasks another live worker is still running; min_idle_seconds skips tasks updated
+    that recently (e.g. just submitted and not claimed yet). Each task is marked by at most one
+    caller, even with several workers sweeping the same store. Returns the marked ids.
+    """
+    rows = _query("SELECT task_id FROM tasks WHERE status IN ('queued', 'running') AND updated_at <= ?", (time.time() - min_idle_seconds,))
+    task_ids = [row[0] for row in rows if not (is_alive and is_alive(row[0]))]
+    marked = []
+    if task_ids:
+        now = time.time()
+        with _lock:
+            conn = _get_conn()
+            for task_id in task_ids:
+                # Conditional, so a task that just finished or was claimed again isn't overwritten
+                cursor = conn.execute(
+                    "UPDATE tasks SET status = 'interrupted', updated_at = ? WHERE task_id = ? AND status IN ('queued', 'running')", (now, task_id)
+                )
+                if cursor.rowcount:
+                    marked.append(task_id)
+            conn.commit()
+    if marked:
+        print(f"Marked {len(marked)} unfinished task(s) as interrupted: {marked}")
+    return marked
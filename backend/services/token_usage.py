@@ -0,0 +1,216 @@
+import threading
+
+# Import the loaded config for tokenizer and output estimates
+try:
+    from config import CONFIG
+except ImportError:
+    print("ERROR: Could not import CONFIG from config.py in token_usage.py.")
+    CONFIG = {'usage': {}}  # Fallback
+
+USAGE_CONFIG = CONFIG.get('usage', {}) or {}
+# 'auto' counts with tiktoken when it is installed, 'estimate' always uses the chars-per-token ratio
+TOKENIZER = USAGE_CONFIG.get('tokenizer', 'auto')
+# Fallback tiktoken encoding for models tiktoken doesn't know (non-OpenAI models are approximations either way)
+DEFAULT_ENCODING = USAGE_CONFIG.get('default_encoding', 'cl100k_base')
+# Output tokens assumed per call when estimating a task before it runs
+DEFAULT_OUTPUT_TOKENS_ESTIMATE = int(USAGE_CONFIG.get('default_output_tokens', 512))
+# Rough chars-per-token ratio used when no tokenizer is available
+CHARS_PER_TOKEN = 4
+# Per-message overhead of the chat format (role, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+_TOKEN_KEYS = ('prompt_tokens', 'completion_tokens', 'total_tokens')
+
+_encodings = {}
+_encodings_lock = threading.Lock()
+
+
+class BudgetExhausted(Exception):
+    """Raised instead of starting an LLM call that the task's token or cost budget can't cover."""
+
+
+def _get_encoding(model_id=None):
+    """Returns a tiktoken encoding for model_id, or None to fall back to the char estimate."""
+    if TOKENIZER != 'auto':
+        return None
+    key = model_id or ''
+    with _encodings_lock:
+        if key in _encodings:
+            return _encodings[key]
+        encoding = None
+        try:
+            import tiktoken
+            try:
+                encoding = tiktoken.encoding_for_model(model_id) if model_id else tiktoken.get_encoding(DEFAULT_ENCODING)
+            except KeyError:
+                encoding = tiktoken.get_encoding(DEFAULT_ENCODING)
+        except ImportError:
+            pass  # Optional dependency; estimates are used instead
+        except Exception as e:
+            # e.g. the encoding file could not be downloaded
+            print(f"Warning: Could not load tiktoken encoding for '{model_id}', estimating tokens instead: {e}")
+        _encodings[key] = encoding
+        return encoding
+
+
+def tokenizer_name(model_id=None):
+    """Names the counting method used for model_id, for reporting alongside estimates."""
+    encoding = _get_encoding(model_id)
+    return f'tiktoken:{encoding.name}' if encoding else f'estimate:{CHARS_PER_TOKEN}_chars_per_token'
+
+
+def count_tokens(text, model_id=None):
+    """Counts the tokens in text with tiktoken when available, else estimates from its length."""
+    if not text:
+        return 0
+    encoding = _get_encoding(model_id)
+    if encoding:
+        return len(encoding.encode(text, disallowed_special=()))
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def count_message_tokens(prompt_messages, model_id=None):
+    """Counts the prompt tokens of a list of OpenAI-style messages."""
+    return sum(count_tokens(str(msg.get('content', '')), model_id) + MESSAGE_OVERHEAD_TOKENS for msg in prompt_messages)
+
+
+def truncate_to_tokens(text, max_tokens, model_id=None):
+    """Returns the longest prefix of text that fits in max_tokens."""
+    max_tokens = max(0, int(max_tokens))
+    encoding = _get_encoding(model_id)
+    if not encoding:
+        return text[:max_tokens * CHARS_PER_TOKEN]
+    if len(text) <= max_tokens:
+        return text  # Every token is at least one character
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens])
+
+
+def make_usage(prompt_tokens, completion_tokens, estimated=False):
+    """Builds a usage dict in the shape reported with results and tasks."""
+    prompt_tokens, completion_tokens = int(prompt_tokens or 0), int(completion_tokens or 0)
+    return {
+        'prompt_tokens': prompt_tokens,
+        'completion_tokens': completion_tokens,
+        'total_tokens': prompt_tokens + completion_tokens,
+        'estimated': estimated,
+    }
+
+
+def usage_from_response(usage):
+    """
+    Normalises a provider usage object (OpenAI prompt/completion_tokens, Anthropic
+    input/output_tokens, Google *_token_count) into make_usage() form, or None if absent.
+    """
+    if usage is None:
+        return None
+    for prompt_attr, completion_attr in (('prompt_tokens', 'completion_tokens'), ('input_tokens', 'output_tokens'),
+                                         ('prompt_token_count', 'candidates_token_count')):
+        prompt_tokens = getattr(usage, prompt_attr, None)
+        if prompt_tokens is not None:
+            return make_usage(prompt_tokens, getattr(usage, completion_attr, 0))
+    return None
+
+
+def estimate_usage(prompt_messages, response_text, model_id=None):
+    """Usage counted locally, for providers/streams that don't report it."""
+    return make_usage(count_message_tokens(prompt_messages, model_id), count_tokens(response_text, model_id), estimated=True)
+
+
+def get_pricing(provider_config, model_id):
+    """
+    Returns the effective {'input_per_mtok', 'output_per_mtok'} (USD per million tokens)
+    for a model: a model's own pricing overrides the provider's. None if not configured.
+    """
+    pricing = dict(provider_config.get('pricing') or {})
+    model_config = next((m for m in provider_config.get('models', []) if m.get('id') == model_id), {})
+    pricing.update(model_config.get('pricing') or {})
+    if pricing.get('input_per_mtok') is None and pricing.get('output_per_mtok') is None:
+        return None
+    return {'input_per_mtok': float(pricing.get('input_per_mtok') or 0), 'output_per_mtok': float(pricing.get('output_per_mtok') or 0)}
+
+
+def usage_cost(usage, pricing):
+    """USD cost of a usage dict under pricing, or None without pricing."""
+    if not pricing:
+        return None
+    return round((usage['prompt_tokens'] * pricing['input_per_mtok'] + usage['completion_tokens'] * pricing['output_per_mtok']) / 1_000_000, 6)
+
+
+class UsageTracker:
+    """
+    Accumulates one task's usage and enforces its optional token and cost budgets
+    (None or 0 = unlimited). Thread-safe; shared by a task's worker threads.
+    """
+
+    def __init__(self, pricing=None, token_budget=None, cost_budget=None):
+        self.pricing = pricing
+        self.token_budget = token_budget or None
+        self.cost_budget = cost_budget or None
+        self._lock = threading.Lock()
+        self._refused = False  # Set once a call was refused, so the task stops starting new ones
+        self._totals = {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0, 'calls': 0, 'estimated_calls': 0}
+        self._reserved = make_usage(0, 0)  # Held by calls that passed check() and haven't been added yet
+
+    def add(self, usage, reservation=None):
+        """
+        Records one call's usage, settling the reservation check() made for it.
+        Returns the usage with its cost added (when pricing is known).
+        """
+        usage = {**usage, 'cost': usage_cost(usage, self.pricing)}
+        with self._lock:
+            for key in _TOKEN_KEYS:
+                self._totals[key] += usage[key]
+                if reservation:
+                    self._reserved[key] -= reservation[key]
+            self._totals['calls'] += 1
+            if usage.get('estimated'):
+                self._totals['estimated_calls'] += 1
+        return usage
+
+    def release(self, reservation):
+        """Drops the reservation of a call that failed before reporting usage."""
+        with self._lock:
+            for key in _TOKEN_KEYS:
+                self._reserved[key] -= reservation[key]
+
+    def totals(self):
+        """Usage so far, with cost and the budgets it is measured against."""
+        with self._lock:
+            totals = dict(self._totals)
+        totals['cost'] = usage_cost(totals, self.pricing)
+        totals['token_budget'] = self.token_budget
+        totals['cost_budget'] = self.cost_budget
+        return totals
+
+    def exhausted(self):
+        """True once either budget is used up or a call has been refused."""
+        if self._refused:
+            return True
+        totals = self.totals()
+        if self.token_budget and totals['total_tokens'] >= self.token_budget:
+            return True
+        return bool(self.cost_budget and totals['cost'] is not None and totals['cost'] >= self.cost_budget)
+
+    def check(self, prompt_tokens):
+        """
+        Reserves a call's prompt tokens plus DEFAULT_OUTPUT_TOKENS_ESTIMATE against the budgets,
+        so concurrent calls can't all spend the same headroom. Returns the reservation for
+        add() (or release()). Raises BudgetExhausted if the call can't be afforded.
+        """
+        reservation = make_usage(prompt_tokens, DEFAULT_OUTPUT_TOKENS_ESTIMATE, estimated=True)
+        with self._lock:
+            committed = {key: self._totals[key] + self._reserved[key] for key in _TOKEN_KEYS}
+            if self.token_budget and committed['total_tokens'] + reservation['total_tokens'] > self.token_budget:
+                self._refused = True
+                raise BudgetExhausted(f"Token budget exhausted ({committed['total_tokens']}/{self.token_budget} tokens used or reserved, "
+                                      f"next call needs ~{reservation['total_tokens']}).")
+            committed_cost = usage_cost(committed, self.pricing)
+            if self.cost_budget and committed_cost is not None and committed_cost + usage_cost(reservation, self.pricing) > self.cost_budget:
+                self._refused = True
+                raise BudgetExhausted(f"Cost budget exhausted (${committed_cost:.4f}/${self.cost_budget:.4f} spent or reserved).")
+            for key in _TOKEN_KEYS:
+                self._reserved[key] += reservation[key]
+        return reservation
\ No newline at end of file
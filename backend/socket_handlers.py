@@ -1,7 +1,7 @@
 from flask import request
 from flask_socketio import emit, join_room, leave_room
 
-# Import the shared cancelled_tasks dictionary and socketio instance
+# Import the shared cancelled_tasks mapping (backed by the shared-state backend) and socketio instance
 # This assumes main.py initializes socketio before this module is imported
 try:
     # Use absolute imports relative to backend root
@@ -52,7 +52,7 @@ def register_socketio_handlers(socketio):
         task_id = data.get('task_id')
         if task_id:
             print(f'Received cancel request for task_id: {task_id} from {request.sid}')
-            # Use the imported dictionary
+            # Visible to the task on whichever worker runs it
             cancelled_tasks[task_id] = True
             emit('task_cancelled_ack', {'task_id': task_id}, room=request.sid)  # Acknowledge cancellation request
         else:
@@ -43,6 +43,7 @@ export default function Home() {
      progress,
      availableFiles, // Changed from filteredFiles
      selectedFiles,  // Added
+     totalFiles, hasMoreFiles, isLoadingMoreFiles, loadMoreFiles,
       handleScopeToggle,
       handleSelectAllFiltered,
       handleClearScope, // Add handleClearScope here
@@ -93,6 +94,8 @@ export default function Home() {
                   error={error} // Pass general file loading error
                   availableFiles={availableFiles} // Pass the available list
                   selectedFiles={selectedFiles}   // Pass the selected list
+                  totalFiles={totalFiles} hasMoreFiles={hasMoreFiles}
+                  isLoadingMoreFiles={isLoadingMoreFiles} loadMoreFiles={loadMoreFiles}
                   searchTerm={searchTerm} setSearchTerm={setSearchTerm}
                  isCaseSensitive={isCaseSensitive} setIsCaseSensitive={setIsCaseSensitive}
                  filterMode={filterMode} setFilterMode={setFilterMode} // Pass filter mode props
@@ -124,6 +127,21 @@ export default function Home() {
                        Combined Context (Analyze selected files together)
                      </label>
                    </div>
+                   {/* Map-Reduce */}
+                   <div className="flex items-center">
+                     <input
+                       id="mode-map-reduce"
+                       name="analysisMode"
+                       type="radio"
+                       value="map_reduce"
+                       checked={analysisMode === 'map_reduce'}
+                       onChange={(e) => setAnalysisMode(e.target.value)}
+                       className="h-4 w-4 text-indigo-600 border-gray-300 focus:ring-indigo-500"
+                     />
+                     <label htmlFor="mode-map-reduce" className="ml-2 block text-sm text-gray-900">
+                       Map-Reduce (Summarize large selections in stages, nothing truncated)
+                     </label>
+                   </div>
                    {/* Iterative */}
                    <div className="flex items-center">
                      <input
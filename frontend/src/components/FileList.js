@@ -8,6 +8,10 @@ const FileList = ({
   error,
   availableFiles, // Changed from filteredFiles
   selectedFiles,  // Added
+  totalFiles, // Files matching the filter, loaded or not
+  hasMoreFiles,
+  isLoadingMoreFiles,
+  loadMoreFiles, // Fetches the next page of the filtered list
   searchTerm,
   setSearchTerm,
   isCaseSensitive,
@@ -58,6 +62,10 @@ const FileList = ({
         childrenAvailableCol={filterControlsElement} // Pass filters as prop
         availableFiles={availableFiles} // Pass down available files
         selectedFiles={selectedFiles}   // Pass down selected files
+        totalFiles={totalFiles}
+        hasMoreFiles={hasMoreFiles}
+        isLoadingMoreFiles={isLoadingMoreFiles}
+        loadMoreFiles={loadMoreFiles}
         selectedScope={selectedScope}
         handleScopeToggle={handleScopeToggle}
         isLoadingFiles={isLoadingFiles}
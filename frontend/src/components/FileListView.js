@@ -3,6 +3,10 @@ import React from 'react';
 const FileListView = ({
   availableFiles, // Changed from filteredFiles
   selectedFiles,  // Added
+  totalFiles, // Files matching the filter, loaded or not
+  hasMoreFiles, // More pages of the filtered list on the server
+  isLoadingMoreFiles,
+  loadMoreFiles,
   selectedScope,
   handleScopeToggle,
   isLoadingFiles,
@@ -27,14 +31,16 @@ const FileListView = ({
       {/* Title Row with inline buttons - Moved to top */}
       <div className="flex justify-between items-center mb-2 px-1">
         <h4 className="text-sm font-semibold text-gray-700">
-          {listType === 'available' ? `Available (${availableFiles.length})` : `Selected (${selectedFiles.length})`}
+          {listType === 'available'
+            ? `Available (${availableFiles.length}${hasMoreFiles ? ` shown, ${totalFiles} matching` : ''})`
+            : `Selected (${selectedFiles.length})`}
         </h4>
         {listType === 'available' && (
           <button
             onClick={handleSelectAllFiltered}
-            title="Add all available files shown to selection"
+            title="Add all files matching the filter to selection"
             className="px-2 py-0.5 border border-gray-300 rounded text-xs hover:bg-gray-100 disabled:opacity-50"
-            disabled={isLoadingFiles || availableFiles.length === 0}
+            disabled={isLoadingFiles || (availableFiles.length === 0 && !hasMoreFiles)}
           >
             Select All
           </button>
@@ -68,13 +74,22 @@ const FileListView = ({
               {file.path}
             </div>
           ))
-        ) : (
+        ) : hasMoreFiles && listType === 'available' ? null : (
           <p className="text-xs text-gray-400 italic px-1 pt-1"> {/* Added padding top */}
             {listType === 'available'
               ? (searchTerm ? 'No files match filter' : (availableFiles.length === 0 && selectedFiles.length > 0 ? 'All matching files selected' : 'No files found')) // Adjusted logic
               : 'No files selected'}
           </p>
         )}
+        {listType === 'available' && hasMoreFiles && (
+          <button
+            onClick={loadMoreFiles}
+            className="w-full mt-1 text-xs text-indigo-600 hover:text-indigo-800 disabled:opacity-50"
+            disabled={isLoadingMoreFiles}
+          >
+            {isLoadingMoreFiles ? 'Loading...' : 'Load more'}
+          </button>
+        )}
       </div>
       {/* Removed rendering of children prop below the list */}
     </div>
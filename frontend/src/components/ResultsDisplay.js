@@ -46,6 +46,16 @@ const ResultsDisplay = ({ analysisResults, progress, isLoadingAnalysis }) => {
               <p className="font-medium text-gray-900">Combined Context Response:</p>
               {/* Display message from the combined result object if available */}
               {analysisResults[0].message && <p className="text-sm text-gray-600 mb-2">{analysisResults[0].message}</p>}
+              {/* Files that didn't fit the prompt budget (combined mode) */}
+              {analysisResults[0].partial_files && analysisResults[0].partial_files.length > 0 && (
+                <p className="text-xs text-amber-700">Truncated: {analysisResults[0].partial_files.join(', ')}</p>
+              )}
+              {analysisResults[0].skipped_files && analysisResults[0].skipped_files.length > 0 && (
+                <details className="text-xs text-amber-700 mb-2">
+                  <summary>Skipped {analysisResults[0].skipped_files.length} file(s) (prompt budget full)</summary>
+                  <p>{analysisResults[0].skipped_files.join(', ')}</p>
+                </details>
+              )}
               {analysisResults[0].error ? (
                 <p className="mt-1 text-sm text-red-600">Error: {analysisResults[0].error}</p>
               ) : (
@@ -61,6 +71,10 @@ const ResultsDisplay = ({ analysisResults, progress, isLoadingAnalysis }) => {
                 // Assuming each item has at least 'path', and either 'response' or 'error'
                 <li key={result.path || index} className="p-4 border border-gray-200 rounded-md bg-gray-50">
                   <p className="font-medium text-gray-900">{result.path || `Result ${index + 1}`}</p>
+                  {/* Duplicates reuse the answer generated for the original path, which the answer may name */}
+                  {result.duplicate_of && (
+                    <p className="text-xs text-amber-700">Same content as {result.duplicate_of}; this answer was generated for {result.duplicate_of}.</p>
+                  )}
                   {result.error ? (
                     <p className="mt-1 text-sm text-red-600">{formatError(result.error)}</p>
                   ) : (
@@ -132,28 +132,68 @@ export function useAnalysisExecution(
       });
 
       // --- Task-Specific Event Handlers ---
-      socket.on('progress_update', (data) => {
+      const handleProgressUpdate = (data) => {
         if (data.message) {
           setProgress(prev => ({ ...prev, message: data.message }));
         } else if (data.current_file) {
           const percent = data.total_files > 0 ? Math.round(((data.current_index + 1) / data.total_files) * 100) : 0;
+          // Files sharing a blob with an analysed file reuse its result
+          const dedupNote = data.duplicate_files ? ` (${data.duplicate_files} duplicates reused, ${Math.round(data.dedup_ratio * 100)}% fewer LLM calls)` : '';
           setProgress(prev => ({
             ...prev,
-            message: `Processing: ${data.current_file}`,
+            message: `Processing: ${data.current_file}${dedupNote}`,
             percentage: percent,
             current: data.current_index + 1,
             total: data.total_files
           }));
         }
-      });
+      };
+
+      const handlePartialToken = (data) => {
+        if (data.path === undefined) {
+          // Combined mode: stream into a single provisional combined result
+          setAnalysisResults(prev => [{
+            message: 'Receiving response...',
+            combined_response: ((prev[0] && prev[0].streaming && prev[0].combined_response) || '') + data.token,
+            streaming: true
+          }]);
+        } else {
+          // Iterative mode: grow the provisional entry for this file until its partial_result arrives
+          setAnalysisResults(prev => {
+            const i = prev.findIndex(r => r.streaming && r.index === data.index);
+            if (i === -1) return [...prev, { path: data.path, index: data.index, response: data.token, streaming: true }];
+            const next = [...prev];
+            next[i] = { ...next[i], response: next[i].response + data.token };
+            return next;
+          });
+        }
+      };
 
-      socket.on('partial_result', (data) => {
-        setAnalysisResults(prev => [...prev, data]);
+      const handlePartialResult = (data) => {
+        // Replace the streamed provisional entry if there is one, otherwise append
+        setAnalysisResults(prev => {
+          const i = prev.findIndex(r => r.streaming && r.index === data.index);
+          if (i === -1) return [...prev, data];
+          const next = [...prev];
+          next[i] = data;
+          return next;
+        });
         if (data.error) {
           setProgress(prev => ({ ...prev, errorCount: prev.errorCount + 1 }));
         } else {
           setProgress(prev => ({ ...prev, successCount: prev.successCount + 1 }));
         }
+      };
+
+      socket.on('progress_update', handleProgressUpdate);
+      socket.on('partial_token', handlePartialToken);
+      socket.on('partial_result', handlePartialResult);
+
+      // The backend coalesces progress, tokens and results into periodic batches
+      socket.on('event_batch', (batch) => {
+        (batch.tokens || []).forEach(handlePartialToken);
+        (batch.results || []).forEach(handlePartialResult);
+        if (batch.progress) handleProgressUpdate(batch.progress);
       });
 
       socket.on('final_result', (data) => {
@@ -178,9 +218,16 @@ export function useAnalysisExecution(
               let finalMessage = 'Analysis complete.';
               if (data.status === 'cancelled') {
                 finalMessage = 'Analysis cancelled.';
+              } else if (data.status === 'budget_exceeded') {
+                finalMessage = 'Analysis stopped: token/cost budget exhausted.';
               } else if (hasErrors) {
                 finalMessage = 'Analysis complete with errors.';
               }
+              if (data.usage && data.usage.total_tokens) {
+                finalMessage += ` ${data.usage.total_tokens.toLocaleString()} tokens used`;
+                if (data.usage.cost != null) finalMessage += ` (~$${data.usage.cost.toFixed(4)})`;
+                finalMessage += '.';
+              }
               setProgress(prev => ({ ...prev, message: finalMessage, percentage: 100 }));
               return prevResults;
             });
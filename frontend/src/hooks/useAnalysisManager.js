@@ -30,7 +30,9 @@ export function useAnalysisManager() {
     availableFiles, // Changed from filteredFiles
     selectedFiles,  // Added
     selectedScope,
+    totalFiles, hasMoreFiles, // Paginated file list
     isLoadingFiles,
+    isLoadingMoreFiles,
     error: fileError, // Rename to avoid conflict with configError
     searchTerm, setSearchTerm,
     isCaseSensitive, setIsCaseSensitive,
@@ -39,6 +41,7 @@ export function useAnalysisManager() {
     handleScopeToggle,
     handleSelectAllFiltered,
     handleClearScope,
+    loadMoreFiles,
   } = useFileManagement(
     owner,
     repo,
@@ -88,6 +91,7 @@ export function useAnalysisManager() {
     availableFiles, // Changed from filteredFiles
     selectedFiles,  // Added
     selectedScope, // Needed for FileList -> FileListView and handleAnalyze
+    totalFiles, hasMoreFiles, isLoadingMoreFiles, loadMoreFiles, // Needed for FileList -> FileListView (pagination)
     isLoadingFiles, // Needed for RepoConfig, FileList -> FileListView
     error: fileError, // Pass file fetching error
     searchTerm, setSearchTerm, // Needed for FileList -> FileFilterControls
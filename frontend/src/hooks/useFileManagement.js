@@ -1,12 +1,26 @@
-import { useState, useEffect, useCallback } from 'react';
+import { useState, useEffect, useCallback, useRef } from 'react';
 import { minimatch } from 'minimatch';
 
 // Define the backend API base URL (Consider moving to a shared config/constants file)
 const API_BASE_URL = 'http://localhost:5001';
+// Paths fetched per page; the backend filters the tree and paginates, so large repos aren't downloaded whole
+const FILES_PAGE_SIZE = 500;
+
+async function fetchFilesPage(url) {
+  console.log("Fetching files with URL:", url);
+  const response = await fetch(url);
+  if (!response.ok) {
+    const errorData = await response.json().catch(() => ({ error: 'Unknown error fetching files' }));
+    throw new Error(`HTTP error! status: ${response.status} - ${errorData.error}`);
+  }
+  return response.json();
+}
 
 export function useFileManagement(owner, repo, branch, defaultFileFilters, isReadyToLoad) {
   // File Tree and Selection State
-  const [fileTree, setFileTree] = useState([]); // The raw list from the API
+  const [fileTree, setFileTree] = useState([]); // Loaded pages of paths matching the current filter
+  const [nextCursor, setNextCursor] = useState(null); // Cursor of the next page, null when everything is loaded
+  const [totalFiles, setTotalFiles] = useState(0); // Paths matching the current filter, loaded or not
   const [selectedScope, setSelectedScope] = useState([]); // Array of selected paths
 
   // Filter State
@@ -17,6 +31,7 @@ export function useFileManagement(owner, repo, branch, defaultFileFilters, isRea
 
   // Loading and Error State
   const [isLoadingFiles, setIsLoadingFiles] = useState(false);
+  const [isLoadingMoreFiles, setIsLoadingMoreFiles] = useState(false);
   const [error, setError] = useState(null);
 
   // Update fileFilters if the default changes after initial load
@@ -24,72 +39,83 @@ export function useFileManagement(owner, repo, branch, defaultFileFilters, isRea
     setFileFilters(defaultFileFilters);
   }, [defaultFileFilters]);
 
-  // --- File Tree Fetch ---
+  // The /api/files query for the current repo, extensions and search filter (without pagination)
+  const filesQuery = (() => {
+    const extensionsParam = fileFilters.map(ext => ext.startsWith('.') ? ext.substring(1) : ext).join(',');
+    const params = new URLSearchParams({ owner, repo, branch, extensions: extensionsParam, case_sensitive: isCaseSensitive ? 'true' : 'false' });
+    const term = searchTerm.trim();
+    if (term) params.set(filterMode === 'contains' ? 'contains' : 'prefix', term);
+    return `${API_BASE_URL}/api/files?${params.toString()}`;
+  })();
+  const repoKey = `${owner}/${repo}@${branch}:${fileFilters.join(',')}`;
+  const loadedRepoKey = useRef(null); // Repo whose files are shown; a new repo clears the selection
+  const currentQuery = useRef(filesQuery); // Guards against pages arriving for a stale filter
+  currentQuery.current = filesQuery;
+
+  // --- File Tree Fetch (first page; refetched when the repo or the search filter changes) ---
   useEffect(() => {
     // Define conditions for fetching: config loaded, provider OK, repo details present
     const shouldFetchFiles = isReadyToLoad && owner && repo && branch;
 
     if (!shouldFetchFiles) {
       // Clear file tree if conditions aren't met
-      setFileTree([]);
+      setFileTree([]); setNextCursor(null); setTotalFiles(0);
       setSelectedScope([]); // Also clear scope when repo changes
       setError(null);
+      loadedRepoKey.current = null;
       return; // Exit effect if not ready to fetch
     }
 
     // Debounced fetch function
+    let cancelled = false;
     const fetchFiles = async () => {
       console.log("Attempting to fetch files...");
-      setIsLoadingFiles(true); setError(null); setFileTree([]); setSelectedScope([]); // Reset state
+      const isNewRepo = loadedRepoKey.current !== repoKey;
+      if (isNewRepo) {
+        // Only a new repo shows the loading state; a search refetch keeps the list (and the search box) in place
+        setIsLoadingFiles(true); setFileTree([]); setSelectedScope([]);
+      }
+      setError(null);
       try {
-        const extensionsParam = fileFilters.map(ext => ext.startsWith('.') ? ext.substring(1) : ext).join(',');
-        const url = `${API_BASE_URL}/api/files?owner=${encodeURIComponent(owner)}&repo=${encodeURIComponent(repo)}&branch=${encodeURIComponent(branch)}&extensions=${encodeURIComponent(extensionsParam)}`;
-        console.log("Fetching files with URL:", url);
-        const response = await fetch(url);
-        if (!response.ok) {
-          const errorData = await response.json().catch(() => ({ error: 'Unknown error fetching files' }));
-          throw new Error(`HTTP error! status: ${response.status} - ${errorData.error}`);
-        }
-        const data = await response.json();
+        const data = await fetchFilesPage(`${filesQuery}&limit=${FILES_PAGE_SIZE}&count=1`);
+        if (cancelled) return;
+        loadedRepoKey.current = repoKey;
         setFileTree(data.files || []);
+        setNextCursor(data.next_cursor || null);
+        setTotalFiles(data.total ?? (data.files || []).length);
       } catch (e) {
-        console.error("Error fetching file tree:", e); setError(`Failed to fetch file tree: ${e.message}`); setFileTree([]);
-      } finally { setIsLoadingFiles(false); }
+        if (cancelled) return;
+        console.error("Error fetching file tree:", e); setError(`Failed to fetch file tree: ${e.message}`); setFileTree([]); setNextCursor(null);
+      } finally { if (!cancelled) setIsLoadingFiles(false); }
     };
 
     const timerId = setTimeout(fetchFiles, 300);
-    return () => clearTimeout(timerId);
-
-  }, [isReadyToLoad, owner, repo, branch, fileFilters]); // Depend on readiness and config details
+    return () => { cancelled = true; clearTimeout(timerId); };
+
+  }, [isReadyToLoad, owner, repo, branch, repoKey, filesQuery]); // Depend on readiness, repo details and the filter
+
+  // Appends the next page of the current filter
+  const loadMoreFiles = useCallback(async () => {
+    if (!nextCursor || isLoadingMoreFiles) return;
+    const query = filesQuery;
+    setIsLoadingMoreFiles(true);
+    try {
+      const data = await fetchFilesPage(`${query}&limit=${FILES_PAGE_SIZE}&cursor=${encodeURIComponent(nextCursor)}`);
+      if (currentQuery.current !== query) return; // The filter changed meanwhile
+      setFileTree(prev => [...prev, ...(data.files || [])]);
+      setNextCursor(data.next_cursor || null);
+    } catch (e) {
+      console.error("Error fetching more files:", e); setError(`Failed to fetch file tree: ${e.message}`);
+    } finally { setIsLoadingMoreFiles(false); }
+  }, [filesQuery, nextCursor, isLoadingMoreFiles]);
 
   // --- File List Calculations (Available vs Selected) ---
 
-  // Calculate Selected Files (only based on selectedScope, ignores searchTerm)
-  const selectedFiles = fileTree.filter(file => selectedScope.includes(file.path));
-
-  // Calculate Available Files (start with fileTree, remove selected, then apply searchTerm)
-  const availableFiles = fileTree
-    .filter(file => !selectedScope.includes(file.path)) // Exclude already selected files
-    .filter(file => { // Apply search term filter
-      const term = searchTerm.trim();
-      if (!term) return true; // No search term means file matches this filter
-
-      // Ignore wildcard logic for now as per previous request
-      // const hasWildcard = term.includes('*') || term.includes('?');
-      // if (hasWildcard) { ... }
-
-      const pathLower = file.path.toLowerCase();
-      const termLower = term.toLowerCase();
-      const comparisonPath = isCaseSensitive ? file.path : pathLower;
-      const comparisonTerm = isCaseSensitive ? term : termLower;
-
-      // Apply filter based on mode
-      if (filterMode === 'contains') {
-        return comparisonPath.includes(comparisonTerm);
-      } else { // Default to 'startsWith'
-        return comparisonPath.startsWith(comparisonTerm);
-      }
-    });
+  // Selected files may lie outside the loaded pages, so they come from selectedScope itself
+  const selectedFiles = selectedScope.map(path => ({ path, type: 'blob' }));
+
+  // Available files: the loaded pages (already filtered by the backend) minus the selection
+  const availableFiles = fileTree.filter(file => !selectedScope.includes(file.path));
 
 
   // --- Scope Selection Handlers ---
@@ -97,11 +123,20 @@ export function useFileManagement(owner, repo, branch, defaultFileFilters, isRea
     setSelectedScope(prev => prev.includes(filePath) ? prev.filter(p => p !== filePath) : [...prev, filePath]);
   }, []);
 
-  const handleSelectAllFiltered = useCallback(() => {
-    // Operate on the currently *available* files after filtering
-    const availablePathsToSelect = availableFiles.map(f => f.path);
-    setSelectedScope(prev => [...new Set([...prev, ...availablePathsToSelect])]);
-  }, [availableFiles, selectedScope]); // Depend on availableFiles now
+  const handleSelectAllFiltered = useCallback(async () => {
+    // Selects every file matching the filter, including pages that aren't loaded yet
+    let paths = availableFiles.map(f => f.path);
+    if (nextCursor) {
+      try {
+        const data = await fetchFilesPage(filesQuery);
+        paths = (data.files || []).map(f => f.path);
+      } catch (e) {
+        console.error("Error fetching files to select:", e); setError(`Failed to fetch file tree: ${e.message}`);
+        return;
+      }
+    }
+    setSelectedScope(prev => [...new Set([...prev, ...paths])]);
+  }, [availableFiles, nextCursor, filesQuery]);
 
   const handleClearScope = useCallback(() => {
     setSelectedScope([]);
@@ -109,7 +144,9 @@ export function useFileManagement(owner, repo, branch, defaultFileFilters, isRea
 
   return {
     // File State
-    fileTree, // Raw tree (might be useful for debugging or future features)
+    fileTree, // Loaded pages of the filtered tree (might be useful for debugging or future features)
+    totalFiles, // Files matching the filter, loaded or not
+    hasMoreFiles: Boolean(nextCursor),
     availableFiles, // Files available for selection (filtered by search)
     selectedFiles,  // Files currently selected (unaffected by search)
     selectedScope,  // Array of selected paths
@@ -122,11 +159,13 @@ export function useFileManagement(owner, repo, branch, defaultFileFilters, isRea
 
     // Loading & Error State
     isLoadingFiles,
+    isLoadingMoreFiles,
     error, // File fetching error
 
     // Scope Handlers
     handleScopeToggle,
     handleSelectAllFiltered,
     handleClearScope,
+    loadMoreFiles,
   };
 }